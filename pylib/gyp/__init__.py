@@ -4,8 +4,15 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+from __future__ import with_statement
+
 import copy
+import gyp.disk_cache
 import gyp.input
+import gyp.regeneration
+import gyp.server
+import gyp.stats
+import multiprocessing
 import optparse
 import os.path
 import re
@@ -22,6 +29,14 @@ DEBUG_GENERAL = 'general'
 DEBUG_VARIABLES = 'variables'
 DEBUG_INCLUDES = 'includes'
 
+# The caches gyp_main keeps in subdirectories of --cache-dir.
+CACHE_NAMES = ('commands', 'early', 'parsed', 'runs')
+
+# While gyp --server runs, maps each of CACHE_NAMES to the
+# gyp.disk_cache.MemoryCache it keeps between the runs it serves.  These take
+# the place of the --cache-dir caches.
+resident_caches = None
+
 
 def DebugOutput(mode, message, *args):
   if 'all' in gyp.debug or mode in gyp.debug:
@@ -124,9 +139,14 @@ def Load(build_files, format, default_variables={},
   }
 
   # Process the input specific to this generator.
-  result = gyp.input.Load(build_files, default_variables, includes[:],
-                          depth, generator_input_info, check, circular_check,
-                          params['parallel'])
+  try:
+    result = gyp.input.Load(build_files, default_variables, includes[:],
+                            depth, generator_input_info, check,
+                            circular_check, params['parallel'],
+                            params.get('parallel_jobs'))
+  finally:
+    # Prefetched commands are only needed while loading.
+    gyp.input.StopCommandPrefetcher()
   return [generator] + result
 
 def NameValueListToDict(name_value_list):
@@ -275,6 +295,67 @@ class RegeneratableOptionParser(optparse.OptionParser):
     values._regeneration_metadata = self.__regeneratable_options
     return values, args
 
+class GeneratorProcess(object):
+  """Runs a generator's GenerateOutput in a forked process.
+
+  Lets gyp_main load the build files for the next format while the files of
+  the previous one are written.
+  """
+
+  def __init__(self, format, record_outputs):
+    self.format = format
+    self.record_outputs = record_outputs
+    self.connection = None
+    self.process = None
+
+  def Start(self, generator, flat_list, targets, data, params):
+    self.connection, child_connection = multiprocessing.Pipe(False)
+    self.process = multiprocessing.Process(
+        target=self._Run,
+        args=(child_connection, generator, flat_list, targets, data, params))
+    # The child would write out whatever is buffered again when it exits.
+    sys.stdout.flush()
+    self.process.start()
+    child_connection.close()
+
+  def _Run(self, connection, generator, flat_list, targets, data, params):
+    output_recorder = gyp.regeneration.OutputRecorder()
+    if self.record_outputs:
+      output_recorder.Start()
+    gyp.input.TakeCacheCounts()
+    gyp.stats.Reset()
+    try:
+      with gyp.stats.Phase('generate %s' % self.format):
+        generator.GenerateOutput(flat_list, targets, data, params)
+      result = (None, list(output_recorder.paths),
+                gyp.input.TakeCacheCounts(), gyp.stats.Take())
+    except GypError, e:
+      result = (str(e), [], None, None)
+    except Exception:
+      result = (traceback.format_exc(), [], None, None)
+    sys.stdout.flush()
+    connection.send(result)
+    connection.close()
+
+  def Wait(self):
+    """Waits for the generator to finish and returns the paths it wrote.
+
+    Adds the generator's cache counts and statistics to this process's.
+    Raises GypError if the generator failed.
+    """
+    try:
+      error, paths, cache_counts, stats = self.connection.recv()
+    except EOFError:
+      error, paths = 'the generator process died', []
+    self.connection.close()
+    self.process.join()
+    if error:
+      raise GypError('Generating %s files failed: %s' % (self.format, error))
+    gyp.input.AddCacheCounts(cache_counts)
+    gyp.stats.Merge(stats)
+    return paths
+
+
 def gyp_main(args):
   my_name = os.path.basename(sys.argv[0])
 
@@ -283,8 +364,23 @@ def gyp_main(args):
   parser.set_usage(usage.replace('%s', '%prog'))
   parser.add_option('--build', dest='configs', action='append',
                     help='configuration for build after project generation')
+  parser.add_option('--cache-dir', dest='cache_dir', action='store',
+                    env_name='GYP_CACHE_DIR', default=None, metavar='DIR',
+                    type='path',
+                    help='keep parsed build files, build files after '
+                    'early variable expansion, and the output of commands '
+                    'with declared inputs in DIR to speed up later runs')
+  parser.add_option('--cache-size', dest='cache_size', action='store',
+                    type='int', default=None, metavar='MB',
+                    help='limit each cache kept in --cache-dir or by '
+                    '--server to MB megabytes (default %d)' %
+                    (gyp.disk_cache.DEFAULT_MAX_SIZE / (1024 * 1024)))
   parser.add_option('--check', dest='check', action='store_true',
                     help='check format of gyp files')
+  parser.add_option('--command-jobs', dest='command_jobs', action='store',
+                    type='int', env_name='GYP_COMMAND_JOBS', default=None,
+                    metavar='N', regenerate=False,
+                    help='run up to N <!() commands at once (default 1)')
   parser.add_option('--config-dir', dest='config_dir', action='store',
                     env_name='GYP_CONFIG_DIR', default=None,
                     help='The location for configuration files like '
@@ -301,6 +397,10 @@ def gyp_main(args):
   parser.add_option('-f', '--format', dest='formats', action='append',
                     env_name='GYP_GENERATORS', regenerate=False,
                     help='output formats to generate')
+  parser.add_option('--force-regenerate', dest='force_regenerate',
+                    action='store_true', default=False, regenerate=False,
+                    help='generate output even if nothing changed since the '
+                    'last run with the same arguments and --cache-dir')
   parser.add_option('-G', dest='generator_flags', action='append', default=[],
                     metavar='FLAG=VAL', env_name='GYP_GENERATOR_FLAGS',
                     help='sets generator flag FLAG to VAL')
@@ -314,6 +414,11 @@ def gyp_main(args):
   parser.add_option('-I', '--include', dest='includes', action='append',
                     metavar='INCLUDE', type='path',
                     help='files to include in all loaded .gyp files')
+  parser.add_option('-j', '--jobs', dest='jobs', action='store', type='int',
+                    env_name='GYP_PARALLEL_JOBS', default=None, metavar='N',
+                    regenerate=False,
+                    help='number of processes to load build files with when '
+                    'using --parallel (default: the number of CPUs)')
   # --no-circular-check disables the check for circular relationships between
   # .gyp files.  These relationships should not exist, but they've only been
   # observed to be harmful with the Xcode generator.  Chromium's .gyp files
@@ -327,8 +432,23 @@ def gyp_main(args):
   parser.add_option('--parallel', action='store_true',
                     env_name='GYP_PARALLEL',
                     help='Use multiprocessing for speed (experimental)')
+  parser.add_option('--server', dest='server', action='store', default=None,
+                    metavar='SOCKET', regenerate=False,
+                    help='keep loaded build files in memory and serve the '
+                    'gyp runs of --use-server clients on the Unix domain '
+                    'socket SOCKET, until interrupted')
+  parser.add_option('--stats', dest='stats', action='store', default=None,
+                    metavar='FILE', regenerate=False,
+                    help='write the time and memory each phase of the run '
+                    'took, along with counts of hot function calls and cache '
+                    'hits, to FILE as JSON')
   parser.add_option('-S', '--suffix', dest='suffix', default='',
                     help='suffix to add to generated files')
+  parser.add_option('--use-server', dest='use_server', action='store',
+                    env_name='GYP_SERVER', default=None, metavar='SOCKET',
+                    regenerate=False,
+                    help='run on the gyp --server listening on SOCKET, if '
+                    'there is one')
   parser.add_option('--toplevel-dir', dest='toplevel_dir', action='store',
                     default=None, metavar='DIR', type='path',
                     help='directory to use as the root of the source tree')
@@ -336,6 +456,22 @@ def gyp_main(args):
   options, build_files_arg = parser.parse_args(args)
   build_files = build_files_arg
 
+  if options.cache_size is None:
+    cache_size = gyp.disk_cache.DEFAULT_MAX_SIZE
+  else:
+    cache_size = options.cache_size * 1024 * 1024
+
+  if options.server:
+    return gyp.server.Serve(options.server, cache_size)
+  if not options.use_server and options.use_environment:
+    options.use_server = os.environ.get('GYP_SERVER')
+  # Builds (--build) write to this process's output, so they run here.
+  if options.use_server and not options.configs and not gyp.server.serving:
+    status = gyp.server.RunOnServer(options.use_server, args)
+    if status is not None:
+      return status
+  gyp.stats.Start(bool(options.stats))
+
   # Set up the configuration directory (defaults to ~/.gyp)
   if not options.config_dir:
     home = None
@@ -390,9 +526,46 @@ def gyp_main(args):
     p = os.environ.get('GYP_PARALLEL')
     options.parallel = bool(p and p != '0')
 
+  for dest, env_name in (('jobs', 'GYP_PARALLEL_JOBS'),
+                         ('command_jobs', 'GYP_COMMAND_JOBS')):
+    if getattr(options, dest) is None and options.use_environment:
+      jobs = os.environ.get(env_name)
+      if jobs:
+        try:
+          setattr(options, dest, int(jobs))
+        except ValueError:
+          raise GypError('%s must be a number, not %r' % (env_name, jobs))
+    if getattr(options, dest) is not None and getattr(options, dest) < 1:
+      raise GypError('The number of jobs must be at least 1')
+  gyp.input.command_jobs = options.command_jobs or 1
+
+  if not options.cache_dir and options.use_environment:
+    options.cache_dir = os.environ.get('GYP_CACHE_DIR')
+  caches = {}
+  if resident_caches:
+    caches = resident_caches
+  elif options.cache_dir:
+    for name in CACHE_NAMES:
+      caches[name] = gyp.disk_cache.DiskCache(
+          os.path.join(options.cache_dir, name), cache_size)
+  if not caches and len(set(options.formats)) > 1:
+    # Each format loads the build files anew, but most of them read the same
+    # variables, so the parsed build files and most of the early phase results
+    # of the first format serve the others.
+    for name in ('parsed', 'early'):
+      caches[name] = gyp.disk_cache.MemoryCache(cache_size)
+  gyp.input.parsed_build_file_cache = caches.get('parsed')
+  gyp.input.command_output_cache = caches.get('commands')
+  gyp.input.early_phase_cache = caches.get('early')
+  gyp.input.expansion_log = None
+  run_manifests = caches.get('runs')
+
   for mode in options.debug:
     gyp.debug[mode] = 1
 
+  input_files = set()
+  output_recorder = gyp.regeneration.OutputRecorder()
+
   # Do an extra check to avoid work when we're not debugging.
   if DEBUG_GENERAL in gyp.debug:
     DebugOutput(DEBUG_GENERAL, 'running with these options:')
@@ -471,6 +644,25 @@ def gyp_main(args):
   if options.includes:
     includes.extend(options.includes)
 
+  # Skip the run if its manifest says it would generate the same output as
+  # last time.  Runs that also build (--build) always go ahead.
+  run_key = None
+  if run_manifests and not options.configs:
+    # The build files found in the current directory and whether there's a
+    # default include aren't in |args|.
+    run_key = gyp.regeneration.RunKey(args, build_files, includes)
+    if not options.force_regenerate:
+      with gyp.stats.Phase('check run manifest'):
+        manifest = run_manifests.Get(run_key)
+        current = manifest and gyp.regeneration.ManifestIsCurrent(manifest)
+      if current:
+        DebugOutput(DEBUG_GENERAL,
+                    'nothing changed since the last run, skipping it')
+        if options.stats:
+          gyp.stats.WriteReport(options.stats)
+        return 0
+    gyp.input.expansion_log = []
+
   # Generator flags should be prefixed with the target generator since they
   # are global across all generator runs.
   gen_flags = []
@@ -484,7 +676,15 @@ def gyp_main(args):
 
   # Generate all requested formats (use a set in case we got one format request
   # twice)
-  for format in set(options.formats):
+  formats = list(set(options.formats))
+  # With --parallel, all but the last format generate their files in a
+  # separate process while the next format loads.  --build runs the build
+  # right after generating, so it keeps to one format at a time.
+  concurrent_generation = (options.parallel and len(formats) > 1 and
+                           not options.configs and not gyp.server.serving and
+                           hasattr(os, 'fork'))
+  generator_processes = []
+  for format in formats:
     params = {'options': options,
               'build_files': build_files,
               'generator_flags': generator_flags,
@@ -492,14 +692,16 @@ def gyp_main(args):
               'build_files_arg': build_files_arg,
               'gyp_binary': sys.argv[0],
               'home_dot_gyp': home_dot_gyp,
-              'parallel': options.parallel}
+              'parallel': options.parallel,
+              'parallel_jobs': options.jobs}
 
     # Start with the default variables from the command line.
-    [generator, flat_list, targets, data] = Load(build_files, format,
-                                                 cmdline_default_variables,
-                                                 includes, options.depth,
-                                                 params, options.check,
-                                                 options.circular_check)
+    with gyp.stats.Phase('load'):
+      [generator, flat_list, targets, data] = Load(build_files, format,
+                                                   cmdline_default_variables,
+                                                   includes, options.depth,
+                                                   params, options.check,
+                                                   options.circular_check)
 
     # TODO(mark): Pass |data| for now because the generator needs a list of
     # build files that came in.  In the future, maybe it should just accept
@@ -508,7 +710,21 @@ def gyp_main(args):
     # that targets may be built.  Build systems that operate serially or that
     # need to have dependencies defined before dependents reference them should
     # generate targets in the order specified in flat_list.
-    generator.GenerateOutput(flat_list, targets, data, params)
+    if run_key:
+      input_files.update(gyp.regeneration.InputFiles(data))
+    if concurrent_generation and format != formats[-1]:
+      generator_process = GeneratorProcess(format, bool(run_key))
+      generator_process.Start(generator, flat_list, targets, data, params)
+      generator_processes.append(generator_process)
+      continue
+    if run_key:
+      output_recorder.Start()
+    with gyp.stats.Phase('generate %s' % format):
+      try:
+        generator.GenerateOutput(flat_list, targets, data, params)
+      finally:
+        if run_key:
+          output_recorder.Stop()
 
     if options.configs:
       valid_configs = targets[flat_list[0]]['configurations'].keys()
@@ -517,6 +733,40 @@ def gyp_main(args):
           raise GypError('Invalid config specified via --build: %s' % conf)
       generator.PerformBuild(data, options.configs, params)
 
+  for generator_process in generator_processes:
+    output_recorder.paths.update(generator_process.Wait())
+
+  if run_key:
+    with gyp.stats.Phase('record run manifest'):
+      manifest = gyp.regeneration.BuildManifest(
+          input_files, gyp.input.expansion_log, output_recorder.paths)
+      if manifest:
+        run_manifests.Put(run_key, manifest)
+      else:
+        DebugOutput(DEBUG_GENERAL, 'not recording a manifest of this run, '
+                    'since it expanded commands without declared inputs')
+      gyp.input.expansion_log = None
+
+  for name, cache in (('parsed build file', gyp.input.parsed_build_file_cache),
+                      ('command output', gyp.input.command_output_cache),
+                      ('early phase', gyp.input.early_phase_cache),
+                      ('run manifest', run_manifests)):
+    if cache:
+      DebugOutput(DEBUG_GENERAL, '%s cache: %d hits, %d misses',
+                  name, cache.hits, cache.misses)
+      gyp.stats.counts['%s cache hits' % name] = cache.hits
+      gyp.stats.counts['%s cache misses' % name] = cache.misses
+      cache.Trim()
+  stats = gyp.common.realpath_cache_stats
+  DebugOutput(DEBUG_GENERAL,
+              'realpath cache: %d hits, %d misses, %d lstat calls saved',
+              stats['hits'], stats['misses'], stats['lstats_saved'])
+
+  if options.stats:
+    for name, count in stats.iteritems():
+      gyp.stats.counts['realpath cache %s' % name.replace('_', ' ')] = count
+    gyp.stats.WriteReport(options.stats)
+
   # Done
   return 0
 
@@ -527,6 +777,8 @@ def main(args):
   except GypError, e:
     sys.stderr.write("gyp: %s\n" % e)
     return 1
+  finally:
+    gyp.input.StopCommandPrefetcher()
 
 # NOTE: setuptools generated console_scripts calls function with no arguments
 def script_main():
@@ -6,6 +6,8 @@ from __future__ import with_statement
 
 import errno
 import filecmp
+import gyp.generator
+import hashlib
 import os.path
 import re
 import tempfile
@@ -121,6 +123,48 @@ def QualifiedTarget(build_file, target, toolset):
   return fully_qualified
 
 
+# Caches of results that depend on the file system and the current directory,
+# cleared by InvalidatePathCaches.  Modules add their own with
+# RegisterPathCache.
+_path_caches = []
+
+# os.path.realpath results, keyed by path.  realpath lstat()s every component
+# of the path, so each hit saves that many system calls.
+_realpath_cache = {}
+
+# Counters for _realpath_cache, for debugging output.
+realpath_cache_stats = {'hits': 0, 'misses': 0, 'lstats_saved': 0}
+
+
+def RegisterPathCache(cache):
+  """Has InvalidatePathCaches clear the dict |cache|.  Returns |cache|."""
+  _path_caches.append(cache)
+  return cache
+
+
+def InvalidatePathCaches():
+  """Forgets all cached path resolutions.
+
+  Paths are resolved once per process and assumed not to change.  Call this
+  when that doesn't hold, for example after changing the current directory
+  or symbolic links in the source tree.
+  """
+  for cache in _path_caches:
+    cache.clear()
+
+
+def RealPath(path):
+  """Returns os.path.realpath(|path|), cached."""
+  real_path = _realpath_cache.get(path)
+  if real_path is None:
+    real_path = _realpath_cache[path] = os.path.realpath(path)
+    realpath_cache_stats['misses'] += 1
+  else:
+    realpath_cache_stats['hits'] += 1
+    realpath_cache_stats['lstats_saved'] += real_path.count(os.path.sep)
+  return real_path
+
+
 @memoize
 def RelativePath(path, relative_to):
   # Assuming both |path| and |relative_to| are relative to the current
@@ -128,8 +172,8 @@ def RelativePath(path, relative_to):
   # relative_to.
 
   # Convert to normalized (and therefore absolute paths).
-  path = os.path.realpath(path)
-  relative_to = os.path.realpath(relative_to)
+  path = RealPath(path)
+  relative_to = RealPath(relative_to)
 
   # On Windows, we can't create a relative path to a different drive, so just
   # use the absolute path.
@@ -172,6 +216,11 @@ def InvertRelativePath(path, toplevel_dir=None):
   return RelativePath(toplevel_dir, os.path.join(toplevel_dir, path))
 
 
+RegisterPathCache(_realpath_cache)
+RegisterPathCache(RelativePath.cache)
+RegisterPathCache(InvertRelativePath.cache)
+
+
 def FixIfRelativePath(path, relative_to):
   # Like RelativePath but returns |path| unchanged if it is absolute.
   if os.path.isabs(path):
@@ -310,6 +359,55 @@ def AllTargets(target_list, target_dicts, build_file):
   return bftargets + deptargets
 
 
+# While not None, the set of the files that generators wrote, as reported to
+# RecordWrittenFile.  See gyp.regeneration.
+written_files = None
+
+
+def RecordWrittenFile(path):
+  """Notes that |path| was written as part of the generated output."""
+  if written_files is not None:
+    written_files.add(os.path.abspath(path))
+
+
+def GypSources():
+  """Returns the paths of the Python sources of gyp itself."""
+  sources = []
+  for directory in (os.path.dirname(gyp.__file__),
+                    os.path.dirname(gyp.generator.__file__)):
+    for name in sorted(os.listdir(directory)):
+      if name.endswith('.py'):
+        sources.append(os.path.join(directory, name))
+  return sources
+
+
+def FileState(path):
+  """Returns (path, size, mtime, SHA-1 of the contents) for the file |path|."""
+  st = os.stat(path)
+  with open(path, 'rb') as f:
+    digest = hashlib.sha1(f.read()).hexdigest()
+  return (path, st.st_size, st.st_mtime, digest)
+
+
+def FileStateIsCurrent(file_state):
+  """Returns whether a file described by FileState still has that content.
+
+  The file is only read again if its size matches but its modification time
+  doesn't.
+  """
+  (path, size, mtime, digest) = file_state
+  try:
+    st = os.stat(path)
+  except OSError:
+    return False
+  if st.st_size != size:
+    return False
+  if st.st_mtime == mtime:
+    return True
+  with open(path, 'rb') as f:
+    return hashlib.sha1(f.read()).hexdigest() == digest
+
+
 def WriteOnDiff(filename):
   """Write to a file only if the new contents differ.
 
@@ -375,6 +473,7 @@ def WriteOnDiff(filename):
             # is no way to make the switch atomic.
             os.remove(filename)
           os.rename(self.tmp_path, filename)
+        RecordWrittenFile(filename)
       except Exception:
         # Don't leave turds behind.
         os.unlink(self.tmp_path)
@@ -7,6 +7,9 @@
 """Unit tests for the common.py file."""
 
 import gyp.common
+import os
+import shutil
+import tempfile
 import unittest
 import sys
 
@@ -68,5 +71,38 @@ class TestGetFlavor(unittest.TestCase):
     self.assertFlavor('foobar', 'linux2' , {'flavor': 'foobar'})
 
 
+class TestPathCaches(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(self.directory, 'real'))
+    gyp.common.InvalidatePathCaches()
+
+  def tearDown(self):
+    gyp.common.InvalidatePathCaches()
+    shutil.rmtree(self.directory)
+
+  def test_RelativePath(self):
+    link = os.path.join(self.directory, 'link')
+    other = os.path.join(self.directory, 'other')
+    os.mkdir(other)
+    if not hasattr(os, 'symlink'):
+      return
+    os.symlink(other, link)
+    hits = gyp.common.realpath_cache_stats['hits']
+    self.assertEqual('../other',
+                     gyp.common.RelativePath(link, self.directory + '/real'))
+    self.assertEqual('other', gyp.common.RelativePath(link, self.directory))
+    self.assertEqual(hits + 1, gyp.common.realpath_cache_stats['hits'])
+
+    # Re-pointing the link is only noticed after invalidation.
+    os.remove(link)
+    os.symlink(os.path.join(self.directory, 'real'), link)
+    self.assertEqual('../other',
+                     gyp.common.RelativePath(link, self.directory + '/real'))
+    gyp.common.InvalidatePathCaches()
+    self.assertEqual('',
+                     gyp.common.RelativePath(link, self.directory + '/real'))
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,218 @@
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A small persistent cache of marshalled Python values.
+
+Each entry lives in its own file inside the cache directory, so independent
+gyp processes (including the workers used by --parallel) can read and write
+the cache without coordinating.  The total size of the directory is capped;
+Trim() evicts the least recently used entries once the cap is exceeded.
+
+MemoryCache offers the same interface for a process that outlives its runs,
+such as gyp --server.
+"""
+
+from __future__ import with_statement
+
+import collections
+import errno
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+
+
+# Entries written by a different cache layout or a different marshal format
+# are ignored.  Bump the first element when the entry layout changes.
+CACHE_FORMAT = (1, marshal.version, sys.version_info[:2])
+
+# The default cap on the total size of a cache directory, in bytes.
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+ENTRY_SUFFIX = '.entry'
+
+
+class DiskCache(object):
+  """Maps string keys to marshallable values stored under |directory|.
+
+  Attributes:
+    directory: the directory holding the entries.  Created on first write.
+    max_size: the number of bytes Trim() shrinks the directory to.
+    hits, misses: lookup counters, for debugging output.
+  """
+
+  def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+    self.directory = directory
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+
+  def _EntryPath(self, key):
+    return os.path.join(self.directory,
+                        hashlib.sha1(key).hexdigest() + ENTRY_SUFFIX)
+
+  def Get(self, key):
+    """Returns the value stored for |key|, or None if there is none."""
+    path = self._EntryPath(key)
+    try:
+      with open(path, 'rb') as entry_file:
+        stored_format, stored_key, value = marshal.load(entry_file)
+    except IOError, e:
+      if e.errno != errno.ENOENT:
+        raise
+      self.misses += 1
+      return None
+    except (EOFError, ValueError, TypeError):
+      # A truncated or foreign entry.  Drop it so it gets rewritten.
+      self._Remove(path)
+      self.misses += 1
+      return None
+
+    if stored_format != CACHE_FORMAT or stored_key != key:
+      self.misses += 1
+      return None
+
+    # Entry modification times drive the least-recently-used eviction in
+    # Trim(), so mark this entry as freshly used.
+    try:
+      os.utime(path, None)
+    except OSError:
+      pass
+    self.hits += 1
+    return value
+
+  def Put(self, key, value):
+    """Stores |value| for |key|.  Values marshal can't handle are dropped."""
+    try:
+      contents = marshal.dumps((CACHE_FORMAT, key, value))
+    except ValueError:
+      return
+
+    if not os.path.isdir(self.directory):
+      try:
+        os.makedirs(self.directory)
+      except OSError, e:
+        if e.errno != errno.EEXIST:
+          raise
+
+    # Write to a temporary file and rename it into place so that concurrent
+    # readers never see a partially written entry.
+    path = self._EntryPath(key)
+    tmp_fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+    try:
+      with os.fdopen(tmp_fd, 'wb') as tmp_file:
+        tmp_file.write(contents)
+      if sys.platform == 'win32' and os.path.exists(path):
+        # rename won't replace an existing file on Windows.
+        os.remove(path)
+      os.rename(tmp_path, path)
+    except Exception:
+      # Don't leave turds behind.
+      self._Remove(tmp_path)
+      raise
+
+  def Trim(self):
+    """Evicts least recently used entries until the cache fits in max_size.
+
+    Returns the number of entries removed.
+    """
+    try:
+      names = os.listdir(self.directory)
+    except OSError:
+      return 0
+
+    entries = []
+    total_size = 0
+    for name in names:
+      if not name.endswith(ENTRY_SUFFIX):
+        continue
+      path = os.path.join(self.directory, name)
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      entries.append((st.st_mtime, st.st_size, path))
+      total_size += st.st_size
+
+    removed = 0
+    entries.sort()
+    for mtime, size, path in entries:
+      if total_size <= self.max_size:
+        break
+      self._Remove(path)
+      total_size -= size
+      removed += 1
+    return removed
+
+  def _Remove(self, path):
+    try:
+      os.unlink(path)
+    except OSError:
+      pass
+
+
+class MemoryCache(object):
+  """Like DiskCache, but keeps the entries in this process's memory.
+
+  Values are stored marshalled, so that each Get() returns a fresh copy that
+  the caller may modify, just as a DiskCache would.
+
+  Attributes:
+    max_size: the number of bytes of marshalled values Trim() shrinks the
+        cache to.
+    hits, misses: lookup counters, for debugging output.
+  """
+
+  def __init__(self, max_size=DEFAULT_MAX_SIZE):
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    # Maps keys to marshalled values, least recently used first.
+    self.entries = collections.OrderedDict()
+    self.size = 0
+    # While not None, each new entry's key and marshalled value are appended
+    # to this list, so that parallel workers can send the entries they add
+    # back to the main process.
+    self.added = None
+
+  def Get(self, key):
+    """Returns the value stored for |key|, or None if there is none."""
+    contents = self.entries.pop(key, None)
+    if contents is None:
+      self.misses += 1
+      return None
+    self.entries[key] = contents
+    self.hits += 1
+    return marshal.loads(contents)
+
+  def Put(self, key, value):
+    """Stores |value| for |key|.  Values marshal can't handle are dropped."""
+    try:
+      contents = marshal.dumps(value)
+    except ValueError:
+      return
+    self.PutMarshalled(key, contents)
+
+  def PutMarshalled(self, key, contents):
+    """Stores the marshalled value |contents| for |key|."""
+    old_contents = self.entries.pop(key, None)
+    if old_contents is not None:
+      self.size -= len(old_contents)
+    self.entries[key] = contents
+    self.size += len(contents)
+    if self.added is not None:
+      self.added.append((key, contents))
+
+  def Trim(self):
+    """Evicts least recently used entries until the cache fits in max_size.
+
+    Returns the number of entries removed.
+    """
+    removed = 0
+    while self.size > self.max_size:
+      key, contents = self.entries.popitem(last=False)
+      self.size -= len(contents)
+      removed += 1
+    return removed
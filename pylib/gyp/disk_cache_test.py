@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for the disk_cache.py file."""
+
+from __future__ import with_statement
+
+import gyp.disk_cache
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestDiskCache(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache = gyp.disk_cache.DiskCache(self.directory)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_RoundTrip(self):
+    value = {'targets': [{'target_name': 'foo', 'sources': ['a.cc']}]}
+    self.assertEqual(None, self.cache.Get('foo.gyp'))
+    self.cache.Put('foo.gyp', value)
+    self.assertEqual(value, self.cache.Get('foo.gyp'))
+    self.assertEqual(1, self.cache.hits)
+    self.assertEqual(1, self.cache.misses)
+
+  def test_CorruptEntry(self):
+    self.cache.Put('foo.gyp', [1, 2, 3])
+    with open(self.cache._EntryPath('foo.gyp'), 'wb') as entry_file:
+      entry_file.write('garbage')
+    self.assertEqual(None, self.cache.Get('foo.gyp'))
+    self.assertFalse(os.path.exists(self.cache._EntryPath('foo.gyp')))
+
+  def test_Trim(self):
+    for index in xrange(10):
+      self.cache.Put('file%d.gyp' % index, 'x' * 1000)
+      entry = self.cache._EntryPath('file%d.gyp' % index)
+      os.utime(entry, (index, index))
+    # Reading an entry makes it the most recently used one.
+    self.cache.Get('file0.gyp')
+    self.cache.max_size = 3500
+    self.assertEqual(7, self.cache.Trim())
+    self.assertNotEqual(None, self.cache.Get('file0.gyp'))
+    self.assertNotEqual(None, self.cache.Get('file9.gyp'))
+    self.assertEqual(None, self.cache.Get('file1.gyp'))
+
+
+class TestMemoryCache(unittest.TestCase):
+  def test_RoundTrip(self):
+    cache = gyp.disk_cache.MemoryCache()
+    value = {'sources': ['a.cc']}
+    cache.Put('foo.gyp', value)
+    cached = cache.Get('foo.gyp')
+    self.assertEqual(value, cached)
+    # Callers get their own copy.
+    cached['sources'].append('b.cc')
+    self.assertEqual(value, cache.Get('foo.gyp'))
+    self.assertEqual(None, cache.Get('bar.gyp'))
+    self.assertEqual((2, 1), (cache.hits, cache.misses))
+
+  def test_Trim(self):
+    cache = gyp.disk_cache.MemoryCache(max_size=3500)
+    for index in xrange(10):
+      cache.Put('file%d.gyp' % index, 'x' * 1000)
+    cache.Get('file0.gyp')
+    self.assertEqual(7, cache.Trim())
+    self.assertNotEqual(None, cache.Get('file0.gyp'))
+    self.assertNotEqual(None, cache.Get('file9.gyp'))
+    self.assertEqual(None, cache.Get('file1.gyp'))
+
+  def test_Added(self):
+    worker_cache = gyp.disk_cache.MemoryCache()
+    worker_cache.Put('foo.gyp', 'before')
+    worker_cache.added = []
+    worker_cache.Put('bar.gyp', ['a.cc'])
+    cache = gyp.disk_cache.MemoryCache()
+    for key, contents in worker_cache.added:
+      cache.PutMarshalled(key, contents)
+    self.assertEqual(['a.cc'], cache.Get('bar.gyp'))
+    self.assertEqual(None, cache.Get('foo.gyp'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -2,6 +2,7 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import gyp.common
 import re
 import os
 
@@ -129,6 +130,9 @@ def WriteXmlIfChanged(content, path, encoding='utf-8', pretty=False,
     f = open(path, 'w')
     f.write(xml_string)
     f.close()
+  else:
+    # Still part of the output, whether or not it was touched.
+    gyp.common.RecordWrittenFile(path)
 
 
 _xml_escape_map = {
@@ -470,6 +470,7 @@ sys.exit(subprocess.call(sys.argv[1:]))" """
 
         os.chmod(new_pbxproj_path, 0666 & ~umask)
         os.rename(new_pbxproj_path, pbxproj_path)
+      gyp.common.RecordWrittenFile(pbxproj_path)
 
     except Exception:
       # Don't leave turds behind.  In fact, if this code was responsible for
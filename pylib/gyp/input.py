@@ -2,19 +2,23 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-from compiler.ast import Const
-from compiler.ast import Dict
-from compiler.ast import Discard
-from compiler.ast import List
-from compiler.ast import Module
-from compiler.ast import Node
-from compiler.ast import Stmt
-import compiler
+from __future__ import with_statement
+
+import ast
+import collections
 import copy
 import gyp.common
+import gyp.disk_cache
+import gyp.literal_parser
+import gyp.pymod_host
+import gyp.stats
+import hashlib
+import heapq
+import marshal
 import multiprocessing
 import optparse
 import os.path
+import Queue
 import re
 import shlex
 import signal
@@ -112,6 +116,61 @@ multiple_toolsets = False
 # Converts filelist paths to output paths.
 generator_filelist_path = None
 
+# An optional gyp.disk_cache.DiskCache of already parsed build files.  Set up
+# by gyp_main when --cache-dir is given.
+parsed_build_file_cache = None
+
+# An optional gyp.disk_cache.DiskCache of target build files as they are after
+# the early phase, along with the manifest of build files and command inputs
+# they were computed from.  Set up by gyp_main when --cache-dir is given, or
+# for the duration of a run that generates several formats.
+early_phase_cache = None
+
+# The SHA-1 of the contents of gyp's own sources, which the early_phase_cache
+# keys include.  Computed on first use by GetGypSourcesDigest.
+gyp_sources_digest = None
+
+# The number of early phase results early_phase_cache keeps per target build
+# file, for different values of the variables that its early phase reads,
+# such as those that differ between generators.
+max_early_phase_variants = 8
+
+# While not None, ExpandVariables adds an entry to this list for each command
+# and file list expansion: the (inputs, cwd, fingerprint) of commands with
+# declared inputs, or None for expansions whose result can't be revalidated.
+# Set up while the results of an early phase or of a whole run get cached.
+expansion_log = None
+
+# Maps the path of each included build file to its IncludeSnapshot.  Reset by
+# Load.
+include_snapshots = {}
+
+# Maps each loaded target build file to the number of seconds it took to load,
+# not counting its dependencies.  Reset by Load.
+build_file_load_times = {}
+
+# The caches that parallel worker processes share with the main process.
+worker_cache_names = ('parsed_build_file_cache', 'early_phase_cache',
+                      'command_output_cache')
+
+# The (variables, includes, depth, check) arguments shared by all the
+# LoadTargetBuildFile calls of a parallel loader worker process.
+parallel_loader_args = None
+
+# In a parallel loader worker process, maps each included build file loaded
+# so far to its (data, aux_data), and the set of those that were already sent
+# to the main process.
+parallel_loader_includes = {}
+parallel_loader_sent_includes = set()
+
+# Maps each build file loaded by a parallel loader worker to the size of the
+# encoded result the worker sent back for it.  Reset by Load.
+build_file_transport_sizes = {}
+
+# The (variables, extra_sources_for_rules) arguments shared by all the
+# ProcessTargetsLate calls of a parallel target worker process.
+parallel_target_args = None
+
 def GetIncludedBuildFiles(build_file_path, aux_data, included=None):
   """Return a list of all build files included into build_file_path.
 
@@ -151,62 +210,28 @@ def CheckedEval(file_contents):
   The gyp file is restricted to dictionaries and lists only, and
   repeated keys are not allowed.
 
-  Note that this is slower than eval() is.
+  This uses gyp.literal_parser, which is only a little slower than eval().
   """
 
-  ast = compiler.parse(file_contents)
-  assert isinstance(ast, Module)
-  c1 = ast.getChildren()
-  assert c1[0] is None
-  assert isinstance(c1[1], Stmt)
-  c2 = c1[1].getChildren()
-  assert isinstance(c2[0], Discard)
-  c3 = c2[0].getChildren()
-  assert len(c3) == 1
-  return CheckNode(c3[0], [])
-
-
-def CheckNode(node, keypath):
-  if isinstance(node, Dict):
-    c = node.getChildren()
-    dict = {}
-    for n in range(0, len(c), 2):
-      assert isinstance(c[n], Const)
-      key = c[n].getChildren()[0]
-      if key in dict:
-        raise GypError("Key '" + key + "' repeated at level " +
-              repr(len(keypath) + 1) + " with key path '" +
-              '.'.join(keypath) + "'")
-      kp = list(keypath)  # Make a copy of the list for descending this node.
-      kp.append(key)
-      dict[key] = CheckNode(c[n + 1], kp)
-    return dict
-  elif isinstance(node, List):
-    c = node.getChildren()
-    children = []
-    for index, child in enumerate(c):
-      kp = list(keypath)  # Copy list.
-      kp.append(repr(index))
-      children.append(CheckNode(child, kp))
-    return children
-  elif isinstance(node, Const):
-    return node.getChildren()[0]
-  else:
-    raise TypeError, "Unknown AST node at key path '" + '.'.join(keypath) + \
-         "': " + repr(node)
+  return gyp.literal_parser.ParseLiteral(file_contents)
 
 
-def LoadOneBuildFile(build_file_path, data, aux_data, variables, includes,
-                     is_target, check):
-  if build_file_path in data:
-    return data[build_file_path]
+def ParseBuildFile(build_file_path, build_file_contents, check):
+  """Returns the value that build_file_contents evaluates to.
 
-  if os.path.exists(build_file_path):
-    build_file_contents = open(build_file_path).read()
-  else:
-    raise GypError("%s not found (cwd: %s)" % (build_file_path, os.getcwd()))
+  If parsed_build_file_cache is set, a previously parsed copy is returned when
+  the file is unchanged, and newly parsed files are added to the cache.  The
+  cache is keyed by the SHA-1 of |build_file_contents|, which is cheap next to
+  parsing them, rather than by the file's size and modification time, which
+  could have changed since the contents were read.
+  """
+  if parsed_build_file_cache:
+    cache_key = '%s:%d:%s' % (os.path.abspath(build_file_path), bool(check),
+                              hashlib.sha1(build_file_contents).hexdigest())
+    cached_data = parsed_build_file_cache.Get(cache_key)
+    if cached_data is not None:
+      return cached_data
 
-  build_file_data = None
   try:
     if check:
       build_file_data = CheckedEval(build_file_contents)
@@ -220,6 +245,32 @@ def LoadOneBuildFile(build_file_path, data, aux_data, variables, includes,
     gyp.common.ExceptionAppend(e, 'while reading ' + build_file_path)
     raise
 
+  if parsed_build_file_cache and isinstance(build_file_data, dict):
+    parsed_build_file_cache.Put(cache_key, build_file_data)
+
+  return build_file_data
+
+
+def LoadOneBuildFile(build_file_path, data, aux_data, variables, includes,
+                     is_target, check):
+  if is_target:
+    # Target build files are modified in place once loaded, so any snapshot
+    # taken while the file served as an include is stale.  That goes for files
+    # already loaded as includes too.
+    include_snapshots.pop(build_file_path, None)
+
+  if build_file_path in data:
+    return data[build_file_path]
+
+  with gyp.stats.Phase('parse'):
+    if os.path.exists(build_file_path):
+      build_file_contents = open(build_file_path).read()
+    else:
+      raise GypError("%s not found (cwd: %s)" % (build_file_path, os.getcwd()))
+
+    build_file_data = ParseBuildFile(build_file_path, build_file_contents,
+                                     check)
+
   if not isinstance(build_file_data, dict):
     raise GypError("%s does not evaluate to a dictionary." % build_file_path)
 
@@ -229,17 +280,19 @@ def LoadOneBuildFile(build_file_path, data, aux_data, variables, includes,
   # Scan for includes and merge them in.
   if ('skip_includes' not in build_file_data or
       not build_file_data['skip_includes']):
-    try:
-      if is_target:
-        LoadBuildFileIncludesIntoDict(build_file_data, build_file_path, data,
-                                      aux_data, variables, includes, check)
-      else:
-        LoadBuildFileIncludesIntoDict(build_file_data, build_file_path, data,
-                                      aux_data, variables, None, check)
-    except Exception, e:
-      gyp.common.ExceptionAppend(e,
-                                 'while reading includes of ' + build_file_path)
-      raise
+    with gyp.stats.Phase('includes'):
+      try:
+        if is_target:
+          LoadBuildFileIncludesIntoDict(build_file_data, build_file_path,
+                                        data, aux_data, variables, includes,
+                                        check)
+        else:
+          LoadBuildFileIncludesIntoDict(build_file_data, build_file_path,
+                                        data, aux_data, variables, None, check)
+      except Exception, e:
+        gyp.common.ExceptionAppend(
+            e, 'while reading includes of ' + build_file_path)
+        raise
 
   return build_file_data
 
@@ -268,10 +321,10 @@ def LoadBuildFileIncludesIntoDict(subdict, subdict_path, data, aux_data,
 
     gyp.DebugOutput(gyp.DEBUG_INCLUDES, "Loading Included File: '%s'", include)
 
-    MergeDicts(subdict,
-               LoadOneBuildFile(include, data, aux_data, variables, None,
-                                False, check),
-               subdict_path, include)
+    MergeIncludedDict(subdict,
+                      LoadOneBuildFile(include, data, aux_data, variables,
+                                       None, False, check),
+                      subdict_path, include)
 
   # Recurse into subdictionaries.
   for k, v in subdict.iteritems():
@@ -332,28 +385,16 @@ def ProcessToolsetsInDict(data):
 # TODO(mark): I don't love this name.  It just means that it's going to load
 # a build file that contains targets and is expected to provide a targets dict
 # that contains the targets...
-def LoadTargetBuildFile(build_file_path, data, aux_data, variables, includes,
-                        depth, check, load_dependencies):
-  # If depth is set, predefine the DEPTH variable to be a relative path from
-  # this build file's directory to the directory identified by depth.
-  if depth:
-    # TODO(dglazkov) The backslash/forward-slash replacement at the end is a
-    # temporary measure. This should really be addressed by keeping all paths
-    # in POSIX until actual project generation.
-    d = gyp.common.RelativePath(depth, os.path.dirname(build_file_path))
-    if d == '':
-      variables['DEPTH'] = '.'
-    else:
-      variables['DEPTH'] = d.replace('\\', '/')
-
-  if build_file_path in data['target_build_files']:
-    # Already loaded.
-    return False
-  data['target_build_files'].add(build_file_path)
-
-  gyp.DebugOutput(gyp.DEBUG_INCLUDES,
-                  "Loading Target Build File '%s'", build_file_path)
-
+def RunEarlyPhase(build_file_path, data, aux_data, variables, includes,
+                  depth, check, early_phase_key=None, early_phase_variants=()):
+  """Loads a target build file and applies the early phase to it.
+
+  The result goes into |data| and |aux_data| like LoadOneBuildFile's, and is
+  stored in early_phase_cache under |early_phase_key|, along with the
+  |early_phase_variants| already stored there, if that is set and the result
+  can be revalidated.  Returns the build files that the targets in
+  |build_file_path| depend on.
+  """
   build_file_data = LoadOneBuildFile(build_file_path, data, aux_data, variables,
                                      includes, True, check)
 
@@ -380,8 +421,22 @@ def LoadTargetBuildFile(build_file_path, data, aux_data, variables, includes,
   ProcessToolsetsInDict(build_file_data)
 
   # Apply "pre"/"early" variable expansions and condition evaluations.
-  ProcessVariablesAndConditionsInDict(
-      build_file_data, PHASE_EARLY, variables, build_file_path)
+  global expansion_log
+  outer_expansion_log = expansion_log
+  if early_phase_key or outer_expansion_log is not None:
+    expansion_log = []
+  early_variables = variables
+  if early_phase_key:
+    early_variables = RecordingVariables(variables)
+  try:
+    PrefetchCommands(build_file_data, PHASE_EARLY, variables, build_file_path)
+    ProcessVariablesAndConditionsInDict(
+        build_file_data, PHASE_EARLY, early_variables, build_file_path)
+    commands = expansion_log
+  finally:
+    expansion_log = outer_expansion_log
+  if expansion_log is not None:
+    expansion_log.extend(commands)
 
   # Since some toolsets might have been defined conditionally, perform
   # a second round of toolsets expansion now.
@@ -427,6 +482,217 @@ def LoadTargetBuildFile(build_file_path, data, aux_data, variables, includes,
         dependencies.append(
             gyp.common.ResolveTarget(build_file_path, dependency, None)[0])
 
+  if early_phase_key and None not in commands:
+    PutEarlyPhaseResult(early_phase_key, early_phase_variants,
+                        early_variables.reads, included, commands,
+                        build_file_data, aux_data[build_file_path],
+                        dependencies)
+  return dependencies
+
+
+class RecordingVariables(dict):
+  """A dict of variables that records which of them are looked up.
+
+  The early phase of a target build file starts with one when its result is
+  to be cached, so that the result can be reused wherever the variables it
+  read have the same values, even if others differ.
+
+  Attributes:
+    reads: maps the name of each variable looked up to a tuple holding its
+        value, or to () if it wasn't set.
+  """
+
+  def __init__(self, variables):
+    dict.__init__(self, variables)
+    self.reads = {}
+
+  def _Read(self, key):
+    if dict.__contains__(self, key):
+      self.reads[key] = (dict.__getitem__(self, key),)
+    else:
+      self.reads[key] = ()
+
+  def _ReadAll(self):
+    for key in dict.iterkeys(self):
+      self._Read(key)
+
+  def __getitem__(self, key):
+    if key not in self.reads:
+      self._Read(key)
+    return dict.__getitem__(self, key)
+
+  def __contains__(self, key):
+    if key not in self.reads:
+      self._Read(key)
+    return dict.__contains__(self, key)
+
+  def get(self, key, default=None):
+    if key in self:
+      return self[key]
+    return default
+
+  has_key = __contains__
+
+  def copy(self):
+    self._ReadAll()
+    return dict(self)
+
+  def __iter__(self):
+    self._ReadAll()
+    return dict.__iter__(self)
+
+  def iteritems(self):
+    self._ReadAll()
+    return dict.iteritems(self)
+
+  def items(self):
+    self._ReadAll()
+    return dict.items(self)
+
+  def keys(self):
+    self._ReadAll()
+    return dict.keys(self)
+
+  def values(self):
+    self._ReadAll()
+    return dict.values(self)
+
+
+def VariableReadsMatch(reads, variables):
+  """Returns whether the |variables| dict agrees with the |reads| of a
+  RecordingVariables.
+  """
+  for key, value in reads.iteritems():
+    if key in variables:
+      if value != (variables[key],):
+        return False
+    elif value:
+      return False
+  return True
+
+
+def GetEarlyPhaseCacheKey(build_file_path, includes, depth, check):
+  """Returns the early_phase_cache key of a target build file.
+
+  Besides the files read and the commands run, which the cached manifest
+  covers, and the variables read, which each cached result records, the early
+  phase depends on the forced includes, the generator's path_sections and
+  toolset support, and gyp itself.
+  """
+  return repr((os.getcwd(), build_file_path, includes, depth, bool(check),
+               sorted(path_sections), multiple_toolsets,
+               GetGypSourcesDigest()))
+
+
+def GetGypSourcesDigest():
+  """Returns gyp_sources_digest, computing it if needed."""
+  global gyp_sources_digest
+  if gyp_sources_digest is None:
+    digest = hashlib.sha1()
+    for path in gyp.common.GypSources():
+      (path, size, mtime, file_digest) = gyp.common.FileState(path)
+      # Not the whole path, which depends on how gyp was started.
+      digest.update(repr((os.path.basename(path), file_digest)))
+    gyp_sources_digest = digest.hexdigest()
+  return gyp_sources_digest
+
+
+def GetEarlyPhaseResult(early_phase_variants, variables):
+  """Returns (commands, build_file_data, build_file_aux_data, dependencies)
+  from the |early_phase_variants| stored in early_phase_cache for a target
+  build file, or None if none of them read the values in |variables|, or a
+  file or command input in its manifest changed.
+  """
+  for (reads, manifest, commands, result) in early_phase_variants:
+    if VariableReadsMatch(reads, variables):
+      break
+  else:
+    return None
+  for file_state in manifest:
+    if not gyp.common.FileStateIsCurrent(file_state):
+      return None
+  if not CommandInputsAreCurrent(commands):
+    return None
+  return (commands,) + marshal.loads(result)
+
+
+def CommandInputsAreCurrent(commands):
+  """Returns whether the inputs of |commands|, (inputs, cwd, fingerprint)
+  entries of expansion_log, still have the same fingerprints.
+  """
+  for (inputs, cwd, fingerprint) in commands:
+    if FingerprintCommandInputs(inputs, cwd) != fingerprint:
+      return False
+  return True
+
+
+def PutEarlyPhaseResult(early_phase_key, early_phase_variants, reads,
+                        included, commands, build_file_data,
+                        build_file_aux_data, dependencies):
+  """Stores a target build file's early phase result in early_phase_cache.
+
+  The result joins the |early_phase_variants| already stored, replacing the
+  one with the same variable |reads| if any.  |included| lists the build file
+  and every file it included, and |commands| the (inputs, cwd, fingerprint)
+  of the commands its early phase ran.
+  """
+  manifest = [gyp.common.FileState(path) for path in included]
+  try:
+    # Only the variant that matches gets unmarshalled again.
+    result = marshal.dumps((build_file_data, build_file_aux_data,
+                            dependencies))
+  except ValueError:
+    return
+  variants = [(reads, manifest, commands, result)]
+  for variant in early_phase_variants:
+    if variant[0] != reads and len(variants) < max_early_phase_variants:
+      variants.append(variant)
+  early_phase_cache.Put(early_phase_key, variants)
+
+
+def LoadTargetBuildFile(build_file_path, data, aux_data, variables, includes,
+                        depth, check, load_dependencies):
+  # If depth is set, predefine the DEPTH variable to be a relative path from
+  # this build file's directory to the directory identified by depth.
+  if depth:
+    # TODO(dglazkov) The backslash/forward-slash replacement at the end is a
+    # temporary measure. This should really be addressed by keeping all paths
+    # in POSIX until actual project generation.
+    d = gyp.common.RelativePath(depth, os.path.dirname(build_file_path))
+    if d == '':
+      variables['DEPTH'] = '.'
+    else:
+      variables['DEPTH'] = d.replace('\\', '/')
+
+  if build_file_path in data['target_build_files']:
+    # Already loaded.
+    return False
+  data['target_build_files'].add(build_file_path)
+  start_time = time.time()
+  with gyp.stats.Phase('early phase'):
+    gyp.DebugOutput(gyp.DEBUG_INCLUDES,
+                    "Loading Target Build File '%s'", build_file_path)
+
+    early_phase_key = None
+    early_phase_variants = []
+    cached = None
+    if early_phase_cache and build_file_path not in data:
+      early_phase_key = GetEarlyPhaseCacheKey(build_file_path, includes, depth,
+                                              check)
+      early_phase_variants = early_phase_cache.Get(early_phase_key) or []
+      cached = GetEarlyPhaseResult(early_phase_variants, variables)
+    if cached:
+      (commands, data[build_file_path], aux_data[build_file_path],
+       dependencies) = cached
+      if expansion_log is not None:
+        expansion_log.extend(commands)
+    else:
+      dependencies = RunEarlyPhase(build_file_path, data, aux_data, variables,
+                                   includes, depth, check, early_phase_key,
+                                   early_phase_variants)
+
+    build_file_load_times[build_file_path] = time.time() - start_time
+
   if load_dependencies:
     for dependency in dependencies:
       try:
@@ -440,27 +706,72 @@ def LoadTargetBuildFile(build_file_path, data, aux_data, variables, includes,
     return (build_file_path, dependencies)
 
 
-def CallLoadTargetBuildFile(global_flags,
-                            build_file_path, data,
-                            aux_data, variables,
-                            includes, depth, check):
-  """Wrapper around LoadTargetBuildFile for parallel processing.
+def InitParallelLoaderWorker(global_flags, variables, includes, depth, check):
+  """Sets up a worker process of LoadTargetBuildFilesParallel's pool.
 
-     This wrapper is used when LoadTargetBuildFile is executed in
-     a worker process.
+  Everything but the path of the build file to load is the same for all the
+  files, so it's passed once per worker instead of once per file.
   """
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  # Apply globals so that the worker process behaves the same.
+  for key, value in global_flags.iteritems():
+    globals()[key] = value
+
+  global parallel_loader_args
+  parallel_loader_args = (variables, includes, depth, check)
+  parallel_loader_includes.clear()
+  parallel_loader_sent_includes.clear()
+  RecordAddedCacheEntries()
+  TakeCacheCounts()
+  gyp.stats.Reset()
 
-  try:
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    # Apply globals so that the worker process behaves the same.
-    for key, value in global_flags.iteritems():
-      globals()[key] = value
+def InternStrings(value):
+  """Returns a copy of |value| with all of its strings interned.
 
-    # Save the keys so we can return data that changed.
-    data_keys = set(data)
-    aux_data_keys = set(aux_data)
+  marshal writes an interned string once and refers back to it afterwards, so
+  this makes the many repeated strings of build file data cheap to send.
+  """
+  if value.__class__ == str:
+    return intern(value)
+  elif value.__class__ == dict:
+    return dict((InternStrings(k), InternStrings(v))
+                for k, v in value.iteritems())
+  elif value.__class__ == list:
+    return [InternStrings(item) for item in value]
+  elif value.__class__ == tuple:
+    return tuple([InternStrings(item) for item in value])
+  return value
+
+
+def CallLoadTargetBuildFile(build_file_path, host_address):
+  """Wrapper around LoadTargetBuildFile for parallel processing.
+
+     This wrapper is used when LoadTargetBuildFile is executed in
+     a worker process.  |host_address| is the ServedPymodHostAddress() of the
+     main process.  Returns the marshalled result, None on error, or
+     (PYMOD_HOST_NEEDED, build_file_path) if the main process has to serve its
+     PymodHost before the file can be loaded.
+  """
 
+  try:
+    SetPymodHostAddress(host_address)
+    (variables, includes, depth, check) = parallel_loader_args
+    if expansion_log is not None:
+      del expansion_log[:]
+
+    # The main process makes sure that each build file is only loaded once,
+    # so there's no need to send over the set of loaded build files.  Included
+    # files are only loaded once per worker; they're never modified after
+    # loading.
+    data = {'target_build_files': set()}
+    aux_data = {}
+    for include, (include_data, include_aux_data) in \
+        parallel_loader_includes.iteritems():
+      if include != build_file_path:
+        data[include] = include_data
+        aux_data[include] = include_aux_data
     result = LoadTargetBuildFile(build_file_path, data,
                                  aux_data, variables,
                                  includes, depth, check, False)
@@ -468,29 +779,47 @@ def CallLoadTargetBuildFile(global_flags,
       return result
 
     (build_file_path, dependencies) = result
+    del data['target_build_files']
 
+    # Send the target build file along with the included files that this
+    # worker hasn't sent yet.
     data_out = {}
-    for key in data:
-      if key == 'target_build_files':
-        continue
-      if key not in data_keys:
-        data_out[key] = data[key]
     aux_data_out = {}
-    for key in aux_data:
-      if key not in aux_data_keys:
-        aux_data_out[key] = aux_data[key]
-
-    # This gets serialized and sent back to the main process via a pipe.
-    # It's handled in LoadTargetBuildFileCallback.
-    return (build_file_path,
-            data_out,
-            aux_data_out,
-            dependencies)
+    for key in data:
+      if key != build_file_path:
+        parallel_loader_includes[key] = (data[key], aux_data[key])
+        if key in parallel_loader_sent_includes:
+          continue
+        parallel_loader_sent_includes.add(key)
+      data_out[key] = data[key]
+      aux_data_out[key] = aux_data[key]
+
+    # This gets sent back to the main process via a pipe.  It's handled in
+    # LoadTargetBuildFileCallback.
+    return marshal.dumps(InternStrings((build_file_path,
+                                        data_out,
+                                        aux_data_out,
+                                        dependencies,
+                                        build_file_load_times[build_file_path],
+                                        expansion_log)) +
+                         (TakeAddedCacheEntries(), TakeCacheCounts(),
+                          gyp.stats.Take()),
+                         2)
+  except PymodHostNeeded:
+    # The prefetched results of the file are dropped along with the rest of
+    # this attempt.
+    StopCommandPrefetcher()
+    return (PYMOD_HOST_NEEDED, build_file_path)
   except Exception, e:
     print >>sys.stderr, 'Exception: ', e
     return None
 
 
+# What parallel workers return in place of a result when they raised
+# PymodHostNeeded.
+PYMOD_HOST_NEEDED = 'pymod host needed'
+
+
 class ParallelProcessingError(Exception):
   pass
 
@@ -519,10 +848,42 @@ class ParallelState(object):
     # The set of all build files that have been scheduled, so we don't
     # schedule the same one twice.
     self.scheduled = set()
-    # A list of dependency build file paths that haven't been scheduled yet.
-    self.dependencies = []
+    # Maps each scheduled build file that hasn't been handed to the pool yet
+    # to the number of loaded build files that depend on it.
+    self.waiting = {}
+    # A heap of (-dependents, sequence, build file) entries for the files in
+    # |waiting|, so that the files most others are waiting on get loaded
+    # first.  A file is pushed again each time its count goes up; entries
+    # that no longer match |waiting| are skipped.
+    self.queue = []
+    self.sequence = 0
     # Flag to indicate if there was an error in a child process.
     self.error = False
+    # The address the main process's PymodHost is served at, or None while
+    # no worker needed it.
+    self.pymod_host_address = None
+
+  def Schedule(self, build_file):
+    """Queues |build_file| for loading, or raises its priority if queued."""
+    if build_file in self.waiting:
+      self.waiting[build_file] += 1
+    elif build_file in self.scheduled:
+      return
+    else:
+      self.scheduled.add(build_file)
+      self.waiting[build_file] = 0
+    heapq.heappush(self.queue,
+                   (-self.waiting[build_file], self.sequence, build_file))
+    self.sequence += 1
+
+  def NextBuildFile(self):
+    """Returns the queued build file to load next, or None if there is none."""
+    while self.queue:
+      dependents, sequence, build_file = heapq.heappop(self.queue)
+      if self.waiting.get(build_file) == -dependents:
+        del self.waiting[build_file]
+        return build_file
+    return None
 
   def LoadTargetBuildFileCallback(self, result):
     """Handle the results of running LoadTargetBuildFile in another process.
@@ -533,35 +894,150 @@ class ParallelState(object):
       self.condition.notify()
       self.condition.release()
       return
-    (build_file_path0, data0, aux_data0, dependencies0) = result
+    if result.__class__ == tuple:
+      # The worker needs the PymodHost.  Serve it, and load the file again.
+      (needed, build_file_path0) = result
+      self.pymod_host_address = GetPymodHost().Serve()
+      self.scheduled.discard(build_file_path0)
+      self.Schedule(build_file_path0)
+      self.pending -= 1
+      self.condition.notify()
+      self.condition.release()
+      return
+    (build_file_path0, data0, aux_data0, dependencies0, load_time0,
+     expansion_log0, cache_entries0, cache_counts0,
+     stats0) = marshal.loads(result)
     self.data['target_build_files'].add(build_file_path0)
+    # Each worker sends every included file once, so several workers may
+    # send the same one.  Keep the first copy, but let a target build file
+    # replace its copy loaded as an include.
     for key in data0:
-      self.data[key] = data0[key]
-    for key in aux_data0:
-      self.aux_data[key] = aux_data0[key]
-    for new_dependency in dependencies0:
-      if new_dependency not in self.scheduled:
-        self.scheduled.add(new_dependency)
-        self.dependencies.append(new_dependency)
+      if key == build_file_path0 or key not in self.data:
+        self.data[key] = data0[key]
+        self.aux_data[key] = aux_data0[key]
+    build_file_load_times[build_file_path0] = load_time0
+    build_file_transport_sizes[build_file_path0] = len(result)
+    if expansion_log is not None:
+      expansion_log.extend(expansion_log0)
+    PutAddedCacheEntries(cache_entries0)
+    AddCacheCounts(cache_counts0)
+    gyp.stats.Merge(stats0)
+    for new_dependency in set(dependencies0):
+      self.Schedule(new_dependency)
     self.pending -= 1
     self.condition.notify()
     self.condition.release()
 
 
+def RecordAddedCacheEntries():
+  """Has the in-memory caches of a worker process record their new entries.
+
+  The entries would be lost along with the worker otherwise.
+  """
+  for name in worker_cache_names:
+    cache = globals()[name]
+    if isinstance(cache, gyp.disk_cache.MemoryCache):
+      cache.added = []
+
+
+def TakeAddedCacheEntries():
+  """Returns the (cache name, key, marshalled value) of each entry that the
+  in-memory caches recorded since the last call.
+  """
+  entries = []
+  for name in worker_cache_names:
+    added = getattr(globals()[name], 'added', None)
+    if added:
+      entries.extend((name, key, contents) for key, contents in added)
+      del added[:]
+  return entries
+
+
+def PutAddedCacheEntries(entries):
+  """Stores the |entries| from a worker's TakeAddedCacheEntries."""
+  for name, key, contents in entries:
+    globals()[name].PutMarshalled(key, contents)
+
+
+def TakeCacheCounts():
+  """Returns the hits and misses of the caches, and the counts of the realpath
+  cache, since the last call, and resets them.
+
+  Worker processes send these back to the main process, which adds them to its
+  own with AddCacheCounts.
+  """
+  cache_counts = []
+  for name in worker_cache_names:
+    cache = globals()[name]
+    if cache:
+      cache_counts.append((name, cache.hits, cache.misses))
+      cache.hits = cache.misses = 0
+  realpath_counts = dict(gyp.common.realpath_cache_stats)
+  for key in realpath_counts:
+    gyp.common.realpath_cache_stats[key] = 0
+  return (cache_counts, realpath_counts)
+
+
+def AddCacheCounts(counts):
+  """Adds the |counts| from a worker's TakeCacheCounts."""
+  (cache_counts, realpath_counts) = counts
+  for name, hits, misses in cache_counts:
+    cache = globals()[name]
+    cache.hits += hits
+    cache.misses += misses
+  for key, count in realpath_counts.iteritems():
+    gyp.common.realpath_cache_stats[key] += count
+
+
+def ParallelWorkerGlobals():
+  """Returns the globals that worker processes need to behave like this one.
+  """
+  global_flags = {
+    'path_sections': globals()['path_sections'],
+    'non_configuration_keys': globals()['non_configuration_keys'],
+    'multiple_toolsets': globals()['multiple_toolsets'],
+    'generator_filelist_path': globals()['generator_filelist_path'],
+    'parsed_build_file_cache': globals()['parsed_build_file_cache'],
+    'early_phase_cache': globals()['early_phase_cache'],
+    'gyp_sources_digest': GetGypSourcesDigest(),
+    'command_output_cache': globals()['command_output_cache'],
+    'command_jobs': globals()['command_jobs'],
+    # Threads and pipes don't survive the fork, so workers make their own
+    # prefetcher and reach the main process's PymodHost over a connection.
+    # The address of the host comes with each piece of work, once it's served.
+    'command_prefetcher': None,
+    'pymod_host': None,
+    'parallel_worker': True,
+    'pymod_host_address': None,
+    'expansion_log': None}
+  if expansion_log is not None:
+    # Workers send the entries they log back with each result.
+    global_flags['expansion_log'] = []
+  return global_flags
+
+
 def LoadTargetBuildFilesParallel(build_files, data, aux_data,
-                                 variables, includes, depth, check):
+                                 variables, includes, depth, check, jobs=None):
+  if not jobs:
+    try:
+      jobs = multiprocessing.cpu_count()
+    except NotImplementedError:
+      jobs = 8
+
   parallel_state = ParallelState()
   parallel_state.condition = threading.Condition()
-  # Make copies of the build_files argument that we can modify while working.
-  parallel_state.dependencies = list(build_files)
-  parallel_state.scheduled = set(build_files)
+  for build_file in sorted(build_files):
+    parallel_state.Schedule(build_file)
   parallel_state.pending = 0
   parallel_state.data = data
   parallel_state.aux_data = aux_data
+  parallel_state.pymod_host_address = ServedPymodHostAddress()
+
+  global_flags = ParallelWorkerGlobals()
 
   try:
     parallel_state.condition.acquire()
-    while parallel_state.dependencies or parallel_state.pending:
+    while parallel_state.queue or parallel_state.pending:
       if parallel_state.error:
         print >>sys.stderr, (
             '\n'
@@ -570,28 +1046,24 @@ def LoadTargetBuildFilesParallel(build_files, data, aux_data,
             'If the error only occurs when GYP_PARALLEL=1, '
             'please report a bug!')
         break
-      if not parallel_state.dependencies:
+      # Only hand the pool as many files as it has workers, so that files
+      # discovered in the meantime can still go ahead of the queued ones.
+      if not parallel_state.queue or parallel_state.pending >= jobs:
         parallel_state.condition.wait()
         continue
 
-      dependency = parallel_state.dependencies.pop()
+      dependency = parallel_state.NextBuildFile()
+      if dependency is None:
+        continue
 
       parallel_state.pending += 1
-      data_in = {}
-      data_in['target_build_files'] = data['target_build_files']
-      aux_data_in = {}
-      global_flags = {
-        'path_sections': globals()['path_sections'],
-        'non_configuration_keys': globals()['non_configuration_keys'],
-        'multiple_toolsets': globals()['multiple_toolsets']}
-
       if not parallel_state.pool:
-        parallel_state.pool = multiprocessing.Pool(8)
+        parallel_state.pool = multiprocessing.Pool(
+            jobs, InitParallelLoaderWorker,
+            (global_flags, variables, includes, depth, check))
       parallel_state.pool.apply_async(
           CallLoadTargetBuildFile,
-          args = (global_flags, dependency,
-                  data_in, aux_data_in,
-                  variables, includes, depth, check),
+          args = (dependency, parallel_state.pymod_host_address),
           callback = parallel_state.LoadTargetBuildFileCallback)
   except KeyboardInterrupt, e:
     parallel_state.pool.terminate()
@@ -599,7 +1071,11 @@ def LoadTargetBuildFilesParallel(build_files, data, aux_data,
 
   parallel_state.condition.release()
   if parallel_state.error:
+    parallel_state.pool.terminate()
     sys.exit()
+  if parallel_state.pool:
+    parallel_state.pool.close()
+    parallel_state.pool.join()
 
 
 # Look for the bracket that matches the first bracket seen in a
@@ -665,6 +1141,365 @@ latelate_variable_re = re.compile(
 # more then once.
 cached_command_results = {}
 
+# The command_output_cache keys that PrefetchCommands looked up without
+# finding them, so that ExpandVariables doesn't look them up again.
+prefetch_cache_misses = set()
+
+# An optional gyp.disk_cache.DiskCache of command outputs, kept across runs.
+# Set up by gyp_main when --cache-dir is given.  Only commands whose inputs
+# are declared with the command_cache_inputs variable are cached in it.
+command_output_cache = None
+
+
+def FingerprintCommandInputs(inputs, cwd):
+  """Returns a fingerprint of the command inputs listed in |inputs|.
+
+  Items starting with "$" name environment variables; other items are paths
+  relative to |cwd|.  Files are represented by the SHA-1 of their contents
+  and directories by their listing, so that commands that glob directories
+  can declare them.
+  """
+  fingerprint = []
+  for item in inputs:
+    if item.startswith('$'):
+      fingerprint.append((item, os.environ.get(item[1:])))
+      continue
+    path = os.path.join(cwd, item)
+    if os.path.isdir(path):
+      fingerprint.append((item, sorted(os.listdir(path))))
+    else:
+      try:
+        digest = hashlib.sha1(open(path, 'rb').read()).hexdigest()
+      except IOError:
+        digest = None
+      fingerprint.append((item, digest))
+  return fingerprint
+
+
+def GetCommandCacheKey(command_string, contents, build_file_dir, phase,
+                       variables, build_file):
+  """Returns the command_output_cache key of a command, or None.
+
+  Commands can only be cached if the variable command_cache_inputs lists
+  their inputs: the files, directories and "$" prefixed environment
+  variables whose contents determine the command's output, relative to the
+  build file.  The key covers the command, the directory it runs in and the
+  state of those inputs, so it changes whenever one of them does.
+  """
+  if not command_output_cache:
+    return None
+  command_inputs = GetCommandInputs(phase, variables, build_file,
+                                    build_file_dir)
+  if not command_inputs:
+    return None
+  (inputs, cwd) = command_inputs
+  return repr((command_string, contents, cwd,
+               FingerprintCommandInputs(inputs, cwd)))
+
+
+def GetCommandInputs(phase, variables, build_file, build_file_dir):
+  """Returns the (inputs, cwd) declared by command_cache_inputs, or None.
+
+  |inputs| is the expanded command_cache_inputs list and |cwd| the absolute
+  directory its paths are relative to, as FingerprintCommandInputs takes them.
+  """
+  if 'command_cache_inputs' not in variables:
+    return None
+  inputs = variables['command_cache_inputs']
+  if isinstance(inputs, list):
+    inputs = inputs[:]
+  else:
+    inputs = [inputs]
+  ProcessVariablesAndConditionsInList(inputs, phase, variables, build_file)
+  inputs = [str(item) for item in inputs]
+  return (inputs, os.path.abspath(build_file_dir or os.curdir))
+
+
+# The number of <!() commands that may run at once.  Above one,
+# PrefetchCommands starts the commands found in build files on that many
+# threads ahead of variable expansion, and ExpandVariables picks up their
+# results instead of running the commands itself.  It also sizes the pool of
+# pymod_do_main hosts.
+command_jobs = 1
+
+# The CommandPrefetcher used when command_jobs is above one.  Created on first
+# use, so that parallel loader workers get their own.
+command_prefetcher = None
+
+def StopCommandPrefetcher():
+  """Stops command_prefetcher, if there is one, and forgets it."""
+  global command_prefetcher
+  if command_prefetcher:
+    command_prefetcher.Stop()
+    command_prefetcher = None
+
+
+# The gyp.pymod_host.PymodHost running <!pymod_do_main() calls, or in parallel
+# workers a PymodClient of the main process's host.  Created on first use by
+# GetPymodHost.
+pymod_host = None
+
+# Whether this is a worker process of a parallel loader or target pool.
+parallel_worker = False
+
+# In parallel workers, the address of the main process's PymodHost, or None
+# while the main process doesn't serve it.  It only does once a worker needs
+# it, so that loads without <!pymod_do_main() don't pay for the listener.
+pymod_host_address = None
+
+
+class PymodHostNeeded(Exception):
+  """Raised in a parallel worker that needs the main process's PymodHost
+  before the main process serves it.
+
+  The main process serves it then and hands the work out again.
+  """
+  pass
+
+
+def GetPymodHost():
+  """Returns pymod_host, creating it if needed."""
+  global pymod_host
+  if pymod_host is None:
+    if parallel_worker:
+      if not pymod_host_address:
+        raise PymodHostNeeded()
+      pymod_host = gyp.pymod_host.PymodClient(pymod_host_address)
+    else:
+      pymod_host = gyp.pymod_host.PymodHost(command_jobs)
+  return pymod_host
+
+
+def SetPymodHostAddress(address):
+  """Has a parallel worker reach the main process's PymodHost at |address|,
+  unless it's None.
+  """
+  global pymod_host_address
+  if address:
+    pymod_host_address = address
+
+
+def ServedPymodHostAddress():
+  """Returns the address pymod_host is served at, or None if it isn't."""
+  return pymod_host and pymod_host.address
+
+
+def RunShellCommand(command, cwd):
+  """Runs |command| through the shell.  Returns (returncode, stdout, stderr).
+  """
+  # CommandPrefetcher runs several commands at once.  Each must see the end of
+  # its output when it exits, not when the commands it was started alongside
+  # exit, so they mustn't inherit each other's pipes.
+  p = subprocess.Popen(command, shell=True,
+                       stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE,
+                       stdin=subprocess.PIPE,
+                       cwd=cwd,
+                       close_fds=(sys.platform != 'win32'))
+  p_stdout, p_stderr = p.communicate('')
+  return (p.wait(), p_stdout, p_stderr)
+
+
+def CallPymodDoMain(contents, cwd):
+  """Runs <!pymod_do_main(|contents|) in |cwd| and returns its output.
+
+  |contents| is "modulename param eters"; the module's DoMain() gets
+  ["param", "eters"] as a single list argument.  The call runs in a
+  gyp.pymod_host host process.
+  """
+  parsed_contents = shlex.split(contents)
+  return GetPymodHost().Call(os.path.abspath(cwd or os.curdir),
+                             parsed_contents[0], parsed_contents[1:])
+
+
+class CommandPrefetcher(object):
+  """Runs commands for ExpandVariables on a bounded set of threads.
+
+  Commands are identified by a key that ExpandVariables can rebuild when it
+  gets to them.  Each result is handed out once; ExpandVariables then reports
+  failures and caches output just as if it had run the command itself.
+  """
+
+  def __init__(self, jobs):
+    self.queue = Queue.Queue()
+    self.condition = threading.Condition()
+    # Maps keys to the (return value, exception) of their commands, or to
+    # None while the command is running.
+    self.results = {}
+    self.threads = []
+    for i in xrange(jobs):
+      thread = threading.Thread(target=self._Work)
+      thread.daemon = True
+      thread.start()
+      self.threads.append(thread)
+
+  def Start(self, key, function, *args):
+    """Queues a call of |function| with |args| unless |key| is queued."""
+    self.condition.acquire()
+    try:
+      if key in self.results:
+        return
+      self.results[key] = None
+    finally:
+      self.condition.release()
+    self.queue.put((key, function, args))
+
+  def Stop(self):
+    """Drops the commands not yet started and waits for the threads to exit.
+
+    Commands already running are waited for, so that none of them is still
+    running when the interpreter shuts down.
+    """
+    try:
+      while True:
+        self.queue.get_nowait()
+    except Queue.Empty:
+      pass
+    for thread in self.threads:
+      self.queue.put(None)
+    for thread in self.threads:
+      thread.join()
+    self.results.clear()
+
+  def _Work(self):
+    while True:
+      work = self.queue.get()
+      if work is None:
+        return
+      key, function, args = work
+      try:
+        result = (function(*args), None)
+      except Exception, e:
+        result = (None, e)
+      self.condition.acquire()
+      try:
+        # Discarded results aren't kept.
+        if key in self.results:
+          self.results[key] = result
+          self.condition.notifyAll()
+      finally:
+        self.condition.release()
+
+  def Take(self, key):
+    """Returns the return value of a started command, or raises its error.
+
+    Waits for the command to finish if needed.  Returns None if the command
+    wasn't started.
+    """
+    self.condition.acquire()
+    try:
+      if key not in self.results:
+        return None
+      while self.results[key] is None:
+        self.condition.wait()
+      value, error = self.results.pop(key)
+    finally:
+      self.condition.release()
+    if error:
+      raise error
+    return value
+
+  def Discard(self, key):
+    """Drops the result of a started command that won't be taken."""
+    self.condition.acquire()
+    try:
+      self.results.pop(key, None)
+    finally:
+      self.condition.release()
+
+
+def PrefetchCommands(the_dict, phase, variables, build_file):
+  """Starts the commands that expanding |the_dict| will run.
+
+  Only commands whose command lines need no further expansion are started.
+  Conditions sections are skipped, so that commands are only run if their
+  condition holds; ProcessConditionsInDict prefetches the dicts it merges.
+  Commands whose output command_output_cache has, going by the
+  command_cache_inputs of |variables| and of |the_dict| itself, aren't run;
+  their output goes into cached_command_results instead.  Does nothing unless
+  command_jobs is above one.
+  """
+  global command_prefetcher
+  if command_jobs <= 1:
+    return
+  if command_prefetcher is None:
+    command_prefetcher = CommandPrefetcher(command_jobs)
+
+  if phase == PHASE_EARLY:
+    variable_re = early_variable_re
+    expansion_symbol = '<'
+    conditions_key = 'conditions'
+  elif phase == PHASE_LATE:
+    variable_re = late_variable_re
+    expansion_symbol = '>'
+    conditions_key = 'target_conditions'
+  elif phase == PHASE_LATELATE:
+    variable_re = latelate_variable_re
+    expansion_symbol = '^'
+    conditions_key = None
+  else:
+    assert False
+
+  cache_variables = None
+  if command_output_cache:
+    cache_variables = VariableScope(variables)
+    own_variables = the_dict.get('variables')
+    if isinstance(own_variables, dict):
+      if 'command_cache_inputs' in own_variables:
+        cache_variables['command_cache_inputs'] = \
+            own_variables['command_cache_inputs']
+      elif ('command_cache_inputs%' in own_variables and
+            'command_cache_inputs' not in variables):
+        cache_variables['command_cache_inputs'] = \
+            own_variables['command_cache_inputs%']
+
+  # Mirror the directory ExpandVariables runs commands in.
+  build_file_dir = os.path.dirname(build_file) or None
+  command_prefix = expansion_symbol + '!'
+  stack = [the_dict]
+  while stack:
+    value = stack.pop()
+    if isinstance(value, dict):
+      for key, item in value.iteritems():
+        if key != conditions_key and not isinstance(item, int):
+          stack.append(item)
+    elif isinstance(value, list):
+      stack.extend(value)
+    elif isinstance(value, str) and command_prefix in value:
+      template = GetExpansionTemplate(value, phase, variable_re,
+                                      expansion_symbol)
+      for (match, replace_start, replace_end, contents,
+           contents_expanded) in template:
+        command_string = match['command_string']
+        if (not contents_expanded or '!' not in match['type'] or
+            match['is_array']):
+          continue
+        # Mirror the command ExpandVariables looks for.
+        contents = contents.strip()
+        if contents in cached_command_results:
+          continue
+        if cache_variables is not None:
+          try:
+            cache_key = GetCommandCacheKey(command_string, contents,
+                                           build_file_dir, phase,
+                                           cache_variables, build_file)
+          except (GypError, KeyError):
+            # The inputs refer to variables that aren't in scope yet.
+            cache_key = None
+          if cache_key:
+            cached_value = command_output_cache.Get(cache_key)
+            if cached_value is not None:
+              cached_command_results[contents] = cached_value
+              continue
+            prefetch_cache_misses.add(cache_key)
+        if command_string == 'pymod_do_main':
+          command_prefetcher.Start((command_string, contents, build_file_dir),
+                                   CallPymodDoMain, contents, build_file_dir)
+        elif not command_string:
+          command = FixupPlatformCommand(contents)
+          command_prefetcher.Start((command_string, command, build_file_dir),
+                                   RunShellCommand, command, build_file_dir)
+
 
 def FixupPlatformCommand(cmd):
   if sys.platform == 'win32':
@@ -679,8 +1514,86 @@ PHASE_EARLY = 0
 PHASE_LATE = 1
 PHASE_LATELATE = 2
 
+# Parsed expansion templates (see GetExpansionTemplate), keyed by input string
+# and phase.  The cache keeps two generations of at most
+# expansion_template_cache_size entries each: lookups that hit the older
+# generation move the entry to the newer one, and the older generation is
+# dropped when the newer one fills up, which approximates LRU eviction.
+expansion_template_cache_size = 65536
+expansion_templates = {}
+old_expansion_templates = {}
+
+
+def FindReplacement(input_str, replace_start):
+  """Returns (replace_end, contents) for a match starting at replace_start.
+
+  The variable regular expressions don't match the entire reference if it
+  contains nested references, so the end is found by matching brackets.
+  """
+  # Find the ending paren, and re-evaluate the contained string.
+  (c_start, c_end) = FindEnclosingBracketGroup(input_str[replace_start:])
+
+  # Adjust the replacement range to match the entire command
+  # found by FindEnclosingBracketGroup (since the variable_re
+  # probably doesn't match the entire command if it contained
+  # nested variables).
+  replace_end = replace_start + c_end
+
+  # Figure out what the contents of the variable parens are.
+  contents_start = replace_start + c_start + 1
+  contents_end = replace_end - 1
+  return (replace_end, input_str[contents_start:contents_end])
+
+
+def GetExpansionTemplate(input_str, phase, variable_re, expansion_symbol):
+  """Returns the parsed form of |input_str| used by ExpandVariables.
+
+  That is a tuple with one (match, replace_start, replace_end, contents,
+  contents_expanded) entry for each variable reference in |input_str|, in
+  right-to-left order.  match is the reference's regular expression groupdict.
+  replace_end and contents are None if they depend on the replacement of
+  references further right (when the bracket group started by this reference
+  extends past the start of the next one); ExpandVariables then finds them
+  in the partially expanded string.  contents_expanded is set if contents
+  don't need to be expanded any further.
+
+  Templates are cached, so each distinct string is only parsed once.
+  """
+  global expansion_templates, old_expansion_templates
+  key = (input_str, phase)
+  template = expansion_templates.get(key)
+  if template is not None:
+    return template
+  template = old_expansion_templates.pop(key, None)
+  if template is None:
+    matches = list(variable_re.finditer(input_str))
+    entries = []
+    next_start = len(input_str)
+    for match_group in reversed(matches):
+      replace_start = match_group.start('replace')
+      (replace_end, contents) = FindReplacement(input_str, replace_start)
+      contents_expanded = False
+      if replace_end < replace_start or replace_end > next_start:
+        replace_end = None
+        contents = None
+      elif (expansion_symbol not in contents and
+            not IsStrCanonicalInt(contents)):
+        contents_expanded = True
+      entries.append((match_group.groupdict(), replace_start, replace_end,
+                      contents, contents_expanded))
+      next_start = replace_start
+    template = tuple(entries)
+
+  if expansion_template_cache_size:
+    if len(expansion_templates) >= expansion_template_cache_size:
+      old_expansion_templates = expansion_templates
+      expansion_templates = {}
+    expansion_templates[key] = template
+  return template
+
 
 def ExpandVariables(input, phase, variables, build_file):
+  gyp.stats.counts['ExpandVariables calls'] += 1
   # Look for the pattern that gets expanded into variables
   if phase == PHASE_EARLY:
     variable_re = early_variable_re
@@ -702,20 +1615,18 @@ def ExpandVariables(input, phase, variables, build_file):
   if expansion_symbol not in input_str:
     return input_str
 
-  # Get the entire list of matches as a list of MatchObject instances.
-  # (using findall here would return strings instead of MatchObjects).
-  matches = list(variable_re.finditer(input_str))
-  if not matches:
+  template = GetExpansionTemplate(input_str, phase, variable_re,
+                                  expansion_symbol)
+  if not template:
     return input_str
 
   output = input_str
-  # Reverse the list of matches so that replacements are done right-to-left.
-  # That ensures that earlier replacements won't mess up the string in a
-  # way that causes later calls to find the earlier substituted text instead
-  # of what's intended for replacement.
-  matches.reverse()
-  for match_group in matches:
-    match = match_group.groupdict()
+  # The template lists the matches right-to-left, so that replacements are
+  # done right-to-left.  That ensures that earlier replacements won't mess up
+  # the string in a way that causes later calls to find the earlier
+  # substituted text instead of what's intended for replacement.
+  for (match, replace_start, replace_end, contents,
+       contents_expanded) in template:
     gyp.DebugOutput(gyp.DEBUG_VARIABLES, "Matches: %r", match)
     # match['replace'] is the substring to look for, match['type']
     # is the character code for the replacement type (< > <! >! <| >| <@
@@ -731,38 +1642,29 @@ def ExpandVariables(input, phase, variables, build_file):
     # file_list is true if a | variant is used.
     file_list = '|' in match['type']
 
-    # Capture these now so we can adjust them later.
-    replace_start = match_group.start('replace')
-    replace_end = match_group.end('replace')
-
-    # Find the ending paren, and re-evaluate the contained string.
-    (c_start, c_end) = FindEnclosingBracketGroup(input_str[replace_start:])
-
-    # Adjust the replacement range to match the entire command
-    # found by FindEnclosingBracketGroup (since the variable_re
-    # probably doesn't match the entire command if it contained
-    # nested variables).
-    replace_end = replace_start + c_end
+    if replace_end is None:
+      (replace_end, contents) = FindReplacement(input_str, replace_start)
 
     # Find the "real" replacement, matching the appropriate closing
-    # paren, and adjust the replacement start and end.
+    # paren.
     replacement = input_str[replace_start:replace_end]
 
-    # Figure out what the contents of the variable parens are.
-    contents_start = replace_start + c_start + 1
-    contents_end = replace_end - 1
-    contents = input_str[contents_start:contents_end]
-
     # Do filter substitution now for <|().
     # Admittedly, this is different than the evaluation order in other
     # contexts. However, since filtration has no chance to run on <|(),
     # this seems like the only obvious way to give them access to filters.
     if file_list:
-      processed_variables = copy.deepcopy(variables)
+      if isinstance(variables, VariableScope):
+        processed_variables = copy.deepcopy(variables.Flatten())
+      else:
+        processed_variables = copy.deepcopy(variables)
       ProcessListFiltersInDict(contents, processed_variables)
       # Recurse to expand variables in the contents
       contents = ExpandVariables(contents, phase,
                                  processed_variables, build_file)
+    elif contents_expanded:
+      # There's nothing to expand in the contents.
+      pass
     else:
       # Recurse to expand variables in the contents
       contents = ExpandVariables(contents, phase, variables, build_file)
@@ -795,6 +1697,9 @@ def ExpandVariables(input, phase, variables, build_file):
     # This works around actions/rules which have more inputs than will
     # fit on the command line.
     if file_list:
+      if expansion_log is not None:
+        # The file has to be written, so this has to run every time.
+        expansion_log.append(None)
       if type(contents) == list:
         contents_list = contents
       else:
@@ -816,6 +1721,13 @@ def ExpandVariables(input, phase, variables, build_file):
         contents = eval(contents)
         use_shell = False
 
+      if expansion_log is not None:
+        command_inputs = GetCommandInputs(phase, variables, build_file,
+                                          build_file_dir)
+        if command_inputs:
+          command_inputs += (FingerprintCommandInputs(*command_inputs),)
+        expansion_log.append(command_inputs)
+
       # Check for a cached value to avoid executing commands, or generating
       # file lists more than once.
       # TODO(http://code.google.com/p/gyp/issues/detail?id=112): It is
@@ -829,7 +1741,19 @@ def ExpandVariables(input, phase, variables, build_file):
       # command's output so it is run every time.
       cache_key = str(contents)
       cached_value = cached_command_results.get(cache_key, None)
+      persistent_cache_key = None
       if cached_value is None:
+        persistent_cache_key = GetCommandCacheKey(
+            command_string, contents, build_file_dir, phase, variables,
+            build_file)
+        if persistent_cache_key in prefetch_cache_misses:
+          prefetch_cache_misses.discard(persistent_cache_key)
+        elif persistent_cache_key:
+          cached_value = command_output_cache.Get(persistent_cache_key)
+          if cached_value is not None:
+            cached_command_results[cache_key] = cached_value
+      if cached_value is None:
+        gyp.stats.counts['commands run'] += 1
         gyp.DebugOutput(gyp.DEBUG_VARIABLES,
                         "Executing command '%s' in directory '%s'",
                         contents, build_file_dir)
@@ -842,45 +1766,57 @@ def ExpandVariables(input, phase, variables, build_file):
           # passing ["param", "eters"] as a single list argument. For modules
           # that don't load quickly, this can be faster than
           # <!(python modulename param eters). Do this in |build_file_dir|.
-          oldwd = os.getcwd()  # Python doesn't like os.open('.'): no fchdir.
-          if build_file_dir:  # build_file_dir may be None (see above).
-            os.chdir(build_file_dir)
-          try:
-
-            parsed_contents = shlex.split(contents)
-            try:
-              py_module = __import__(parsed_contents[0])
-            except ImportError as e:
-              raise GypError("Error importing pymod_do_main"
-                             "module (%s): %s" % (parsed_contents[0], e))
-            replacement = str(py_module.DoMain(parsed_contents[1:])).rstrip()
-          finally:
-            os.chdir(oldwd)
-          assert replacement != None
+          replacement = None
+          if command_prefetcher:
+            replacement = command_prefetcher.Take(
+                (command_string, contents, build_file_dir))
+          if replacement is None:
+            replacement = CallPymodDoMain(contents, build_file_dir)
         elif command_string:
           raise GypError("Unknown command string '%s' in '%s'." %
                          (command_string, contents))
         else:
           # Fix up command with platform specific workarounds.
           contents = FixupPlatformCommand(contents)
-          p = subprocess.Popen(contents, shell=use_shell,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE,
-                               stdin=subprocess.PIPE,
-                               cwd=build_file_dir)
-
-          p_stdout, p_stderr = p.communicate('')
-
-          if p.wait() != 0 or p_stderr:
+          result = None
+          if use_shell and command_prefetcher:
+            result = command_prefetcher.Take(
+                (command_string, contents, build_file_dir))
+          if result:
+            (returncode, p_stdout, p_stderr) = result
+          else:
+            # Prefetched commands may be running, see RunShellCommand.
+            p = subprocess.Popen(contents, shell=use_shell,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 stdin=subprocess.PIPE,
+                                 cwd=build_file_dir,
+                                 close_fds=(sys.platform != 'win32'))
+
+            p_stdout, p_stderr = p.communicate('')
+            returncode = p.wait()
+
+          if returncode != 0 or p_stderr:
             sys.stderr.write(p_stderr)
             # Simulate check_call behavior, since check_call only exists
             # in python 2.5 and later.
             raise GypError("Call to '%s' returned exit status %d." %
-                           (contents, p.returncode))
+                           (contents, returncode))
           replacement = p_stdout.rstrip()
 
         cached_command_results[cache_key] = replacement
+        if persistent_cache_key:
+          command_output_cache.Put(persistent_cache_key, replacement)
       else:
+        gyp.stats.counts['command results reused'] += 1
+        if command_prefetcher and use_shell:
+          # PrefetchCommands may have started the command before its output
+          # was known.
+          prefetch_command = contents
+          if not command_string:
+            prefetch_command = FixupPlatformCommand(contents)
+          command_prefetcher.Discard(
+              (command_string, prefetch_command, build_file_dir))
         gyp.DebugOutput(gyp.DEBUG_VARIABLES,
                         "Had cache value for command '%s' in directory '%s'",
                         contents,build_file_dir)
@@ -984,6 +1920,78 @@ def ExpandVariables(input, phase, variables, build_file):
   return output
 
 
+# Maps condition expressions to their (code object, variable names), as
+# returned by CompileCondition.
+cached_conditions_asts = {}
+
+# The results of conditions whose value only depends on the variables they
+# read, keyed by the condition followed by the values of those variables.
+# Cleared when it grows past condition_result_cache_size entries.
+cached_condition_results = {}
+condition_result_cache_size = 65536
+
+# The syntax of conditions whose results can be cached: comparisons, boolean
+# operators and literals.
+cacheable_condition_nodes = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not,
+    ast.Compare, ast.Eq, ast.NotEq, ast.In, ast.NotIn, ast.Name, ast.Load,
+    ast.Str, ast.Num, ast.List, ast.Tuple)
+
+
+def CompileCondition(cond_expr):
+  """Returns (code, names) for the condition expression |cond_expr|.
+
+  code is the compiled expression.  names is the sorted tuple of variables
+  the condition reads if it's limited to the syntax in
+  cacheable_condition_nodes, so that its value only depends on theirs, and
+  None otherwise.  Raises SyntaxError for invalid expressions.
+  """
+  compiled = cached_conditions_asts.get(cond_expr)
+  if compiled is None:
+    code = compile(cond_expr, '<string>', 'eval')
+    names = set()
+    for node in ast.walk(ast.parse(cond_expr, mode='eval')):
+      if not isinstance(node, cacheable_condition_nodes):
+        names = None
+        break
+      if isinstance(node, ast.Name):
+        names.add(node.id)
+    if names is not None:
+      names = tuple(sorted(names))
+    compiled = (code, names)
+    cached_conditions_asts[cond_expr] = compiled
+  return compiled
+
+
+def EvalCondition(cond_expr, variables):
+  """Returns whether the condition expression |cond_expr| holds.
+
+  Raises SyntaxError for invalid expressions and NameError if the condition
+  reads an undefined variable, like eval() does.
+  """
+  gyp.stats.counts['EvalCondition calls'] += 1
+  (code, names) = CompileCondition(cond_expr)
+  key = None
+  if names is not None:
+    try:
+      key = (cond_expr,) + tuple([variables[name] for name in names])
+      result = cached_condition_results.get(key)
+    except (KeyError, TypeError):
+      # Undefined variables are reported by eval() below.  Lists aren't
+      # hashable, so conditions on them aren't cached.
+      key = None
+    else:
+      if result is not None:
+        return result
+
+  result = bool(eval(code, {'__builtins__': None}, variables))
+  if key is not None:
+    if len(cached_condition_results) >= condition_result_cache_size:
+      cached_condition_results.clear()
+    cached_condition_results[key] = result
+  return result
+
+
 def ProcessConditionsInDict(the_dict, phase, variables, build_file):
   # Process a 'conditions' or 'target_conditions' section in the_dict,
   # depending on phase.
@@ -1044,9 +2052,7 @@ def ProcessConditionsInDict(the_dict, phase, variables, build_file):
             'only, found ' + expanded.__class__.__name__
 
     try:
-      ast_code = compile(cond_expr_expanded, '<string>', 'eval')
-
-      if eval(ast_code, {'__builtins__': None}, variables):
+      if EvalCondition(cond_expr_expanded, variables):
         merge_dict = true_dict
       else:
         merge_dict = false_dict
@@ -1064,12 +2070,78 @@ def ProcessConditionsInDict(the_dict, phase, variables, build_file):
     if merge_dict != None:
       # Expand variables and nested conditinals in the merge_dict before
       # merging it.
+      PrefetchCommands(merge_dict, phase, variables, build_file)
       ProcessVariablesAndConditionsInDict(merge_dict, phase,
                                           variables, build_file)
 
       MergeDicts(the_dict, merge_dict, build_file, build_file)
 
 
+class VariableScope(object):
+  """The variables visible while processing a dict.
+
+  Reads and writes like a dict.  A scope layers its own variables over |base|,
+  the dict of variables that ProcessVariablesAndConditionsInDict was first
+  called with, possibly a RecordingVariables.  |base| is shared by all the
+  scopes nested in it and never modified through them, so creating a nested
+  scope only copies the variables that the enclosing scopes defined
+  themselves (automatics and "variables" dicts), not everything that is in
+  scope.
+  """
+
+  __slots__ = ('base', 'local')
+
+  def __init__(self, parent):
+    """Creates a scope with the same variables as the dict or scope |parent|.
+
+    Changes to the new scope don't affect |parent|.
+    """
+    if isinstance(parent, VariableScope):
+      self.base = parent.base
+      self.local = parent.local.copy()
+    else:
+      self.base = parent
+      self.local = {}
+
+  def __getitem__(self, key):
+    local = self.local
+    if key in local:
+      return local[key]
+    return self.base[key]
+
+  def __setitem__(self, key, value):
+    self.local[key] = value
+
+  def __contains__(self, key):
+    return key in self.local or key in self.base
+
+  def get(self, key, default=None):
+    if key in self:
+      return self[key]
+    return default
+
+  def copy(self):
+    return VariableScope(self)
+
+  def Flatten(self):
+    """Returns a plain dict of all the variables in scope."""
+    variables = self.base.copy()
+    variables.update(self.local)
+    return variables
+
+  def iteritems(self):
+    return self.Flatten().iteritems()
+
+  def keys(self):
+    return self.Flatten().keys()
+
+  def __iter__(self):
+    return iter(self.Flatten())
+
+  def __len__(self):
+    return len(self.Flatten())
+
+
 def LoadAutomaticVariablesFromDict(variables, the_dict):
   # Any keys with plain string values in the_dict become automatic variables.
   # The variable name is the key name with a "_" character prepended.
@@ -1113,13 +2185,13 @@ def ProcessVariablesAndConditionsInDict(the_dict, phase, variables_in,
   """Handle all variable and command expansion and conditional evaluation.
 
   This function is the public entry point for all variable expansions and
-  conditional evaluations.  The variables_in dictionary will not be modified
-  by this function.
+  conditional evaluations.  The variables_in dictionary (or VariableScope)
+  will not be modified by this function.
   """
 
   # Make a copy of the variables_in dict that can be modified during the
   # loading of automatics and the loading of the variables dict.
-  variables = variables_in.copy()
+  variables = VariableScope(variables_in)
   LoadAutomaticVariablesFromDict(variables, the_dict)
 
   if 'variables' in the_dict:
@@ -1152,7 +2224,7 @@ def ProcessVariablesAndConditionsInDict(the_dict, phase, variables_in,
 
   # Variable expansion may have resulted in changes to automatics.  Reload.
   # TODO(mark): Optimization: only reload if no changes were made.
-  variables = variables_in.copy()
+  variables = VariableScope(variables_in)
   LoadAutomaticVariablesFromDict(variables, the_dict)
   LoadVariablesFromVariablesDict(variables, the_dict, the_dict_key)
 
@@ -1192,7 +2264,7 @@ def ProcessVariablesAndConditionsInDict(the_dict, phase, variables_in,
 
   # Conditional processing may have resulted in changes to automatics or the
   # variables dict.  Reload.
-  variables = variables_in.copy()
+  variables = VariableScope(variables_in)
   LoadAutomaticVariablesFromDict(variables, the_dict)
   LoadVariablesFromVariablesDict(variables, the_dict, the_dict_key)
 
@@ -1319,6 +2391,28 @@ def QualifyDependencies(targets):
                          ' of ' + target + ', but not in dependencies')
 
 
+def BuildWildcardIndex(build_file, build_file_dict):
+  """Returns the wildcard expansions available in |build_file|.
+
+  The result maps (target_name, toolset) pairs, where either element may be
+  '*', to the qualified names of the targets the pair matches, in the order
+  that the targets appear in |build_file_dict|.  Targets that set
+  "suppress_wildcard" are left out of every entry.
+  """
+  index = {}
+  for target_dict in build_file_dict['targets']:
+    if int(target_dict.get('suppress_wildcard', False)):
+      continue
+    target_name = target_dict['target_name']
+    toolset = target_dict['toolset']
+    qualified_target = gyp.common.QualifiedTarget(build_file, target_name,
+                                                  toolset)
+    for key in ((target_name, toolset), (target_name, '*'), ('*', toolset),
+                ('*', '*')):
+      index.setdefault(key, []).append(qualified_target)
+  return index
+
+
 def ExpandWildcardDependencies(targets, data):
   """Expands dependencies specified as build_file:*.
 
@@ -1335,21 +2429,26 @@ def ExpandWildcardDependencies(targets, data):
   dependency list, must be qualified when this function is called.
   """
 
+  # Maps build files to their BuildWildcardIndex, built on first use.
+  wildcard_indices = {}
+
   for target, target_dict in targets.iteritems():
-    toolset = target_dict['toolset']
     target_build_file = gyp.common.BuildFile(target)
     for dependency_key in dependency_sections:
-      dependencies = target_dict.get(dependency_key, [])
+      dependencies = target_dict.get(dependency_key)
+      if not dependencies:
+        continue
 
-      # Loop this way instead of "for dependency in" or "for index in xrange"
-      # because the dependencies list will be modified within the loop body.
-      index = 0
-      while index < len(dependencies):
+      # Build the expanded list on the side and splice it in once, so that
+      # lists with many wildcards don't shift their tail for every insertion.
+      expanded = None
+      for index, dependency in enumerate(dependencies):
         (dependency_build_file, dependency_target, dependency_toolset) = \
-            gyp.common.ParseQualifiedTarget(dependencies[index])
+            gyp.common.ParseQualifiedTarget(dependency)
         if dependency_target != '*' and dependency_toolset != '*':
           # Not a wildcard.  Keep it moving.
-          index = index + 1
+          if expanded is not None:
+            expanded.append(dependency)
           continue
 
         if dependency_build_file == target_build_file:
@@ -1358,34 +2457,18 @@ def ExpandWildcardDependencies(targets, data):
           raise GypError('Found wildcard in ' + dependency_key + ' of ' +
                          target + ' referring to same build file')
 
-        # Take the wildcard out and adjust the index so that the next
-        # dependency in the list will be processed the next time through the
-        # loop.
-        del dependencies[index]
-        index = index - 1
-
-        # Loop through the targets in the other build file, adding them to
-        # this target's list of dependencies in place of the removed
-        # wildcard.
-        dependency_target_dicts = data[dependency_build_file]['targets']
-        for dependency_target_dict in dependency_target_dicts:
-          if int(dependency_target_dict.get('suppress_wildcard', False)):
-            continue
-          dependency_target_name = dependency_target_dict['target_name']
-          if (dependency_target != '*' and
-              dependency_target != dependency_target_name):
-            continue
-          dependency_target_toolset = dependency_target_dict['toolset']
-          if (dependency_toolset != '*' and
-              dependency_toolset != dependency_target_toolset):
-            continue
-          dependency = gyp.common.QualifiedTarget(dependency_build_file,
-                                                  dependency_target_name,
-                                                  dependency_target_toolset)
-          index = index + 1
-          dependencies.insert(index, dependency)
+        if expanded is None:
+          expanded = dependencies[:index]
+        wildcard_index = wildcard_indices.get(dependency_build_file)
+        if wildcard_index is None:
+          wildcard_index = BuildWildcardIndex(dependency_build_file,
+                                              data[dependency_build_file])
+          wildcard_indices[dependency_build_file] = wildcard_index
+        expanded.extend(wildcard_index.get(
+            (dependency_target, dependency_toolset), []))
 
-        index = index + 1
+      if expanded is not None:
+        dependencies[:] = expanded
 
 
 def Unify(l):
@@ -1439,6 +2522,11 @@ class DependencyGraphNode(object):
     self.ref = ref
     self.dependencies = []
     self.dependents = []
+    # Memoized results of DeepDependencies and of _LinkDependenciesInternal
+    # for dependents (keyed by include_shared_libraries), as tuples.  The
+    # graph must not change once these have been computed.
+    self._deep_dependencies = None
+    self._link_contributions = {}
 
   def __repr__(self):
     return '<DependencyGraphNode: %r>' % self.ref
@@ -1450,44 +2538,47 @@ class DependencyGraphNode(object):
     # dependents.
     flat_list = []
 
-    # in_degree_zeros is the list of DependencyGraphNodes that have no
-    # dependencies not in flat_list.  Initially, it is a copy of the children
-    # of this node, because when the graph was built, nodes with no
-    # dependencies were made implicit dependents of the root node.
-    in_degree_zeros = set(self.dependents[:])
+    # in_degree_zeros is a heap of the (ref, DependencyGraphNode) pairs of
+    # nodes that have no dependencies not in flat_list.  Initially, it holds
+    # the children of this node, because when the graph was built, nodes with
+    # no dependencies were made implicit dependents of the root node.  Taking
+    # the smallest ref first makes the order independent of how the graph was
+    # built, so that generators produce identical output from run to run.
+    in_degree_zeros = [(node.ref, node) for node in set(self.dependents)]
+    heapq.heapify(in_degree_zeros)
+
+    # Maps nodes seen as dependents to the number of their dependencies not
+    # in flat_list yet.
+    in_degrees = {}
 
     while in_degree_zeros:
       # Nodes in in_degree_zeros have no dependencies not in flat_list, so they
-      # can be appended to flat_list.  Take these nodes out of in_degree_zeros
-      # as work progresses, so that the next node to process from the list can
-      # always be accessed at a consistent position.
-      node = in_degree_zeros.pop()
-      flat_list.append(node.ref)
-
-      # Look at dependents of the node just added to flat_list.  Some of them
-      # may now belong in in_degree_zeros.
+      # can be appended to flat_list.
+      ref, node = heapq.heappop(in_degree_zeros)
+      flat_list.append(ref)
+
+      # Look at dependents of the node just added to flat_list.  Once all of a
+      # dependent's dependencies are in flat_list, it belongs in
+      # in_degree_zeros.  Nodes in a cycle never get there, which is how
+      # callers detect cycles.
       for node_dependent in node.dependents:
-        is_in_degree_zero = True
-        for node_dependent_dependency in node_dependent.dependencies:
-          if not node_dependent_dependency.ref in flat_list:
-            # The dependent one or more dependencies not in flat_list.  There
-            # will be more chances to add it to flat_list when examining
-            # it again as a dependent of those other dependencies, provided
-            # that there are no cycles.
-            is_in_degree_zero = False
-            break
-
-        if is_in_degree_zero:
-          # All of the dependent's dependencies are already in flat_list.  Add
-          # it to in_degree_zeros where it will be processed in a future
-          # iteration of the outer loop.
-          in_degree_zeros.add(node_dependent)
+        in_degree = in_degrees.get(node_dependent)
+        if in_degree is None:
+          in_degree = len(node_dependent.dependencies)
+        in_degree -= 1
+        in_degrees[node_dependent] = in_degree
+        if in_degree == 0:
+          heapq.heappush(in_degree_zeros, (node_dependent.ref, node_dependent))
 
     return flat_list
 
   def FindCycles(self, path=None):
     """
     Returns a list of cycles in the graph, where each cycle is its own list.
+
+    Every elementary cycle is enumerated, which takes exponential time on
+    densely cyclic graphs.  DependencyCycles reports one cycle per strongly
+    connected component in linear time instead.
     """
     if path is None:
       path = [self]
@@ -1539,6 +2630,7 @@ class DependencyGraphNode(object):
     if dependencies == None:
       dependencies = []
 
+    present = set(dependencies)
     index = 0
     while index < len(dependencies):
       dependency = dependencies[index]
@@ -1552,8 +2644,9 @@ class DependencyGraphNode(object):
       add_index = 1
       for imported_dependency in \
           dependency_dict.get('export_dependent_settings', []):
-        if imported_dependency not in dependencies:
+        if imported_dependency not in present:
           dependencies.insert(index + add_index, imported_dependency)
+          present.add(imported_dependency)
           add_index = add_index + 1
       index = index + 1
 
@@ -1568,16 +2661,36 @@ class DependencyGraphNode(object):
     dependencies = self.DirectDependencies(dependencies)
     return self._AddImportedDependencies(targets, dependencies)
 
+  @staticmethod
+  def _ExtendWithNew(dependencies, present, refs):
+    """Appends the refs in |refs| that aren't in |present| to |dependencies|.
+    """
+    for ref in refs:
+      if ref not in present:
+        dependencies.append(ref)
+        present.add(ref)
+
   def DeepDependencies(self, dependencies=None):
-    """Returns a list of all of a target's dependencies, recursively."""
+    """Returns a list of all of a target's dependencies, recursively.
+
+    The list is in depth-first order.  Each dependency's own list is computed
+    once and merged into the lists of all of its dependents: as the graph is
+    acyclic, a dependency already in the list had its own dependencies added
+    along with it, so merging skips exactly what the depth-first walk would.
+    """
     if dependencies == None:
       dependencies = []
 
+    present = set(dependencies)
     for dependency in self.dependencies:
       # Check for None, corresponding to the root node.
-      if dependency.ref != None and dependency.ref not in dependencies:
+      if dependency.ref != None and dependency.ref not in present:
         dependencies.append(dependency.ref)
-        dependency.DeepDependencies(dependencies)
+        present.add(dependency.ref)
+        if dependency._deep_dependencies is None:
+          dependency._deep_dependencies = tuple(dependency.DeepDependencies())
+        self._ExtendWithNew(dependencies, present,
+                            dependency._deep_dependencies)
 
     return dependencies
 
@@ -1590,8 +2703,10 @@ class DependencyGraphNode(object):
     setting.
 
     When adding a target to the list of dependencies, this function will
-    recurse into itself with |initial| set to False, to collect dependencies
-    that are linked into the linkable target for which the list is being built.
+    look at the targets it contributes with |initial| set to False, to collect
+    dependencies that are linked into the linkable target for which the list
+    is being built.  Those contributions are memoized per target, and merged
+    like in DeepDependencies.
 
     If |include_shared_libraries| is False, the resulting dependencies will not
     include shared_library targets that are linked into this target.
@@ -1599,9 +2714,28 @@ class DependencyGraphNode(object):
     if dependencies == None:
       dependencies = []
 
+    if initial:
+      contribution = self._LinkContribution(targets, include_shared_libraries,
+                                            True)
+    else:
+      contribution = self._MemoizedLinkContribution(targets,
+                                                    include_shared_libraries)
+    self._ExtendWithNew(dependencies, set(dependencies), contribution)
+    return dependencies
+
+  def _MemoizedLinkContribution(self, targets, include_shared_libraries):
+    contribution = self._link_contributions.get(include_shared_libraries)
+    if contribution is None:
+      contribution = tuple(self._LinkContribution(
+          targets, include_shared_libraries, False))
+      self._link_contributions[include_shared_libraries] = contribution
+    return contribution
+
+  def _LinkContribution(self, targets, include_shared_libraries, initial):
+    """Returns the link dependencies this target adds to an empty list."""
     # Check for None, corresponding to the root node.
     if self.ref == None:
-      return dependencies
+      return []
 
     # It's kind of sucky that |targets| has to be passed into this function,
     # but that's presently the easiest way to access the target dicts so that
@@ -1623,21 +2757,19 @@ class DependencyGraphNode(object):
       # return an empty list of link dependencies, because the link
       # dependencies are intended to apply to the target itself (initial is
       # True) and this target won't be linked.
-      return dependencies
+      return []
 
     # Don't traverse 'none' targets if explicitly excluded.
     if (target_type == 'none' and
         not targets[self.ref].get('dependencies_traverse', True)):
-      if self.ref not in dependencies:
-        dependencies.append(self.ref)
-      return dependencies
+      return [self.ref]
 
     # Executables and loadable modules are already fully and finally linked.
     # Nothing else can be a link dependency of them, there can only be
     # dependencies in the sense that a dependent target might run an
     # executable or load the loadable_module.
     if not initial and target_type in ('executable', 'loadable_module'):
-      return dependencies
+      return []
 
     # Shared libraries are already fully linked.  They should only be included
     # in |dependencies| when adjusting static library dependencies (in order to
@@ -1647,20 +2779,20 @@ class DependencyGraphNode(object):
     # are handling.
     if (not initial and target_type == 'shared_library' and
         not include_shared_libraries):
-      return dependencies
+      return []
 
     # The target is linkable, add it to the list of link dependencies.
-    if self.ref not in dependencies:
-      dependencies.append(self.ref)
-      if initial or not is_linkable:
-        # If this is a subsequent target and it's linkable, don't look any
-        # further for linkable dependencies, as they'll already be linked into
-        # this target linkable.  Always look at dependencies of the initial
-        # target, and always look at dependencies of non-linkables.
-        for dependency in self.dependencies:
-          dependency._LinkDependenciesInternal(targets,
-                                               include_shared_libraries,
-                                               dependencies, False)
+    dependencies = [self.ref]
+    if initial or not is_linkable:
+      # If this is a subsequent target and it's linkable, don't look any
+      # further for linkable dependencies, as they'll already be linked into
+      # this target linkable.  Always look at dependencies of the initial
+      # target, and always look at dependencies of non-linkables.
+      present = set(dependencies)
+      for dependency in self.dependencies:
+        self._ExtendWithNew(dependencies, present,
+                            dependency._MemoizedLinkContribution(
+                                targets, include_shared_libraries))
 
     return dependencies
 
@@ -1685,6 +2817,103 @@ class DependencyGraphNode(object):
     return self._LinkDependenciesInternal(targets, True)
 
 
+def StronglyConnectedComponents(nodes):
+  """Returns the strongly connected components of a DependencyGraphNode graph.
+
+  The graph is formed by |nodes| and everything reachable from them through
+  "dependencies" links.  Each component is a list of nodes, and components come
+  after every component they depend on.  This is Tarjan's algorithm, using an
+  explicit stack so that long dependency chains don't hit the recursion limit.
+  """
+  indices = {}
+  lowlinks = {}
+  # Nodes visited but not yet assigned to a component.
+  stack = []
+  on_stack = set()
+  components = []
+  for start in nodes:
+    if start in indices:
+      continue
+    indices[start] = lowlinks[start] = len(indices)
+    stack.append(start)
+    on_stack.add(start)
+    # (node, iterator over its remaining dependencies) for the nodes on the
+    # current depth-first search path.
+    path = [(start, iter(start.dependencies))]
+    while path:
+      node, dependencies = path[-1]
+      for dependency in dependencies:
+        if dependency not in indices:
+          indices[dependency] = lowlinks[dependency] = len(indices)
+          stack.append(dependency)
+          on_stack.add(dependency)
+          path.append((dependency, iter(dependency.dependencies)))
+          break
+        if dependency in on_stack and indices[dependency] < lowlinks[node]:
+          lowlinks[node] = indices[dependency]
+      else:
+        # All of node's dependencies have been visited.
+        path.pop()
+        if path:
+          parent = path[-1][0]
+          if lowlinks[node] < lowlinks[parent]:
+            lowlinks[parent] = lowlinks[node]
+        if lowlinks[node] == indices[node]:
+          component = []
+          while True:
+            member = stack.pop()
+            on_stack.remove(member)
+            component.append(member)
+            if member is node:
+              break
+          components.append(component)
+  return components
+
+
+def ShortestCycle(component):
+  """Returns a shortest cycle through a strongly connected component.
+
+  The cycle starts and ends at the member of |component| with the smallest
+  ref, and is returned as the list of refs along it, where each ref depends on
+  the next one.  Returns None if |component| has no cycle, which is the case
+  for a single node that doesn't depend on itself.
+  """
+  members = set(component)
+  start = min(component, key=lambda node: node.ref)
+  # Breadth-first search from start, staying within the component, until an
+  # edge leads back to start.
+  previous = {start: None}
+  queue = collections.deque([start])
+  while queue:
+    node = queue.popleft()
+    for dependency in node.dependencies:
+      if dependency is start:
+        cycle = [start.ref]
+        while node is not None:
+          cycle.append(node.ref)
+          node = previous[node]
+        cycle.reverse()
+        return cycle
+      if dependency in members and dependency not in previous:
+        previous[dependency] = node
+        queue.append(dependency)
+  return None
+
+
+def DependencyCycles(nodes):
+  """Returns one shortest cycle, as given by ShortestCycle, for each strongly
+  connected component of the graph of |nodes| that has a cycle.
+
+  Cycles are sorted, so the result doesn't depend on the order of |nodes|.
+  """
+  cycles = []
+  for component in StronglyConnectedComponents(nodes):
+    cycle = ShortestCycle(component)
+    if cycle:
+      cycles.append(cycle)
+  return sorted(cycles)
+
+
 def BuildDependencyList(targets):
   # Create a DependencyGraphNode for each target.  Put it into a dict for easy
   # access.
@@ -1718,9 +2947,11 @@ def BuildDependencyList(targets):
   # (cycle).  If you need to figure out what's wrong, look for elements of
   # targets that are not in flat_list.
   if len(flat_list) != len(targets):
+    cycles = DependencyCycles(dependency_nodes.itervalues())
     raise DependencyGraphNode.CircularException(
         'Some targets not reachable, cycle in dependency graph detected: ' +
-        ' '.join(set(flat_list) ^ set(targets)))
+        ' '.join(set(flat_list) ^ set(targets)) + '\n' +
+        '\n'.join('Cycle: ' + ' -> '.join(cycle) for cycle in cycles))
 
   return [dependency_nodes, flat_list]
 
@@ -1734,7 +2965,9 @@ def VerifyNoGYPFileCircularDependencies(targets):
     if not build_file in dependency_nodes:
       dependency_nodes[build_file] = DependencyGraphNode(build_file)
 
-  # Set up the dependency links.
+  # Set up the dependency links.  file_dependencies holds the
+  # (build_file, dependency_build_file) pairs linked so far.
+  file_dependencies = set()
   for target, spec in targets.iteritems():
     build_file = gyp.common.BuildFile(target)
     build_file_node = dependency_nodes[build_file]
@@ -1753,37 +2986,26 @@ def VerifyNoGYPFileCircularDependencies(targets):
       dependency_node = dependency_nodes.get(dependency_build_file)
       if not dependency_node:
         raise GypError("Dependancy '%s' not found" % dependency_build_file)
-      if dependency_node not in build_file_node.dependencies:
+      if (build_file, dependency_build_file) not in file_dependencies:
+        file_dependencies.add((build_file, dependency_build_file))
         build_file_node.dependencies.append(dependency_node)
         dependency_node.dependents.append(build_file_node)
 
-
-  # Files that have no dependencies are treated as dependent on root_node.
-  root_node = DependencyGraphNode(None)
-  for build_file_node in dependency_nodes.itervalues():
-    if len(build_file_node.dependencies) == 0:
-      build_file_node.dependencies.append(root_node)
-      root_node.dependents.append(build_file_node)
-
-  flat_list = root_node.FlattenToList()
-
-  # If there's anything left unvisited, there must be a circular dependency
-  # (cycle).
-  if len(flat_list) != len(dependency_nodes):
-    bad_files = []
-    for file in dependency_nodes.iterkeys():
-      if not file in flat_list:
-        bad_files.append(file)
+  # A cycle among .gyp files shows up as a strongly connected component with
+  # more than one file in it.
+  cycles = DependencyCycles(dependency_nodes.itervalues())
+  if cycles:
     common_path_prefix = os.path.commonprefix(dependency_nodes)
-    cycles = []
-    for cycle in root_node.FindCycles():
+    descriptions = []
+    for cycle in cycles:
       simplified_paths = []
-      for node in cycle:
-        assert(node.ref.startswith(common_path_prefix))
-        simplified_paths.append(node.ref[len(common_path_prefix):])
-      cycles.append('Cycle: %s' % ' -> '.join(simplified_paths))
+      for build_file in cycle:
+        assert(build_file.startswith(common_path_prefix))
+        simplified_paths.append(build_file[len(common_path_prefix):])
+      descriptions.append('Cycle: %s' % ' -> '.join(simplified_paths))
     raise DependencyGraphNode.CircularException, \
-        'Cycles in .gyp file dependency graph detected:\n' + '\n'.join(cycles)
+        'Cycles in .gyp file dependency graph detected:\n' + \
+        '\n'.join(descriptions)
 
 
 def DoDependentSettings(key, flat_list, targets, dependency_nodes):
@@ -1823,6 +3045,7 @@ def AdjustStaticLibraryDependencies(flat_list, targets, dependency_nodes,
   # linkable target, add a "dependencies" entry referring to all of the
   # target's computed list of link dependencies (including static libraries
   # if no such entry is already present.
+  flat_list_indices = None
   for target in flat_list:
     target_dict = targets[target]
     target_type = target_dict['type']
@@ -1876,25 +3099,35 @@ def AdjustStaticLibraryDependencies(flat_list, targets, dependency_nodes,
 
       link_dependencies = \
           dependency_nodes[target].DependenciesToLinkAgainst(targets)
+      present = set(target_dict.get('dependencies', []))
       for dependency in link_dependencies:
         if dependency == target:
           continue
         if not 'dependencies' in target_dict:
           target_dict['dependencies'] = []
-        if not dependency in target_dict['dependencies']:
+        if not dependency in present:
           target_dict['dependencies'].append(dependency)
+          present.add(dependency)
       # Sort the dependencies list in the order from dependents to dependencies.
       # e.g. If A and B depend on C and C depends on D, sort them in A, B, C, D.
       # Note: flat_list is already sorted in the order from dependencies to
       # dependents.
       if sort_dependencies and 'dependencies' in target_dict:
-        target_dict['dependencies'] = [dep for dep in reversed(flat_list)
-                                       if dep in target_dict['dependencies']]
+        if flat_list_indices is None:
+          flat_list_indices = dict((dep, index)
+                                   for index, dep in enumerate(flat_list))
+        target_dict['dependencies'] = sorted(
+            [dep for dep in present if dep in flat_list_indices],
+            key=flat_list_indices.get, reverse=True)
 
 
 # Initialize this here to speed up MakePathRelative.
 exception_re = re.compile(r'''["']?[-/$<>^]''')
 
+# The directory of fro_file relative to the directory of to_file, keyed by
+# (to_file, fro_file), for MakePathRelative.
+relative_build_file_dirs = gyp.common.RegisterPathCache({})
+
 
 def MakePathRelative(to_file, fro_file, item):
   # If item is a relative path, it's relative to the build file dict that it's
@@ -1917,13 +3150,15 @@ def MakePathRelative(to_file, fro_file, item):
   if to_file == fro_file or exception_re.match(item):
     return item
   else:
+    relative_dir = relative_build_file_dirs.get((to_file, fro_file))
+    if relative_dir is None:
+      relative_dir = gyp.common.RelativePath(os.path.dirname(fro_file),
+                                             os.path.dirname(to_file))
+      relative_build_file_dirs[(to_file, fro_file)] = relative_dir
     # TODO(dglazkov) The backslash/forward-slash replacement at the end is a
     # temporary measure. This should really be addressed by keeping all paths
     # in POSIX until actual project generation.
-    ret = os.path.normpath(os.path.join(
-        gyp.common.RelativePath(os.path.dirname(fro_file),
-                                os.path.dirname(to_file)),
-                                item)).replace('\\', '/')
+    ret = os.path.normpath(os.path.join(relative_dir, item)).replace('\\', '/')
     if item[-1] == '/':
       ret += '/'
     return ret
@@ -1939,11 +3174,12 @@ def MergeLists(to, fro, to_file, fro_file, is_paths=False, append=True):
       return x in s
     return x in l
 
-  prepend_index = 0
-
   # Make membership testing of hashables in |to| (in particular, strings)
   # faster.
   hashable_to_set = set(x for x in to if is_hashable(x))
+  # The items to prepend, and the singletons among them.
+  prepend_items = []
+  prepend_singletons = set()
   for item in fro:
     singleton = False
     if isinstance(item, str) or isinstance(item, int):
@@ -1985,22 +3221,51 @@ def MergeLists(to, fro, to_file, fro_file, is_paths=False, append=True):
         if is_hashable(to_item):
           hashable_to_set.add(to_item)
     else:
-      # If prepending a singleton that's already in the list, remove the
-      # existing instance and proceed with the prepend.  This ensures that the
-      # item appears at the earliest possible position in the list.
-      while singleton and to_item in to:
-        to.remove(to_item)
+      if singleton and prepend_singletons is not None:
+        if to_item in prepend_singletons:
+          # |fro| repeats a singleton; see PrependToList.
+          prepend_singletons = None
+        else:
+          prepend_singletons.add(to_item)
+      prepend_items.append((to_item, singleton))
+
+  if prepend_items:
+    if prepend_singletons is None:
+      PrependToList(to, prepend_items)
+    else:
+      # Prepending a singleton removes its existing instances from the list,
+      # so that it appears at the earliest possible position.  With distinct
+      # singletons, the new items end up in order in front of what's left.
+      to[:] = [to_item for to_item, singleton in prepend_items] + \
+              [x for x in to
+               if not is_hashable(x) or x not in prepend_singletons]
 
-      # Don't just insert everything at index 0.  That would prepend the new
-      # items to the list in reverse order, which would be an unwelcome
-      # surprise.
-      to.insert(prepend_index, to_item)
-      if is_hashable(to_item):
-        hashable_to_set.add(to_item)
-      prepend_index = prepend_index + 1
+
+def PrependToList(to, prepend_items):
+  """Prepends the (to_item, singleton) pairs in |prepend_items| to |to|.
+
+  Items are inserted one at a time.  A singleton first has any existing
+  instances removed, including ones inserted for an earlier copy of it.
+  Insertion positions keep counting from the start regardless, which is the
+  behavior MergeLists keeps for lists that repeat a singleton.
+  """
+  prepend_index = 0
+  for to_item, singleton in prepend_items:
+    # If prepending a singleton that's already in the list, remove the
+    # existing instance and proceed with the prepend.  This ensures that the
+    # item appears at the earliest possible position in the list.
+    while singleton and to_item in to:
+      to.remove(to_item)
+
+    # Don't just insert everything at index 0.  That would prepend the new
+    # items to the list in reverse order, which would be an unwelcome
+    # surprise.
+    to.insert(prepend_index, to_item)
+    prepend_index = prepend_index + 1
 
 
 def MergeDicts(to, fro, to_file, fro_file):
+  gyp.stats.counts['MergeDicts calls'] += 1
   # I wanted to name the parameter "from" but it's a Python keyword...
   for k, v in fro.iteritems():
     # It would be nice to do "if not k in to: to[k] = v" but that wouldn't give
@@ -2099,6 +3364,141 @@ def MergeDicts(to, fro, to_file, fro_file):
           v.__class__.__name__ + ' for key ' + k
 
 
+def IsPathInvariant(value, is_path):
+  """Returns whether merging |value| leaves it the same for any to_file.
+
+  That is the case when MergeDicts and MergeLists would not rewrite any
+  relative path in it.  Values that the merge functions would reject are
+  reported as not invariant so that the merge functions get to raise.
+  """
+  if isinstance(value, str):
+    return not is_path or exception_re.match(value) is not None
+  elif isinstance(value, int):
+    return not is_path
+  elif isinstance(value, dict):
+    for k, v in value.iteritems():
+      if not IsPathInvariant(v, IsPathSection(k)):
+        return False
+    return True
+  elif isinstance(value, list):
+    for item in value:
+      if not IsPathInvariant(item, is_path and not isinstance(item, list)):
+        return False
+    return True
+  return False
+
+
+# Maps a list merge policy (the last character of the key) to the policies
+# that MergeDicts refuses to combine it with.  Keys without a policy
+# character append.
+incompatible_list_policies = {
+  '=': ('', '?'),
+  '+': ('=', '?'),
+  '?': ('', '=', '+'),
+}
+
+
+class IncludeSnapshot(object):
+  """A merge-ready form of an included build file's dict.
+
+  Commonly included files such as common.gypi are merged into every build
+  file that includes them.  MergeDicts copies the included dict key by key,
+  fixing up relative paths as it goes.  An IncludeSnapshot instead keeps each
+  path-invariant value of the dict pre-merged and marshalled, so that copying
+  it into an includer that doesn't have the key yet is a single
+  marshal.loads.  Keys that the includer already has (and values holding
+  relative paths) still go through MergeDicts, so the Python-level merge
+  work grows with what each includer overrides rather than with the size of
+  the include.
+
+  The snapshotted dict must not be modified while the snapshot is in use.
+  """
+
+  def __init__(self, fro, fro_file):
+    self.fro = fro
+    self.fro_file = fro_file
+    self.uses = 0
+    # A list of (key, value, to_key, blob, child, scalar) tuples, one per item
+    # of |fro|, built on first use.  to_key is the key MergeDicts stores the
+    # value under, blob is the marshalled merged value if it's a
+    # path-invariant dict or list, child is an IncludeSnapshot of a dict value
+    # and scalar is set for path-invariant strings and ints.  None if |fro|
+    # mixes incompatible list policies, in which case MergeDicts gets to
+    # report it.
+    self.items = None
+    self.built = False
+
+  def _Build(self):
+    self.built = True
+    items = []
+    for k, v in self.fro.iteritems():
+      to_key = k
+      child = None
+      if isinstance(v, dict):
+        child = IncludeSnapshot(v, self.fro_file)
+      elif isinstance(v, list):
+        ext = k[-1]
+        if ext in '=+?':
+          to_key = k[:-1]
+        for policy in incompatible_list_policies.get(ext, ('=', '?')):
+          if to_key + policy in self.fro:
+            return
+      blob = None
+      scalar = False
+      if child is None and not isinstance(v, list):
+        scalar = IsPathInvariant(v, IsPathSection(k))
+      elif IsPathInvariant(v, IsPathSection(k)):
+        merged = {}
+        try:
+          MergeDicts(merged, {k: v}, self.fro_file, self.fro_file)
+        except (GypError, TypeError):
+          pass
+        else:
+          blob = marshal.dumps(merged[to_key])
+      items.append((k, v, to_key, blob, child, scalar))
+    self.items = items
+
+  def MergeInto(self, to, to_file):
+    """Does the equivalent of MergeDicts(to, self.fro, to_file, fro_file)."""
+    if not self.built:
+      self._Build()
+    if self.items is None:
+      MergeDicts(to, self.fro, to_file, self.fro_file)
+      return
+    for k, v, to_key, blob, child, scalar in self.items:
+      if scalar:
+        if k in to and not (isinstance(to[k], str) or isinstance(to[k], int)):
+          MergeDicts(to, {k: v}, to_file, self.fro_file)
+        else:
+          to[k] = v
+      elif blob is not None and to_key not in to and k not in to:
+        to[to_key] = marshal.loads(blob)
+      elif child is not None and (k not in to or to[k].__class__ == dict):
+        if k not in to:
+          to[k] = {}
+        child.MergeInto(to[k], to_file)
+      else:
+        MergeDicts(to, {k: v}, to_file, self.fro_file)
+
+
+def MergeIncludedDict(to, fro, to_file, fro_file):
+  """Merges |fro|, the contents of the included file |fro_file|, into |to|.
+
+  The result is the same as MergeDicts(to, fro, to_file, fro_file), but
+  includes used more than once are merged from a shared IncludeSnapshot.
+  """
+  snapshot = include_snapshots.get(fro_file)
+  if snapshot is None or snapshot.fro is not fro:
+    snapshot = IncludeSnapshot(fro, fro_file)
+    include_snapshots[fro_file] = snapshot
+  snapshot.uses += 1
+  if snapshot.uses == 1:
+    # Most includes are only included once; don't bother snapshotting those.
+    MergeDicts(to, fro, to_file, fro_file)
+  else:
+    snapshot.MergeInto(to, to_file)
+
+
 def MergeConfigWithInheritance(new_configuration_dict, build_file,
                                target_dict, configuration, visited):
   # Skip if previously visted.
@@ -2141,32 +3541,39 @@ def SetUpConfigurations(target, target_dict):
                 if not target_dict['configurations'][i].get('abstract')]
     target_dict['default_configuration'] = sorted(concrete)[0]
 
+  # Configurations inherit (most) settings from the enclosing target scope.
+  # Leave out the bits that don't belong in a "configurations" section.
+  # Since configuration setup is done before conditional, exclude, and rules
+  # processing, be careful with handling of the suffix characters used in
+  # those phases.
+  inherited_dict = {}
+  for key, value in target_dict.iteritems():
+    key_ext = key[-1:]
+    if key_ext in key_suffixes:
+      key_base = key[:-1]
+    else:
+      key_base = key
+    if key_base not in non_configuration_keys:
+      inherited_dict[key] = value
+
+  # Each configuration needs its own copy of the inherited settings, since
+  # merging and later processing modify them in place.  Loading a marshal
+  # snapshot is much faster than copy.deepcopy, and as the snapshot's strings
+  # are interned, all the copies share them.
+  try:
+    inherited_snapshot = marshal.dumps(InternStrings(inherited_dict), 2)
+  except ValueError:
+    inherited_snapshot = None
+
   for configuration in target_dict['configurations'].keys():
     old_configuration_dict = target_dict['configurations'][configuration]
     # Skip abstract configurations (saves work only).
     if old_configuration_dict.get('abstract'):
       continue
-    # Configurations inherit (most) settings from the enclosing target scope.
-    # Get the inheritance relationship right by making a copy of the target
-    # dict.
-    new_configuration_dict = copy.deepcopy(target_dict)
-
-    # Take out the bits that don't belong in a "configurations" section.
-    # Since configuration setup is done before conditional, exclude, and rules
-    # processing, be careful with handling of the suffix characters used in
-    # those phases.
-    delete_keys = []
-    for key in new_configuration_dict:
-      key_ext = key[-1:]
-      if key_ext in key_suffixes:
-        key_base = key[:-1]
-      else:
-        key_base = key
-      if key_base in non_configuration_keys:
-        delete_keys.append(key)
-
-    for key in delete_keys:
-      del new_configuration_dict[key]
+    if inherited_snapshot is None:
+      new_configuration_dict = copy.deepcopy(inherited_dict)
+    else:
+      new_configuration_dict = marshal.loads(inherited_snapshot)
 
     # Merge in configuration (with all its parents first).
     MergeConfigWithInheritance(new_configuration_dict, build_file,
@@ -2206,6 +3613,69 @@ def SetUpConfigurations(target, target_dict):
 
 
 
+# Compiled regex filters (see CompileListFilters), keyed by the tuple of
+# (action value, pattern) pairs they were compiled from.
+compiled_list_filters = {}
+
+# Matches the syntax of backreferences to groups (\1, (?P=name) and
+# (?(1)yes|no)), which break when patterns are joined into one.  Matching
+# more than that only means that some patterns aren't joined.
+backreference_re = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+
+def CompileListFilters(actions_and_patterns):
+  """Returns the (action value, compiled regex) pairs to apply to list items.
+
+  |actions_and_patterns| lists the (action value, pattern) pairs of a "/"
+  list filter in order.  The result is in reverse order, so that the first
+  matching regex gives an item's final action.  Consecutive patterns with the
+  same action are joined into a single regex where that doesn't change what
+  they match.
+  """
+  key = tuple(actions_and_patterns)
+  filters = compiled_list_filters.get(key)
+  if filters is not None:
+    return filters
+
+  filters = []
+  group = []
+  group_action = None
+  for action_value, pattern in reversed(actions_and_patterns):
+    pattern_re = re.compile(pattern)
+    # Inline flags like (?i) apply to the whole of a joined regex.
+    joinable = (pattern_re.flags == 0 and
+                not backreference_re.search(pattern))
+    if group and (action_value != group_action or not joinable):
+      filters.extend(JoinPatterns(group_action, group))
+      group = []
+    if joinable:
+      group.append(pattern)
+      group_action = action_value
+    else:
+      filters.append((action_value, pattern_re))
+  if group:
+    filters.extend(JoinPatterns(group_action, group))
+
+  compiled_list_filters[key] = filters
+  return filters
+
+
+def JoinPatterns(action_value, patterns):
+  """Returns filters with |action_value| matching where any of |patterns| do.
+
+  That's a single joined regex, unless the patterns can't be joined.
+  """
+  if len(patterns) > 1:
+    try:
+      return [(action_value,
+               re.compile('|'.join('(?:%s)' % pattern
+                                   for pattern in patterns)))]
+    except re.error:
+      # For example, two patterns defining groups with the same name.
+      pass
+  return [(action_value, re.compile(pattern)) for pattern in patterns]
+
+
 def ProcessListFiltersInDict(name, the_dict):
   """Process regular expression and exclusion-based filters on lists.
 
@@ -2272,55 +3742,45 @@ def ProcessListFiltersInDict(name, the_dict):
   for list_key in lists:
     the_list = the_dict[list_key]
 
-    # Initialize the list_actions list, which is parallel to the_list.  Each
-    # item in list_actions identifies whether the corresponding item in
-    # the_list should be excluded, unconditionally preserved (included), or
-    # whether no exclusion or inclusion has been applied.  Items for which
-    # no exclusion or inclusion has been applied (yet) have value -1, items
-    # excluded have value 0, and items included have value 1.  Includes and
-    # excludes override previous actions.  All items in list_actions are
-    # initialized to -1 because no excludes or includes have been processed
-    # yet.
-    list_actions = list((-1,) * len(the_list))
+    # Each item of the_list is either excluded, unconditionally preserved
+    # (included), or has had no exclusion or inclusion applied; -1 stands for
+    # the latter, 0 for excluded and 1 for included.  Includes and excludes
+    # override previous actions, so an item's final action is the one of the
+    # last regex filter matching it, or failing that, 0 if the exclusion list
+    # names it.
 
     exclude_key = list_key + '!'
+    exclude_set = set()
+    exclude_unhashables = []
     if exclude_key in the_dict:
       for exclude_item in the_dict[exclude_key]:
-        for index in xrange(0, len(the_list)):
-          if exclude_item == the_list[index]:
-            # This item matches the exclude_item, so set its action to 0
-            # (exclude).
-            list_actions[index] = 0
+        if exclude_item.__hash__:
+          exclude_set.add(exclude_item)
+        else:
+          exclude_unhashables.append(exclude_item)
 
       # The "whatever!" list is no longer needed, dump it.
       del the_dict[exclude_key]
 
     regex_key = list_key + '/'
+    filters = []
     if regex_key in the_dict:
+      actions_and_patterns = []
       for regex_item in the_dict[regex_key]:
         [action, pattern] = regex_item
-        pattern_re = re.compile(pattern)
 
         if action == 'exclude':
-          # This item matches an exclude regex, so set its value to 0 (exclude).
+          # Items matching an exclude regex get the value 0 (exclude).
           action_value = 0
         elif action == 'include':
-          # This item matches an include regex, so set its value to 1 (include).
+          # Items matching an include regex get the value 1 (include).
           action_value = 1
         else:
           # This is an action that doesn't make any sense.
           raise ValueError, 'Unrecognized action ' + action + ' in ' + name + \
                             ' key ' + regex_key
-
-        for index in xrange(0, len(the_list)):
-          list_item = the_list[index]
-          if list_actions[index] == action_value:
-            # Even if the regex matches, nothing will change so continue (regex
-            # searches are expensive).
-            continue
-          if pattern_re.search(list_item):
-            # Regular expression match.
-            list_actions[index] = action_value
+        actions_and_patterns.append((action_value, pattern))
+      filters = CompileListFilters(actions_and_patterns)
 
       # The "whatever/" list is no longer needed, dump it.
       del the_dict[regex_key]
@@ -2337,18 +3797,31 @@ def ProcessListFiltersInDict(name, the_dict):
                      ' must not be present prior '
                      ' to applying exclusion/regex filters for ' + list_key)
 
+    kept_list = []
     excluded_list = []
-
-    # Go backwards through the list_actions list so that as items are deleted,
-    # the indices of items that haven't been seen yet don't shift.  That means
-    # that things need to be prepended to excluded_list to maintain them in the
-    # same order that they existed in the_list.
-    for index in xrange(len(list_actions) - 1, -1, -1):
-      if list_actions[index] == 0:
+    for list_item in the_list:
+      # Regular expressions only apply to strings; other items are decided by
+      # the exclusion list alone.
+      for action_value, pattern_re in filters:
+        if isinstance(list_item, basestring) and pattern_re.search(list_item):
+          # Regular expression match.
+          break
+      else:
+        if list_item.__hash__:
+          excluded = list_item in exclude_set
+        else:
+          excluded = list_item in exclude_unhashables
+        if excluded:
+          action_value = 0
+        else:
+          action_value = -1
+      if action_value == 0:
         # Dump anything with action 0 (exclude).  Keep anything with action 1
         # (include) or -1 (no include or exclude seen for the item).
-        excluded_list.insert(0, the_list[index])
-        del the_list[index]
+        excluded_list.append(list_item)
+      else:
+        kept_list.append(list_item)
+    the_list[:] = kept_list
 
     # If anything was excluded, put the excluded list into the_dict at
     # excluded_key.
@@ -2587,8 +4060,171 @@ def VerifyNoCollidingTargets(targets):
     used[key] = gyp
 
 
+def ProcessTargetsLate(target_list, targets, variables,
+                       extra_sources_for_rules):
+  """Runs the per-target processing that follows dependency resolution.
+
+  Applies the "late" and "latelate" phases, sets up configurations, applies
+  list filters and validates the targets in |target_list|, whose dicts are
+  looked up in |targets|.  The passes only look at one target at a time, so
+  any split of the targets gives the same result.
+  """
+  # Apply "post"/"late"/"target" variable expansions and condition
+  # evaluations.
+  with gyp.stats.Phase('late phase'):
+    for target in target_list:
+      PrefetchCommands(targets[target], PHASE_LATE, variables,
+                       gyp.common.BuildFile(target))
+    for target in target_list:
+      target_dict = targets[target]
+      build_file = gyp.common.BuildFile(target)
+      ProcessVariablesAndConditionsInDict(
+          target_dict, PHASE_LATE, variables, build_file)
+
+  # Move everything that can go into a "configurations" section into one.
+  with gyp.stats.Phase('configurations'):
+    for target in target_list:
+      target_dict = targets[target]
+      SetUpConfigurations(target, target_dict)
+
+  # Apply exclude (!) and regex (/) list filters.
+  with gyp.stats.Phase('list filters'):
+    for target in target_list:
+      target_dict = targets[target]
+      ProcessListFiltersInDict(target, target_dict)
+
+  # Apply "latelate" variable expansions and condition evaluations.
+  with gyp.stats.Phase('latelate phase'):
+    for target in target_list:
+      PrefetchCommands(targets[target], PHASE_LATELATE, variables,
+                       gyp.common.BuildFile(target))
+    for target in target_list:
+      target_dict = targets[target]
+      build_file = gyp.common.BuildFile(target)
+      ProcessVariablesAndConditionsInDict(
+          target_dict, PHASE_LATELATE, variables, build_file)
+
+  # Make sure that the rules make sense, and build up rule_sources lists as
+  # needed.  Not all generators will need to use the rule_sources lists, but
+  # some may, and it seems best to build the list in a common spot.
+  # Also validate actions and run_as elements in targets.
+  with gyp.stats.Phase('validation'):
+    for target in target_list:
+      target_dict = targets[target]
+      build_file = gyp.common.BuildFile(target)
+      ValidateTargetType(target, target_dict)
+      # TODO(thakis): Get vpx_scale/arm/scalesystemdependent.c to be renamed to
+      #               scalesystemdependent_arm_additions.c or similar.
+      if 'arm' not in variables.get('target_arch', ''):
+        ValidateSourcesInTarget(target, target_dict, build_file)
+      ValidateRulesInTarget(target, target_dict, extra_sources_for_rules)
+      ValidateRunAsInTarget(target, target_dict, build_file)
+      ValidateActionsInTarget(target, target_dict, build_file)
+
+
+def InitParallelTargetWorker(global_flags, variables, extra_sources_for_rules):
+  """Sets up a worker process of ProcessTargetsLateParallel's pool."""
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  for key, value in global_flags.iteritems():
+    globals()[key] = value
+
+  global parallel_target_args
+  parallel_target_args = (variables, extra_sources_for_rules)
+  RecordAddedCacheEntries()
+  TakeCacheCounts()
+  gyp.stats.Reset()
+
+
+def CallProcessTargetsLate(args):
+  """Wrapper around ProcessTargetsLate for parallel processing.
+
+  Takes a marshalled (target_list, targets) pair and the
+  ServedPymodHostAddress() of the main process, and returns the pair
+  marshalled along with the expansion_log entries of the processing, the
+  cache entries it added, its cache counts and its statistics.  Returns
+  PYMOD_HOST_NEEDED instead if the main process has to serve its PymodHost
+  first.
+  """
+  (marshalled_targets, host_address) = args
+  SetPymodHostAddress(host_address)
+  (variables, extra_sources_for_rules) = parallel_target_args
+  (target_list, targets) = marshal.loads(marshalled_targets)
+  if expansion_log is not None:
+    del expansion_log[:]
+  try:
+    ProcessTargetsLate(target_list, targets, variables,
+                       extra_sources_for_rules)
+  except PymodHostNeeded:
+    StopCommandPrefetcher()
+    return PYMOD_HOST_NEEDED
+  return marshal.dumps(InternStrings((target_list, targets, expansion_log)) +
+                       (TakeAddedCacheEntries(), TakeCacheCounts(),
+                        gyp.stats.Take()), 2)
+
+
+def ProcessTargetsLateParallel(flat_list, targets, variables,
+                               extra_sources_for_rules, jobs=None):
+  """Like ProcessTargetsLate, but runs on a pool of |jobs| processes.
+
+  Targets are handed out in contiguous chunks of |flat_list| and their dicts
+  are updated in place, in |flat_list| order, as the chunks come back.
+  """
+  if not jobs:
+    try:
+      jobs = multiprocessing.cpu_count()
+    except NotImplementedError:
+      jobs = 8
+
+  # A few chunks per worker balance the load without sending many messages.
+  chunk_size = max(1, len(flat_list) / (jobs * 4))
+  chunks = []
+  for index in xrange(0, len(flat_list), chunk_size):
+    chunk = flat_list[index:index + chunk_size]
+    chunks.append(marshal.dumps(InternStrings(
+        (chunk, dict((target, targets[target]) for target in chunk))), 2))
+
+  pool = multiprocessing.Pool(
+      jobs, InitParallelTargetWorker,
+      (ParallelWorkerGlobals(), variables, extra_sources_for_rules))
+  try:
+    host_address = ServedPymodHostAddress()
+    while chunks:
+      # Chunks that needed the PymodHost before it was served are handed out
+      # again once it is.
+      needed_host = []
+      results = pool.imap(CallProcessTargetsLate,
+                          [(chunk, host_address) for chunk in chunks])
+      for index, result in enumerate(results):
+        if result == PYMOD_HOST_NEEDED:
+          needed_host.append(chunks[index])
+          continue
+        (chunk, processed_targets, chunk_expansion_log,
+         chunk_cache_entries, chunk_cache_counts,
+         chunk_stats) = marshal.loads(result)
+        if expansion_log is not None:
+          expansion_log.extend(chunk_expansion_log)
+        PutAddedCacheEntries(chunk_cache_entries)
+        AddCacheCounts(chunk_cache_counts)
+        gyp.stats.Merge(chunk_stats)
+        for target in chunk:
+          # Generators reach target dicts through |data| as well as through
+          # |targets|, so update the existing dicts.
+          target_dict = targets[target]
+          target_dict.clear()
+          target_dict.update(processed_targets[target])
+      if needed_host:
+        host_address = GetPymodHost().Serve()
+      chunks = needed_host
+  except:
+    pool.terminate()
+    raise
+  pool.close()
+  pool.join()
+
+
 def Load(build_files, variables, includes, depth, generator_input_info, check,
-         circular_check, parallel):
+         circular_check, parallel, parallel_jobs=None):
   # Set up path_sections and non_configuration_keys with the default data plus
   # the generator-specifc data.
   global path_sections
@@ -2606,7 +4242,7 @@ def Load(build_files, variables, includes, depth, generator_input_info, check,
   global generator_filelist_path
   generator_filelist_path = generator_input_info['generator_filelist_path']
   if not generator_filelist_path:
-    generator_filelist_path = lambda a, b: os.path.join(a, b)
+    generator_filelist_path = os.path.join
 
   # A generator can have other lists (in addition to sources) be processed
   # for rules.
@@ -2621,12 +4257,17 @@ def Load(build_files, variables, includes, depth, generator_input_info, check,
   # track of the keys corresponding to "target" files.
   data = {'target_build_files': set()}
   aux_data = {}
+  include_snapshots.clear()
+  build_file_load_times.clear()
+  build_file_transport_sizes.clear()
   # Normalize paths everywhere.  This is important because paths will be
   # used as keys to the data dict and for references between input files.
   build_files = set(map(os.path.normpath, build_files))
   if parallel:
-    LoadTargetBuildFilesParallel(build_files, data, aux_data,
-                                 variables, includes, depth, check)
+    with gyp.stats.Phase('parallel load'):
+      LoadTargetBuildFilesParallel(build_files, data, aux_data,
+                                   variables, includes, depth, check,
+                                   parallel_jobs)
   else:
     for build_file in build_files:
       try:
@@ -2636,109 +4277,102 @@ def Load(build_files, variables, includes, depth, generator_input_info, check,
         gyp.common.ExceptionAppend(e, 'while trying to load %s' % build_file)
         raise
 
-  # Build a dict to access each target's subdict by qualified name.
-  targets = BuildTargetsDict(data)
-
-  # Fully qualify all dependency links.
-  QualifyDependencies(targets)
+  slowest = sorted(build_file_load_times.iteritems(),
+                   key=lambda item: item[1], reverse=True)
+  for build_file, seconds in slowest[:10]:
+    gyp.DebugOutput(gyp.DEBUG_GENERAL, 'loading %s took %.3fs',
+                    build_file, seconds)
+  if build_file_transport_sizes:
+    gyp.DebugOutput(gyp.DEBUG_GENERAL,
+                    'received %d bytes of build file data from workers',
+                    sum(build_file_transport_sizes.itervalues()))
+    largest = sorted(build_file_transport_sizes.iteritems(),
+                     key=lambda item: item[1], reverse=True)
+    for build_file, size in largest[:10]:
+      gyp.DebugOutput(gyp.DEBUG_GENERAL, 'received %d bytes for %s',
+                      size, build_file)
 
-  # Remove self-dependencies from targets that have 'prune_self_dependencies'
-  # set to 1.
-  RemoveSelfDependencies(targets)
-
-  # Expand dependencies specified as build_file:*.
-  ExpandWildcardDependencies(targets, data)
-
-  # Apply exclude (!) and regex (/) list filters only for dependency_sections.
-  for target_name, target_dict in targets.iteritems():
-    tmp_dict = {}
-    for key_base in dependency_sections:
-      for op in ('', '!', '/'):
-        key = key_base + op
-        if key in target_dict:
-          tmp_dict[key] = target_dict[key]
-          del target_dict[key]
-    ProcessListFiltersInDict(target_name, tmp_dict)
-    # Write the results back to |target_dict|.
-    for key in tmp_dict:
-      target_dict[key] = tmp_dict[key]
-
-  # Make sure every dependency appears at most once.
-  RemoveDuplicateDependencies(targets)
-
-  if circular_check:
-    # Make sure that any targets in a.gyp don't contain dependencies in other
-    # .gyp files that further depend on a.gyp.
-    VerifyNoGYPFileCircularDependencies(targets)
-
-  [dependency_nodes, flat_list] = BuildDependencyList(targets)
-
-  # Check that no two targets in the same directory have the same name.
-  VerifyNoCollidingTargets(flat_list)
+  # Build a dict to access each target's subdict by qualified name.
+  with gyp.stats.Phase('qualify dependencies'):
+    targets = BuildTargetsDict(data)
+
+    # Fully qualify all dependency links.
+    QualifyDependencies(targets)
+
+    # Remove self-dependencies from targets that have 'prune_self_dependencies'
+    # set to 1.
+    RemoveSelfDependencies(targets)
+
+    # Expand dependencies specified as build_file:*.
+    ExpandWildcardDependencies(targets, data)
+
+    # Apply exclude (!) and regex (/) list filters only for dependency_sections.
+    for target_name, target_dict in targets.iteritems():
+      tmp_dict = {}
+      for key_base in dependency_sections:
+        for op in ('', '!', '/'):
+          key = key_base + op
+          if key in target_dict:
+            tmp_dict[key] = target_dict[key]
+            del target_dict[key]
+      ProcessListFiltersInDict(target_name, tmp_dict)
+      # Write the results back to |target_dict|.
+      for key in tmp_dict:
+        target_dict[key] = tmp_dict[key]
+
+    # Make sure every dependency appears at most once.
+    RemoveDuplicateDependencies(targets)
+
+  with gyp.stats.Phase('dependency graph'):
+    if circular_check:
+      # Make sure that any targets in a.gyp don't contain dependencies in other
+      # .gyp files that further depend on a.gyp.
+      VerifyNoGYPFileCircularDependencies(targets)
+
+    [dependency_nodes, flat_list] = BuildDependencyList(targets)
+
+    # Check that no two targets in the same directory have the same name.
+    VerifyNoCollidingTargets(flat_list)
 
   # Handle dependent settings of various types.
-  for settings_type in ['all_dependent_settings',
-                        'direct_dependent_settings',
-                        'link_settings']:
-    DoDependentSettings(settings_type, flat_list, targets, dependency_nodes)
-
-    # Take out the dependent settings now that they've been published to all
-    # of the targets that require them.
-    for target in flat_list:
-      if settings_type in targets[target]:
-        del targets[target][settings_type]
-
-  # Make sure static libraries don't declare dependencies on other static
-  # libraries, but that linkables depend on all unlinked static libraries
-  # that they need so that their link steps will be correct.
-  gii = generator_input_info
-  if gii['generator_wants_static_library_dependencies_adjusted']:
-    AdjustStaticLibraryDependencies(flat_list, targets, dependency_nodes,
-                                    gii['generator_wants_sorted_dependencies'])
-
-  # Apply "post"/"late"/"target" variable expansions and condition evaluations.
-  for target in flat_list:
-    target_dict = targets[target]
-    build_file = gyp.common.BuildFile(target)
-    ProcessVariablesAndConditionsInDict(
-        target_dict, PHASE_LATE, variables, build_file)
-
-  # Move everything that can go into a "configurations" section into one.
-  for target in flat_list:
-    target_dict = targets[target]
-    SetUpConfigurations(target, target_dict)
-
-  # Apply exclude (!) and regex (/) list filters.
-  for target in flat_list:
-    target_dict = targets[target]
-    ProcessListFiltersInDict(target, target_dict)
-
-  # Apply "latelate" variable expansions and condition evaluations.
-  for target in flat_list:
-    target_dict = targets[target]
-    build_file = gyp.common.BuildFile(target)
-    ProcessVariablesAndConditionsInDict(
-        target_dict, PHASE_LATELATE, variables, build_file)
-
-  # Make sure that the rules make sense, and build up rule_sources lists as
-  # needed.  Not all generators will need to use the rule_sources lists, but
-  # some may, and it seems best to build the list in a common spot.
-  # Also validate actions and run_as elements in targets.
-  for target in flat_list:
-    target_dict = targets[target]
-    build_file = gyp.common.BuildFile(target)
-    ValidateTargetType(target, target_dict)
-    # TODO(thakis): Get vpx_scale/arm/scalesystemdependent.c to be renamed to
-    #               scalesystemdependent_arm_additions.c or similar.
-    if 'arm' not in variables.get('target_arch', ''):
-      ValidateSourcesInTarget(target, target_dict, build_file)
-    ValidateRulesInTarget(target, target_dict, extra_sources_for_rules)
-    ValidateRunAsInTarget(target, target_dict, build_file)
-    ValidateActionsInTarget(target, target_dict, build_file)
+  with gyp.stats.Phase('dependent settings'):
+    for settings_type in ['all_dependent_settings',
+                          'direct_dependent_settings',
+                          'link_settings']:
+      DoDependentSettings(settings_type, flat_list, targets, dependency_nodes)
+
+      # Take out the dependent settings now that they've been published to all
+      # of the targets that require them.
+      for target in flat_list:
+        if settings_type in targets[target]:
+          del targets[target][settings_type]
+
+    # Make sure static libraries don't declare dependencies on other static
+    # libraries, but that linkables depend on all unlinked static libraries
+    # that they need so that their link steps will be correct.
+    gii = generator_input_info
+    if gii['generator_wants_static_library_dependencies_adjusted']:
+      AdjustStaticLibraryDependencies(
+          flat_list, targets, dependency_nodes,
+          gii['generator_wants_sorted_dependencies'])
+
+  # Apply the "late" and "latelate" phases to each target, and validate it.
+  if parallel and len(flat_list) > 1:
+    with gyp.stats.Phase('parallel late phases'):
+      ProcessTargetsLateParallel(flat_list, targets, variables,
+                                 extra_sources_for_rules, parallel_jobs)
+  else:
+    ProcessTargetsLate(flat_list, targets, variables, extra_sources_for_rules)
 
   # Generators might not expect ints.  Turn them into strs.
   TurnIntIntoStrInDict(data)
 
+  if isinstance(pymod_host, gyp.pymod_host.PymodHost):
+    for module_name, (calls, seconds) in sorted(pymod_host.stats.iteritems()):
+      gyp.DebugOutput(gyp.DEBUG_GENERAL,
+                      'pymod_do_main %s: %d calls, %.3fs', module_name,
+                      calls, seconds)
+
   # TODO(mark): Return |data| for now because the generator needs a list of
   # build files that came in.  In the future, maybe it should just accept
   # a list, and not the whole data dict.
@@ -6,7 +6,13 @@
 
 """Unit tests for the input.py file."""
 
+import copy
+import gyp.common
+import gyp.disk_cache
 import gyp.input
+import os
+import shutil
+import tempfile
 import unittest
 import sys
 
@@ -86,5 +92,721 @@ class TestFindCycles(unittest.TestCase):
                       self.nodes['a'].FindCycles())
 
 
+class TestDependencyCycles(unittest.TestCase):
+  def _Nodes(self, dependencies):
+    nodes = dict((name, gyp.input.DependencyGraphNode(name))
+                 for name in dependencies)
+    for name, node in nodes.iteritems():
+      for dependency in dependencies[name]:
+        node.dependencies.append(nodes[dependency])
+        nodes[dependency].dependents.append(node)
+    return nodes
+
+  def test_Components(self):
+    nodes = self._Nodes({'a': ['b'], 'b': ['c', 'd'], 'c': ['a'], 'd': ['e'],
+                         'e': ['d'], 'f': ['a']})
+    components = gyp.input.StronglyConnectedComponents([nodes['f']])
+    self.assertEqual([['d', 'e'], ['a', 'b', 'c'], ['f']],
+                     [sorted(node.ref for node in component)
+                      for component in components])
+
+  def test_ShortestCycles(self):
+    nodes = self._Nodes({'a': ['b', 'x'], 'b': ['c'], 'c': ['a'], 'x': ['a'],
+                         's': ['s'], 't': []})
+    self.assertEqual([['a', 'x', 'a'], ['s', 's']],
+                     gyp.input.DependencyCycles(nodes.values()))
+
+  def test_NoCycles(self):
+    nodes = self._Nodes({'a': ['b', 'c'], 'b': ['c'], 'c': []})
+    self.assertEqual([], gyp.input.DependencyCycles(nodes.values()))
+
+  def test_LongChain(self):
+    nodes = [gyp.input.DependencyGraphNode(index) for index in xrange(5000)]
+    for node, dependency in zip(nodes, nodes[1:] + nodes[:1]):
+      node.dependencies.append(dependency)
+    self.assertEqual(range(5000) + [0],
+                     gyp.input.DependencyCycles(nodes[:1])[0])
+
+  def test_BuildFileCycle(self):
+    targets = {
+      'a.gyp:a#target': {'dependencies': ['b.gyp:b#target']},
+      'b.gyp:b#target': {'dependencies': ['a.gyp:c#target']},
+      'a.gyp:c#target': {},
+    }
+    self.assertRaises(gyp.input.DependencyGraphNode.CircularException,
+                      gyp.input.VerifyNoGYPFileCircularDependencies, targets)
+    del targets['b.gyp:b#target']['dependencies']
+    gyp.input.VerifyNoGYPFileCircularDependencies(targets)
+
+
+class TestDependencyGraph(unittest.TestCase):
+  def _Graph(self, dependencies):
+    """Returns the root node of the graph of |dependencies|.
+
+    |dependencies| maps node names to the names of their dependencies.
+    """
+    root = gyp.input.DependencyGraphNode(None)
+    self.nodes = dict((name, gyp.input.DependencyGraphNode(name))
+                      for name in dependencies)
+    for name, node in self.nodes.iteritems():
+      for dependency in dependencies[name] or [None]:
+        dependency_node = self.nodes.get(dependency, root)
+        node.dependencies.append(dependency_node)
+        dependency_node.dependents.append(node)
+    return root
+
+  def test_Order(self):
+    root = self._Graph({'app': ['lib', 'base'], 'lib': ['base'],
+                        'base': [], 'zlib': [], 'tool': ['zlib']})
+    self.assertEqual(['base', 'lib', 'app', 'zlib', 'tool'],
+                     root.FlattenToList())
+
+  def test_Cycle(self):
+    root = self._Graph({'a': ['b'], 'b': ['a'], 'c': []})
+    self.assertEqual(['c'], root.FlattenToList())
+
+  def test_DeepDependencies(self):
+    self._Graph({'app': ['ui', 'net'], 'ui': ['base', 'gfx'], 'gfx': ['base'],
+                 'net': ['gfx', 'zlib'], 'base': [], 'zlib': []})
+    for i in xrange(2):
+      # The second round uses the memoized lists.
+      self.assertEqual(['ui', 'base', 'gfx', 'net', 'zlib'],
+                       self.nodes['app'].DeepDependencies())
+      self.assertEqual(['gfx', 'base', 'zlib'],
+                       self.nodes['net'].DeepDependencies())
+
+  def test_LinkDependencies(self):
+    self._Graph({'app': ['lib', 'plugin'], 'lib': ['gen', 'base'],
+                 'gen': ['base'], 'base': [], 'plugin': ['base']})
+    targets = {
+      'app': {'target_name': 'app', 'type': 'executable'},
+      'lib': {'target_name': 'lib', 'type': 'static_library'},
+      'gen': {'target_name': 'gen', 'type': 'none'},
+      'base': {'target_name': 'base', 'type': 'static_library'},
+      'plugin': {'target_name': 'plugin', 'type': 'shared_library'},
+    }
+    self.assertEqual(['app', 'lib', 'gen', 'base', 'plugin'],
+                     self.nodes['app'].DependenciesToLinkAgainst(targets))
+    self.assertEqual(['app', 'lib', 'gen', 'base'],
+                     self.nodes['app']._LinkDependenciesInternal(targets,
+                                                                 False))
+    self.assertEqual([], self.nodes['lib'].DependenciesToLinkAgainst(targets))
+
+
+class TestExpandWildcardDependencies(unittest.TestCase):
+  def test_Expand(self):
+    data = {'b.gyp': {'targets': [
+      {'target_name': 'x', 'toolset': 'target'},
+      {'target_name': 'x', 'toolset': 'host'},
+      {'target_name': 'y', 'toolset': 'target', 'suppress_wildcard': 1},
+      {'target_name': 'z', 'toolset': 'target'},
+    ]}}
+    targets = {'a.gyp:a#target': {
+      'toolset': 'target',
+      'dependencies': ['c.gyp:c#target', 'b.gyp:*#target', 'c.gyp:d#target',
+                       'b.gyp:x#*'],
+    }}
+    gyp.input.ExpandWildcardDependencies(targets, data)
+    self.assertEqual(['c.gyp:c#target', 'b.gyp:x#target', 'b.gyp:z#target',
+                      'c.gyp:d#target', 'b.gyp:x#target', 'b.gyp:x#host'],
+                     targets['a.gyp:a#target']['dependencies'])
+
+  def test_SameFile(self):
+    data = {'a.gyp': {'targets': [{'target_name': 'a', 'toolset': 'target'}]}}
+    targets = {'a.gyp:a#target': {'toolset': 'target',
+                                  'dependencies': ['a.gyp:*#target']}}
+    self.assertRaises(gyp.common.GypError,
+                      gyp.input.ExpandWildcardDependencies, targets, data)
+
+
+class TestMergeLists(unittest.TestCase):
+  def _Merge(self, to, fro, append):
+    gyp.input.MergeLists(to, fro, 'foo.gyp', 'foo.gyp', append=append)
+    return to
+
+  def test_Append(self):
+    self.assertEqual(['a', '-x', 'b', '-x', 'c'],
+                     self._Merge(['a', '-x', 'b'], ['b', '-x', 'c', 'a'],
+                                 True))
+
+  def test_Prepend(self):
+    self.assertEqual(['c', 'a', '-x', '-x', 'b', {}],
+                     self._Merge(['-x', 'a', 'b', {}, 'c'], ['c', 'a', '-x'],
+                                 False))
+
+  def test_PrependRepeatedSingleton(self):
+    # The second 'a' removes the first one, then goes to position 1.
+    self.assertEqual(['x', 'a', 'y'], self._Merge(['x', 'y'], ['a', 'a'],
+                                                  False))
+
+
+class TestSetUpConfigurations(unittest.TestCase):
+  def setUp(self):
+    self.non_configuration_keys = gyp.input.non_configuration_keys
+    gyp.input.non_configuration_keys = \
+        gyp.input.base_non_configuration_keys[:]
+
+  def tearDown(self):
+    gyp.input.non_configuration_keys = self.non_configuration_keys
+
+  def test_Inheritance(self):
+    target_dict = {
+      'target_name': 'foo',
+      'type': 'none',
+      'sources': ['foo.cc'],
+      'defines': ['FOO'],
+      'configurations': {
+        'Base': {'abstract': 1, 'defines': ['BASE']},
+        'Debug': {'inherit_from': ['Base'], 'defines': ['DEBUG']},
+        'Release': {'inherit_from': ['Base']},
+      },
+    }
+    gyp.input.SetUpConfigurations('foo.gyp:foo#target', target_dict)
+    configurations = target_dict['configurations']
+    self.assertEqual(['Debug', 'Release'], sorted(configurations))
+    self.assertEqual({'defines': ['FOO', 'BASE', 'DEBUG'],
+                      'inherit_from': ['Base']}, configurations['Debug'])
+    self.assertEqual(['FOO', 'BASE'], configurations['Release']['defines'])
+    self.assertFalse('defines' in target_dict)
+    configurations['Debug']['defines'].append('MORE')
+    self.assertEqual(['FOO', 'BASE'], configurations['Release']['defines'])
+
+
+class TestProcessTargetsLate(unittest.TestCase):
+  def setUp(self):
+    self.path_sections = gyp.input.path_sections
+    self.non_configuration_keys = gyp.input.non_configuration_keys
+    gyp.input.path_sections = gyp.input.base_path_sections[:]
+    gyp.input.non_configuration_keys = \
+        gyp.input.base_non_configuration_keys[:]
+
+  def tearDown(self):
+    gyp.input.path_sections = self.path_sections
+    gyp.input.non_configuration_keys = self.non_configuration_keys
+    if gyp.input.pymod_host:
+      gyp.input.pymod_host.Close()
+      gyp.input.pymod_host = None
+
+  def _Targets(self, count):
+    targets = {}
+    for index in xrange(count):
+      targets['foo.gyp:t%d#target' % index] = {
+        'target_name': 't%d' % index,
+        'type': 'static_library',
+        'toolset': 'target',
+        'sources': ['a.cc', 'b.cc', 'b_win.cc'],
+        'sources/': [['exclude', '_win\\.cc$']],
+        'defines': ['NAME=>(_target_name)'],
+        'target_conditions': [
+          ['_type=="static_library"', {'defines': ['LIB']}],
+        ],
+        'configurations': {'Debug': {}, 'Release': {'defines': ['NDEBUG']}},
+      }
+    return targets
+
+  def test_ParallelMatchesSerial(self):
+    serial = self._Targets(5)
+    flat_list = sorted(serial)
+    gyp.input.ProcessTargetsLate(flat_list, serial, {}, [])
+    parallel = self._Targets(5)
+    dicts = [parallel[target] for target in flat_list]
+    gyp.input.ProcessTargetsLateParallel(flat_list, parallel, {}, [], 2)
+    self.assertEqual(serial, parallel)
+    self.assertEqual(['NAME=t0', 'LIB', 'NDEBUG'],
+                     parallel[flat_list[0]]['configurations']['Release']
+                                           ['defines'])
+    # The existing target dicts were updated.
+    self.assertEqual(dicts, [parallel[target] for target in flat_list])
+    self.assertTrue(dicts[0] is parallel[flat_list[0]])
+    # Nothing needed the PymodHost, so it isn't served.
+    self.assertEqual(None, gyp.input.ServedPymodHostAddress())
+
+  def test_ParallelPymod(self):
+    tempdir = tempfile.mkdtemp()
+    sys.path.insert(0, tempdir)
+    try:
+      open(os.path.join(tempdir, 'pymod_late_module.py'), 'w').write(
+          'def DoMain(args):\n'
+          '  return "-".join(args)\n')
+      targets = self._Targets(4)
+      targets['foo.gyp:t2#target']['defines'].append(
+          '>!pymod_do_main(pymod_late_module a b)')
+      gyp.input.ProcessTargetsLateParallel(sorted(targets), targets, {}, [],
+                                           2)
+    finally:
+      sys.path.remove(tempdir)
+      shutil.rmtree(tempdir)
+    self.assertEqual(['NAME=t2', 'a-b', 'LIB'],
+                     targets['foo.gyp:t2#target']['configurations']['Debug']
+                                                 ['defines'])
+    self.assertNotEqual(None, gyp.input.ServedPymodHostAddress())
+
+  def test_ParallelError(self):
+    targets = self._Targets(3)
+    targets['foo.gyp:t1#target']['type'] = 'bogus'
+    self.assertRaises(gyp.common.GypError,
+                      gyp.input.ProcessTargetsLateParallel, sorted(targets),
+                      targets, {}, [], 2)
+
+
+class TestProcessListFilters(unittest.TestCase):
+  def test_Filters(self):
+    the_dict = {
+      'sources': ['a.cc', 'a_linux.cc', 'a_mac.cc', 'a_win.cc', 'b_mac.cc'],
+      'sources!': ['a.cc', 'b_mac.cc'],
+      'sources/': [['exclude', '_(linux|mac|win)\\.cc$'],
+                   ['include', '_mac\\.cc$'],
+                   ['exclude', '^b']],
+    }
+    gyp.input.ProcessListFiltersInDict('foo', the_dict)
+    self.assertEqual({'sources': ['a_mac.cc'],
+                      'sources_excluded': ['a.cc', 'a_linux.cc', 'a_win.cc',
+                                           'b_mac.cc']}, the_dict)
+
+  def test_NonStringItems(self):
+    the_dict = {
+      'warnings': [4251, 'a', 'b'],
+      'warnings!': [4251],
+      'warnings/': [['exclude', 'b']],
+    }
+    gyp.input.ProcessListFiltersInDict('foo', the_dict)
+    self.assertEqual({'warnings': ['a'], 'warnings_excluded': [4251, 'b']},
+                     the_dict)
+
+  def test_CompileListFilters(self):
+    filters = gyp.input.CompileListFilters(
+        [(0, 'a'), (1, 'b'), (1, 'c'), (1, '(x)\\1'), (0, '(?i)d')])
+    self.assertEqual([0, 1, 1, 0], [action for action, regex in filters])
+    self.assertTrue(filters[2][1].search('b'))
+    self.assertTrue(filters[2][1].search('c'))
+    self.assertFalse(filters[1][1].search('x'))
+
+
+class TestIncludeSnapshot(unittest.TestCase):
+  INCLUDE = {
+    'variables': {'chromium_code%': 0, 'conditions': [['OS=="win"', {}]]},
+    'target_defaults': {
+      'defines': ['A', 'B', 'A'],
+      'include_dirs': ['<(DEPTH)', 'relative/dir'],
+      'cflags+': ['-O2'],
+      'configurations': {'Debug': {'defines': ['DEBUG']}},
+    },
+    'sources': ['a.cc', 'a.cc', '$(SRC)/b.cc'],
+    'msvs_settings': {'foo_path': 'x/y'},
+  }
+
+  def setUp(self):
+    gyp.input.include_snapshots.clear()
+
+  def _CheckMerge(self, to, to_file):
+    include = 'build/common.gypi'
+    expected = copy.deepcopy(to)
+    gyp.input.MergeDicts(expected, self.INCLUDE, to_file, include)
+    for i in xrange(3):
+      result = copy.deepcopy(to)
+      gyp.input.MergeIncludedDict(result, self.INCLUDE, to_file, include)
+      self.assertEqual(expected, result)
+
+  def test_Empty(self):
+    self._CheckMerge({}, 'foo/foo.gyp')
+
+  def test_Overrides(self):
+    self._CheckMerge({'target_defaults': {'defines': ['C'], 'cflags': ['-g']},
+                      'sources': ['z.cc']},
+                     'foo/bar/foo.gyp')
+
+  def test_SharedValuesAreCopies(self):
+    include = 'build/common.gypi'
+    first = {}
+    second = {}
+    gyp.input.MergeIncludedDict(first, self.INCLUDE, 'a/a.gyp', include)
+    gyp.input.MergeIncludedDict(second, self.INCLUDE, 'b/b.gyp', include)
+    second['target_defaults']['defines'].append('C')
+    self.assertEqual(['A', 'B'], first['target_defaults']['defines'])
+    self.assertEqual(['A', 'B', 'A'], self.INCLUDE['target_defaults']['defines'])
+
+  def test_IncompatiblePolicies(self):
+    include = 'bad.gypi'
+    fro = {'sources': ['a.cc'], 'sources=': ['b.cc']}
+    for i in xrange(2):
+      self.assertRaises(gyp.common.GypError, gyp.input.MergeIncludedDict,
+                        {}, fro, 'foo.gyp', include)
+
+
+  def test_IncludedTargetBuildFile(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      open(os.path.join(tempdir, 'x.gyp'), 'w').write("{'sources': ['x.cc']}")
+      for name in ('a.gyp', 'b.gyp', 'c.gyp'):
+        open(os.path.join(tempdir, name), 'w').write("{'includes': ['x.gyp']}")
+      data = {}
+      def Load(name):
+        return gyp.input.LoadOneBuildFile(os.path.join(tempdir, name), data,
+                                          {}, {}, None, True, False)
+      Load('a.gyp')
+      Load('b.gyp')
+      # Target build files are modified in place once loaded, so c.gyp has
+      # to get x.gyp as it is then.
+      Load('x.gyp')['sources'].append('y.cc')
+      self.assertEqual(['x.cc', 'y.cc'], Load('c.gyp')['sources'])
+    finally:
+      shutil.rmtree(tempdir)
+
+class TestParallelState(unittest.TestCase):
+  def test_MostWantedFirst(self):
+    state = gyp.input.ParallelState()
+    for build_file in ('a.gyp', 'b.gyp', 'c.gyp'):
+      state.Schedule(build_file)
+    self.assertEqual('a.gyp', state.NextBuildFile())
+    state.Schedule('c.gyp')
+    state.Schedule('d.gyp')
+    state.Schedule('d.gyp')
+    state.Schedule('d.gyp')
+    # Already loading.
+    state.Schedule('a.gyp')
+    self.assertEqual(['d.gyp', 'c.gyp', 'b.gyp', None],
+                     [state.NextBuildFile() for i in xrange(4)])
+
+
+class TestExpandVariables(unittest.TestCase):
+  VARIABLES = {
+    'a': 'A',
+    'b': 'B',
+    'ab': 'AB-value',
+    'a B': 'spaced',
+    'empty': '',
+    'name': 'a',
+    'list': ['x', 'y'],
+    'int': '12',
+  }
+
+  def _Expand(self, string):
+    return gyp.input.ExpandVariables(string, gyp.input.PHASE_EARLY,
+                                     self.VARIABLES, 'foo.gyp')
+
+  def test_Expansions(self):
+    cases = [
+      ('plain', 'plain'),
+      ('<(a)/<(b).cc', 'A/B.cc'),
+      ('<(<(name))', 'A'),
+      ('<(<(name)b)', 'AB-value'),
+      ('<(a <(b))', 'spaced'),
+      ('<(int)', 12),
+      ('<@(list)', ['x', 'y']),
+      ('-l<(list)', '-lx y'),
+      ('<@(list)<(empty)', ['x', 'y']),
+    ]
+    for i in xrange(2):
+      # The second round uses the cached expansion templates.
+      for string, expected in cases:
+        self.assertEqual(expected, self._Expand(string))
+
+  def test_UndefinedVariable(self):
+    for i in xrange(2):
+      self.assertRaises(gyp.common.GypError, self._Expand, '<(undefined)')
+
+
+class TestParseBuildFile(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.build_file = os.path.join(self.tempdir, 'foo.gyp')
+    open(self.build_file, 'w').write('{}')
+    gyp.input.parsed_build_file_cache = gyp.disk_cache.MemoryCache()
+
+  def tearDown(self):
+    gyp.input.parsed_build_file_cache = None
+    shutil.rmtree(self.tempdir)
+
+  def _Parse(self, contents):
+    return gyp.input.ParseBuildFile(self.build_file, contents, True)
+
+  def test_Reuse(self):
+    cache = gyp.input.parsed_build_file_cache
+    self.assertEqual({'a': 1}, self._Parse("{'a': 1}"))
+    self.assertEqual({'a': 1}, self._Parse("{'a': 1}"))
+    self.assertEqual(1, cache.hits)
+    # The contents read are what counts, whatever the file on disk says.
+    self.assertEqual({'a': 2}, self._Parse("{'a': 2}"))
+
+
+class TestCommandOutputCache(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.input_path = os.path.join(self.tempdir, 'input.txt')
+    open(self.input_path, 'w').write('one')
+    gyp.input.command_output_cache = gyp.disk_cache.DiskCache(
+        os.path.join(self.tempdir, 'cache'))
+
+  def tearDown(self):
+    gyp.input.command_output_cache = None
+    gyp.input.cached_command_results.clear()
+    shutil.rmtree(self.tempdir)
+
+  def _Run(self, variables):
+    # Each call behaves like a new gyp process.
+    gyp.input.cached_command_results.clear()
+    return gyp.input.ExpandVariables(
+        '<!(cat input.txt)', gyp.input.PHASE_EARLY, variables,
+        os.path.join(self.tempdir, 'foo.gyp'))
+
+  def test_DeclaredInputs(self):
+    cache = gyp.input.command_output_cache
+    variables = {'command_cache_inputs': ['input.txt']}
+    self.assertEqual('one', self._Run(variables))
+    self.assertEqual('one', self._Run(variables))
+    self.assertEqual(1, cache.hits)
+    open(self.input_path, 'w').write('two')
+    self.assertEqual('two', self._Run(variables))
+    self.assertEqual(1, cache.hits)
+
+  def test_UndeclaredInputs(self):
+    cache = gyp.input.command_output_cache
+    self._Run({})
+    self._Run({})
+    self.assertEqual((0, 0), (cache.hits, cache.misses))
+
+
+class TestEarlyPhaseCache(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.build_file = os.path.join(self.tempdir, 'foo.gyp')
+    self.include = os.path.join(self.tempdir, 'common.gypi')
+    open(self.build_file, 'w').write(
+        "{'includes': ['common.gypi'], 'targets': [{'target_name': 'foo', "
+        "'type': 'none', 'defines': ['<(value)', '<!(cat input.txt)']}]}")
+    open(os.path.join(self.tempdir, 'input.txt'), 'w').write('two')
+    self._WriteInclude('one', "'command_cache_inputs': ['input.txt']")
+    gyp.input.early_phase_cache = gyp.disk_cache.DiskCache(
+        os.path.join(self.tempdir, 'cache'))
+
+  def tearDown(self):
+    gyp.input.early_phase_cache = None
+    gyp.input.cached_command_results.clear()
+    shutil.rmtree(self.tempdir)
+
+  def _WriteInclude(self, value, more_variables=''):
+    open(self.include, 'w').write(
+        "{'variables': {'value': '%s', %s}}" % (value, more_variables))
+
+  def _Defines(self, variables=None):
+    # Each call behaves like a new gyp process.
+    gyp.input.cached_command_results.clear()
+    data = {'target_build_files': set()}
+    gyp.input.LoadTargetBuildFile(self.build_file, data, {}, variables or {},
+                                  None, self.tempdir, False, True)
+    return data[self.build_file]['targets'][0]['defines']
+
+  def test_Reuse(self):
+    cache = gyp.input.early_phase_cache
+    self.assertEqual(['one', 'two'], self._Defines())
+    self.assertEqual(['one', 'two'], self._Defines())
+    self.assertEqual(1, cache.hits)
+    # A change to an included file or a declared command input is noticed.
+    self._WriteInclude('three', "'command_cache_inputs': ['input.txt']")
+    self.assertEqual(['three', 'two'], self._Defines())
+    open(os.path.join(self.tempdir, 'input.txt'), 'w').write('four')
+    self.assertEqual(['three', 'four'], self._Defines())
+    self.assertEqual(['three', 'four'], self._Defines())
+
+  def test_Variables(self):
+    open(self.include, 'w').write(
+        "{'variables': {'value%': 'one', 'command_cache_inputs': []}}")
+    early_phases = []
+    run_early_phase = gyp.input.RunEarlyPhase
+    def RunEarlyPhase(build_file_path, *args):
+      early_phases.append(build_file_path)
+      return run_early_phase(build_file_path, *args)
+    gyp.input.RunEarlyPhase = RunEarlyPhase
+    try:
+      # Variables that the early phase doesn't read don't matter.
+      for generator in ('make', 'ninja'):
+        self.assertEqual(['one', 'two'],
+                         self._Defines({'GENERATOR': generator}))
+      self.assertEqual(['five', 'two'], self._Defines({'value': 'five'}))
+      # Both results are kept.
+      self.assertEqual(['one', 'two'], self._Defines())
+      self.assertEqual(['five', 'two'], self._Defines({'value': 'five'}))
+    finally:
+      gyp.input.RunEarlyPhase = run_early_phase
+    self.assertEqual(2, len(early_phases))
+
+  def test_GypSources(self):
+    source = os.path.join(self.tempdir, 'input.py')
+    open(source, 'w').write('one')
+    gyp_sources = gyp.common.GypSources
+    gyp.common.GypSources = lambda: [source]
+    try:
+      gyp.input.gyp_sources_digest = None
+      key = gyp.input.GetEarlyPhaseCacheKey(self.build_file, [], '.', False)
+      # Sources that changed are noticed even with the same size and mtime.
+      st = os.stat(source)
+      open(source, 'w').write('two')
+      os.utime(source, (st.st_atime, st.st_mtime))
+      gyp.input.gyp_sources_digest = None
+      self.assertNotEqual(key, gyp.input.GetEarlyPhaseCacheKey(
+          self.build_file, [], '.', False))
+    finally:
+      gyp.common.GypSources = gyp_sources
+      gyp.input.gyp_sources_digest = None
+
+  def test_UndeclaredCommandInputs(self):
+    cache = gyp.input.early_phase_cache
+    self._WriteInclude('one')
+    self.assertEqual(['one', 'two'], self._Defines())
+    self.assertEqual(['one', 'two'], self._Defines())
+    self.assertEqual((0, 2), (cache.hits, cache.misses))
+
+
+class TestPrefetchCommands(unittest.TestCase):
+  def setUp(self):
+    gyp.input.command_jobs = 4
+    self.tempdir = tempfile.mkdtemp()
+    self.log = os.path.join(self.tempdir, 'log.txt')
+
+  def tearDown(self):
+    gyp.input.command_jobs = 1
+    gyp.input.cached_command_results.clear()
+    gyp.input.prefetch_cache_misses.clear()
+    gyp.input.command_output_cache = None
+    gyp.input.StopCommandPrefetcher()
+    shutil.rmtree(self.tempdir)
+
+  def _Process(self, the_dict, variables=None):
+    variables = variables or {'OS': 'linux'}
+    gyp.input.PrefetchCommands(the_dict, gyp.input.PHASE_EARLY, variables,
+                               'foo.gyp')
+    gyp.input.ProcessVariablesAndConditionsInDict(
+        the_dict, gyp.input.PHASE_EARLY, variables, 'foo.gyp')
+    return the_dict
+
+  def _Runs(self):
+    """Returns the number of times the logging command ran."""
+    if not os.path.exists(self.log):
+      return 0
+    return len(open(self.log).readlines())
+
+  def _LoggingCommand(self):
+    return '<!(echo run >> %s; echo hi )' % self.log
+
+  def test_Results(self):
+    the_dict = {
+      'a': '<!(echo prefetch a)',
+      'b': ['<!@(echo prefetch b c)'],
+      'conditions': [
+        ['OS=="win"', {'c': '<!(exit 1)'}, {'c': '<!(echo prefetch d)'}],
+      ],
+    }
+    self.assertEqual({'a': 'prefetch a', 'b': ['prefetch', 'b', 'c'],
+                      'c': 'prefetch d'}, self._Process(the_dict))
+
+  def test_Failure(self):
+    saved_stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+      self.assertRaises(gyp.common.GypError, self._Process,
+                        {'a': '<!(echo prefetch failure >&2)'})
+    finally:
+      sys.stderr = saved_stderr
+
+  def test_TrailingWhitespace(self):
+    self.assertEqual({'a': 'hi'}, self._Process({'a': self._LoggingCommand()}))
+    self.assertEqual(1, self._Runs())
+    self.assertEqual({}, gyp.input.command_prefetcher.results)
+
+  def test_CachedOutput(self):
+    gyp.input.command_output_cache = gyp.disk_cache.MemoryCache()
+    variables = {'command_cache_inputs': []}
+    for i in xrange(2):
+      gyp.input.cached_command_results.clear()
+      self.assertEqual({'a': 'hi'},
+                       self._Process({'a': self._LoggingCommand()}, variables))
+    self.assertEqual(1, self._Runs())
+    cache = gyp.input.command_output_cache
+    self.assertEqual((1, 1), (cache.hits, cache.misses))
+    # Commands that declare their inputs in the dict itself are found too.
+    gyp.input.cached_command_results.clear()
+    the_dict = {'variables': {'command_cache_inputs': []},
+                'a': self._LoggingCommand()}
+    self.assertEqual('hi', self._Process(the_dict)['a'])
+    self.assertEqual(1, self._Runs())
+    self.assertEqual({}, gyp.input.command_prefetcher.results)
+
+  def test_SeparatePipes(self):
+    # Commands running at the same time mustn't get each other's pipes, such
+    # as this one.
+    read_fd, write_fd = os.pipe()
+    try:
+      self.assertEqual((0, 'closed\n', ''), gyp.input.RunShellCommand(
+          'if [ -e /dev/fd/%d ]; then echo open; else echo closed; fi' %
+          write_fd, None))
+    finally:
+      os.close(read_fd)
+      os.close(write_fd)
+
+  def test_Stop(self):
+    gyp.input.PrefetchCommands({'a': self._LoggingCommand()},
+                               gyp.input.PHASE_EARLY, {}, 'foo.gyp')
+    threads = gyp.input.command_prefetcher.threads
+    gyp.input.StopCommandPrefetcher()
+    self.assertEqual(None, gyp.input.command_prefetcher)
+    self.assertEqual([], [thread for thread in threads if thread.is_alive()])
+    # A later run starts a new prefetcher.
+    self.assertEqual({'a': 'hi'}, self._Process({'a': self._LoggingCommand()}))
+
+
+class TestEvalCondition(unittest.TestCase):
+  def test_Results(self):
+    for os_name, expected in (('linux', True), ('win', False),
+                              ('linux', True), ('mac', True)):
+      variables = {'OS': os_name, 'chromeos': 0}
+      self.assertEqual(expected, gyp.input.EvalCondition(
+          'OS=="linux" or OS in ("mac", "ios") and not chromeos', variables))
+
+  def test_Lists(self):
+    variables = {'list': ['a', 'b']}
+    self.assertTrue(gyp.input.EvalCondition('"a" in list', variables))
+    variables['list'] = ['c']
+    self.assertFalse(gyp.input.EvalCondition('"a" in list', variables))
+
+  def test_NotCacheable(self):
+    self.assertEqual(None, gyp.input.CompileCondition('len(OS) > 1')[1])
+    self.assertEqual(('OS', 'arch'),
+                     gyp.input.CompileCondition('arch!="x64" and OS=="a"')[1])
+
+  def test_Errors(self):
+    for i in xrange(2):
+      self.assertRaises(NameError, gyp.input.EvalCondition,
+                        'undefined==1', {})
+      self.assertRaises(SyntaxError, gyp.input.EvalCondition,
+                        'OS==', {'OS': 'linux'})
+
+
+class TestVariableScope(unittest.TestCase):
+  def test_Layering(self):
+    base = {'OS': 'linux', 'DEPTH': '.'}
+    outer = gyp.input.VariableScope(base)
+    outer['_type'] = 'none'
+    outer['OS'] = 'win'
+    inner = gyp.input.VariableScope(outer)
+    inner['_type'] = 'executable'
+    self.assertEqual('win', inner['OS'])
+    self.assertEqual('executable', inner['_type'])
+    self.assertEqual('none', outer['_type'])
+    self.assertEqual({'OS': 'linux', 'DEPTH': '.'}, base)
+    self.assertEqual({'OS': 'win', 'DEPTH': '.', '_type': 'executable'},
+                     inner.Flatten())
+    self.assertTrue('DEPTH' in inner)
+    self.assertFalse('undefined' in inner)
+    self.assertRaises(KeyError, lambda: inner['undefined'])
+    self.assertEqual(None, inner.get('undefined'))
+
+  def test_Eval(self):
+    scope = gyp.input.VariableScope({'OS': 'linux'})
+    scope['arch'] = 'arm'
+    self.assertTrue(gyp.input.EvalCondition('OS=="linux" and arch=="arm"',
+                                            scope))
+    self.assertRaises(NameError, gyp.input.EvalCondition, 'len(OS)', scope)
+
+
 if __name__ == '__main__':
   unittest.main()
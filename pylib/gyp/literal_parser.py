@@ -0,0 +1,215 @@
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A parser for the Python literal subset used by .gyp and .gypi files.
+
+Build files are a single expression built from dicts, lists, strings and
+numbers.  ParseLiteral() turns such text into the corresponding Python value,
+rejecting anything else (names, operators including the minus sign of
+negative numbers, tuples, calls) and repeated dict keys, just like the
+compiler-based check it replaced.  It tokenizes with a single regular
+expression and builds the result with an explicit stack, so it runs in a
+small multiple of eval()'s time and has no recursion limit.
+"""
+
+import re
+
+from gyp.common import GypError
+
+
+# Matches optional whitespace, comments and line continuations followed by
+# one token.  The token is captured; a token of '' means the end of the input
+# and any unrecognized character is captured on its own so that the parser
+# reports it.  That includes vertical tabs, which Python doesn't take for
+# whitespace either, so that every character but whitespace starts a token.
+# String alternatives are written as "unrolled loops" to keep the regular
+# expression engine from backtracking on every character.
+_TOKEN_RE = re.compile(r'''
+    (?:[ \t\f\r\n]+|\#[^\r\n]*|\\\r?\n)*
+    (
+        [{}\[\](),:]
+      | [uUbB]?[rR]?
+        (?:'\'\'[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'\'\'
+          |"""[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""
+          |'[^'\\\r\n]*(?:\\.[^'\\\r\n]*)*'
+          |"[^"\\\r\n]*(?:\\.[^"\\\r\n]*)*")
+      | 0[xX][0-9a-fA-F]+[lL]?
+      | (?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?[lLjJ]?
+      | [^ \t\f\r\n]
+      |
+    )''', re.VERBOSE | re.DOTALL)
+
+_STRING_STARTS = frozenset('\'"uUbBrR')
+_NUMBER_STARTS = frozenset('.0123456789')
+
+# Stack entry kinds.
+_DICT = 0
+_LIST = 1
+_PAREN = 2
+
+
+def _Position(text, token_index):
+  """Returns (line, column, line_text) of token number |token_index|."""
+  offset = len(text)
+  for index, match in enumerate(_TOKEN_RE.finditer(text)):
+    if index == token_index:
+      offset = match.start(1)
+      break
+  line = text.count('\n', 0, offset) + 1
+  line_start = text.rfind('\n', 0, offset) + 1
+  line_end = text.find('\n', offset)
+  if line_end == -1:
+    line_end = len(text)
+  return line, offset - line_start + 1, text[line_start:line_end]
+
+
+def _Error(text, token_index, message):
+  line, column, line_text = _Position(text, token_index)
+  return SyntaxError('%s at column %d' % (message, column),
+                     (None, line, column, line_text))
+
+
+def _DecodeString(token):
+  quote = token[0]
+  if quote == '"' or quote == "'":
+    if '\\' not in token:
+      if token[1:3] == quote * 2 and len(token) >= 6:
+        return token[3:-3]
+      return token[1:-1]
+  # Prefixed strings and strings with escapes take the slow path.  The token
+  # matched the string grammar, so evaluating it is safe.
+  return eval(token, {'__builtins__': None}, None)
+
+
+def _DecodeNumber(token):
+  if token.isdigit() and (token[0] != '0' or token == '0'):
+    return int(token)
+  return eval(token, {'__builtins__': None}, None)
+
+
+def ParseLiteral(text):
+  """Returns the Python value of |text|, a gyp build file's contents.
+
+  Raises SyntaxError (with line and column information) for anything outside
+  the literal subset, and GypError if a dict repeats a key.
+  """
+  tokens = _TOKEN_RE.findall(text)
+  pos = 0
+  # Each entry is [kind, container, key] for a container being filled in.
+  # For dicts, key is the key whose value is being parsed.
+  stack = []
+  while True:
+    # Parse one value starting at tokens[pos].  Containers push themselves
+    # onto the stack and loop back here for their first item.
+    token = tokens[pos]
+    pos += 1
+    first = token[:1]
+    if first == '{':
+      if tokens[pos] == '}':
+        pos += 1
+        value = {}
+      else:
+        key, pos = _ParseKey(text, tokens, pos)
+        stack.append([_DICT, {}, key])
+        continue
+    elif first == '[':
+      if tokens[pos] == ']':
+        pos += 1
+        value = []
+      else:
+        stack.append([_LIST, [], None])
+        continue
+    elif first == '(':
+      stack.append([_PAREN, None, None])
+      continue
+    elif first in _STRING_STARTS and len(token) > 1:
+      value = _DecodeString(token)
+      # Adjacent string literals are concatenated.
+      while tokens[pos][:1] in _STRING_STARTS and len(tokens[pos]) > 1:
+        value += _DecodeString(tokens[pos])
+        pos += 1
+    elif first in _NUMBER_STARTS and token != '.':
+      value = _DecodeNumber(token)
+    elif token == '':
+      raise _Error(text, pos - 1, 'unexpected end of input')
+    else:
+      raise _Error(text, pos - 1, 'invalid syntax')
+
+    # Store the value into its container.  A closing bracket completes the
+    # container, which then gets stored into its own container in turn.
+    while True:
+      if not stack:
+        # The end of the input is a zero-length token; any text after one is
+        # left over too.
+        if tokens[pos] != '' or any(tokens[pos + 1:]):
+          raise _Error(text, pos, 'unexpected text after the value')
+        return value
+      entry = stack[-1]
+      kind = entry[0]
+      token = tokens[pos]
+      pos += 1
+      if kind == _DICT:
+        container = entry[1]
+        key = entry[2]
+        if key in container:
+          raise GypError("Key '" + str(key) + "' repeated at level " +
+                         repr(len(_KeyPath(stack))) + " with key path '" +
+                         '.'.join(_KeyPath(stack)[:-1]) + "'")
+        container[key] = value
+        if token == ',':
+          if tokens[pos] != '}':
+            entry[2], pos = _ParseKey(text, tokens, pos)
+            break
+          pos += 1
+        elif token != '}':
+          raise _Error(text, pos - 1, "expected ',' or '}'")
+      elif kind == _LIST:
+        container = entry[1]
+        container.append(value)
+        if token == ',':
+          if tokens[pos] != ']':
+            break
+          pos += 1
+        elif token != ']':
+          raise _Error(text, pos - 1, "expected ',' or ']'")
+      else:
+        if token == ',':
+          raise _Error(text, pos - 1, 'tuples are not allowed')
+        elif token != ')':
+          raise _Error(text, pos - 1, "expected ')'")
+        stack.pop()
+        continue
+      stack.pop()
+      value = container
+
+
+def _ParseKey(text, tokens, pos):
+  """Parses a dict key and the ':' after it.  Returns (key, new_pos)."""
+  token = tokens[pos]
+  first = token[:1]
+  if first in _STRING_STARTS and len(token) > 1:
+    key = _DecodeString(token)
+    pos += 1
+    while tokens[pos][:1] in _STRING_STARTS and len(tokens[pos]) > 1:
+      key += _DecodeString(tokens[pos])
+      pos += 1
+  elif first in _NUMBER_STARTS and token != '.':
+    key = _DecodeNumber(token)
+    pos += 1
+  else:
+    raise _Error(text, pos, 'expected a string or number as dict key')
+  if tokens[pos] != ':':
+    raise _Error(text, pos, "expected ':'")
+  return key, pos + 1
+
+
+def _KeyPath(stack):
+  """Returns the key path leading to the value being parsed, as strings."""
+  path = []
+  for kind, container, key in stack:
+    if kind == _DICT:
+      path.append(str(key))
+    elif kind == _LIST:
+      path.append(repr(len(container)))
+  return path
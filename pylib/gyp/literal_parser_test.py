@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for the literal_parser.py file."""
+
+import gyp.common
+import gyp.literal_parser
+import unittest
+
+
+class TestParseLiteral(unittest.TestCase):
+  def assertParsesLikeEval(self, text):
+    self.assertEqual(eval(text, {'__builtins__': None}, None),
+                     gyp.literal_parser.ParseLiteral(text))
+
+  def test_Values(self):
+    self.assertParsesLikeEval("""
+# A comment.
+{
+  'variables': {'a%': 1, "b": 2e-2, 'c': 0x10, 'd': 1.5,},
+  'targets': [
+    {
+      'target_name': 'foo',  # Trailing comment.
+      'defines': ['X="y"', 'TAB=\\t', u'unicode', r'raw\\n'],
+      'message': 'adjacent ' "strings "
+                 '''and triple quotes''',
+      'grouped': ('parenthesized'),
+      'empty': [{}, [], ''],
+    },
+  ],
+}
+""")
+
+  def test_RepeatedKey(self):
+    text = "{'targets': [{'a': 1, 'b': {'c': 2, 'c': 3}}]}"
+    try:
+      gyp.literal_parser.ParseLiteral(text)
+      self.fail('Repeated key not detected')
+    except gyp.common.GypError, e:
+      self.assertEqual("Key 'c' repeated at level 4 with key path "
+                       "'targets.0.b'", str(e))
+
+  def test_Invalid(self):
+    for text in ("{'a': 1", "{'a': foo}", "['a', 'b'] + ['c']", "('a', 'b')",
+                 "{'a' 1}", "", "['a',,]", "{'a': len('b')}",
+                 "[1]\v", "[1]\v'ignored'", "{'a':\v1}"):
+      self.assertRaises(SyntaxError, gyp.literal_parser.ParseLiteral, text)
+
+  def test_NegativeNumbers(self):
+    # Like the compiler-based check before it, the parser takes the minus sign
+    # for an operator.
+    for text in ("-1", "{'a': -1}", "[-1.5]", "{-1: 'a'}"):
+      self.assertRaises(SyntaxError, gyp.literal_parser.ParseLiteral, text)
+
+  def test_ErrorPosition(self):
+    try:
+      gyp.literal_parser.ParseLiteral("{\n  'a': 1\n  'b': 2,\n}")
+      self.fail('Syntax error not detected')
+    except SyntaxError, e:
+      self.assertEqual(3, e.lineno)
+      self.assertEqual(3, e.offset)
+
+  def test_DeepNesting(self):
+    depth = 5000
+    value = gyp.literal_parser.ParseLiteral('[' * depth + ']' * depth)
+    for i in xrange(depth - 1):
+      value = value[0]
+    self.assertEqual([], value)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,229 @@
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Long-lived host processes for <!pymod_do_main() expansions.
+
+<!pymod_do_main(module args) imports |module| and calls its DoMain() with
+the build file's directory as the working directory.  Doing that in the gyp
+process itself means changing the process-wide working directory, which
+isn't safe once commands run on threads.  A PymodHost instead hands each call
+to one of a small pool of host processes.  Hosts keep the modules they have
+imported, change their own working directory per call, and run one call at a
+time, so the pool runs up to |jobs| calls concurrently.
+
+Parallel loader workers reach the PymodHost of the main gyp process through
+a PymodClient, so every module is imported by the hosts only, not again in
+every worker.
+"""
+
+import marshal
+import multiprocessing.connection
+import os
+import Queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from gyp.common import GypError
+
+
+# Bootstraps a host process: the parent's sys.path is the first message, so
+# that the host finds both gyp and the modules the parent would find.
+_HOST_SCRIPT = ('import marshal, sys; sys.path[:] = marshal.load(sys.stdin); '
+                'import gyp.pymod_host; gyp.pymod_host.HostMain()')
+
+
+def HostMain():
+  """Serves (cwd, module, args) calls from stdin until it's closed.
+
+  Each reply is (True, output, seconds) or (False, error message, seconds).
+  """
+  # DoMain implementations may print, so keep the real stdout for replies
+  # and send everything else to stderr.
+  replies = os.fdopen(os.dup(1), 'wb')
+  os.dup2(2, 1)
+  sys.stdout = sys.stderr
+  while True:
+    try:
+      cwd, module_name, args = marshal.load(sys.stdin)
+    except EOFError:
+      return
+    start_time = time.time()
+    try:
+      os.chdir(cwd)
+      try:
+        module = __import__(module_name)
+      except ImportError, e:
+        reply = (False, 'Error importing pymod_do_main module (%s): %s' %
+                 (module_name, e))
+      else:
+        reply = (True, str(module.DoMain(args)).rstrip())
+    except Exception:
+      reply = (False, 'Exception in %s.DoMain:\n%s' %
+               (module_name, traceback.format_exc()))
+    marshal.dump(reply + (time.time() - start_time,), replies)
+    replies.flush()
+
+
+class PymodHost(object):
+  """Runs DoMain() calls on a pool of up to |jobs| host processes.
+
+  Call() may be used from several threads at once.
+
+  Attributes:
+    stats: maps module names to [calls, seconds spent in DoMain()].
+  """
+
+  def __init__(self, jobs=1):
+    self.jobs = jobs
+    self.stats = {}
+    self.lock = threading.Lock()
+    self.idle_hosts = Queue.Queue()
+    self.host_count = 0
+    self.address = None
+
+  def _StartHost(self):
+    # Hosts must see the end of their input when this process goes away, so
+    # they mustn't inherit each other's pipes.
+    host = subprocess.Popen([sys.executable, '-c', _HOST_SCRIPT],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            close_fds=(sys.platform != 'win32'))
+    marshal.dump(sys.path, host.stdin)
+    return host
+
+  def _AcquireHost(self):
+    self.lock.acquire()
+    try:
+      start = self.idle_hosts.empty() and self.host_count < self.jobs
+      if start:
+        self.host_count += 1
+    finally:
+      self.lock.release()
+    if start:
+      try:
+        return self._StartHost()
+      except Exception:
+        self._ForgetHost()
+        raise
+    return self.idle_hosts.get()
+
+  def _ForgetHost(self):
+    self.lock.acquire()
+    try:
+      self.host_count -= 1
+    finally:
+      self.lock.release()
+
+  def Call(self, cwd, module_name, args):
+    """Returns the output of |module_name|.DoMain(|args|) run in |cwd|.
+
+    Raises GypError if the module can't be imported or DoMain() fails.
+    """
+    host = self._AcquireHost()
+    try:
+      marshal.dump((cwd, module_name, args), host.stdin)
+      host.stdin.flush()
+      ok, output, seconds = marshal.load(host.stdout)
+    except (EOFError, IOError, ValueError):
+      self._ForgetHost()
+      host.stdin.close()
+      host.wait()
+      raise GypError('pymod_do_main host exited while running %s' %
+                     module_name)
+    self.idle_hosts.put(host)
+
+    self.lock.acquire()
+    try:
+      module_stats = self.stats.setdefault(module_name, [0, 0.0])
+      module_stats[0] += 1
+      module_stats[1] += seconds
+    finally:
+      self.lock.release()
+    if not ok:
+      raise GypError(output)
+    return output
+
+  def Close(self):
+    """Stops the idle host processes, along with the modules they imported.
+    """
+    while True:
+      try:
+        host = self.idle_hosts.get_nowait()
+      except Queue.Empty:
+        return
+      self._ForgetHost()
+      host.stdin.close()
+      host.wait()
+
+  def Serve(self):
+    """Makes this host callable from other processes through PymodClient.
+
+    Returns the address to pass to PymodClient.
+    """
+    if self.address:
+      return self.address
+    authkey = os.urandom(20)
+    listener = multiprocessing.connection.Listener(authkey=authkey)
+    thread = threading.Thread(target=self._Accept, args=(listener,))
+    thread.daemon = True
+    thread.start()
+    self.address = (listener.address, authkey)
+    return self.address
+
+  def _Accept(self, listener):
+    while True:
+      connection = listener.accept()
+      thread = threading.Thread(target=self._ServeConnection,
+                                args=(connection,))
+      thread.daemon = True
+      thread.start()
+
+  def _ServeConnection(self, connection):
+    while True:
+      try:
+        cwd, module_name, args = connection.recv()
+      except EOFError:
+        connection.close()
+        return
+      try:
+        reply = (True, self.Call(cwd, module_name, args))
+      except GypError, e:
+        reply = (False, str(e))
+      connection.send(reply)
+
+
+class PymodClient(object):
+  """Forwards DoMain() calls to the PymodHost serving |address|.
+
+  Each concurrent call uses its own connection, so calls from several
+  threads run in parallel on the host's pool.
+  """
+
+  def __init__(self, address):
+    self.address = address
+    self.lock = threading.Lock()
+    self.idle_connections = []
+
+  def Call(self, cwd, module_name, args):
+    """Like PymodHost.Call."""
+    self.lock.acquire()
+    try:
+      connection = self.idle_connections and self.idle_connections.pop()
+    finally:
+      self.lock.release()
+    if not connection:
+      address, authkey = self.address
+      connection = multiprocessing.connection.Client(address, authkey=authkey)
+    connection.send((cwd, module_name, args))
+    ok, output = connection.recv()
+    self.lock.acquire()
+    try:
+      self.idle_connections.append(connection)
+    finally:
+      self.lock.release()
+    if not ok:
+      raise GypError(output)
+    return output
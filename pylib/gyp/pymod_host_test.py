@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for the pymod_host.py file."""
+
+import gyp.common
+import gyp.pymod_host
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+class TestPymodHost(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    module_file = open(os.path.join(self.directory, 'pymod_test_module.py'),
+                       'w')
+    module_file.write('import os\n'
+                      'def DoMain(args):\n'
+                      '  print "stray output"\n'
+                      '  if args == ["fail"]:\n'
+                      '    raise ValueError("failed")\n'
+                      '  return " ".join([os.path.basename(os.getcwd())] + '
+                      'args) + "\\n"\n')
+    module_file.close()
+    os.mkdir(os.path.join(self.directory, 'subdir'))
+    sys.path.insert(0, self.directory)
+    self.host = gyp.pymod_host.PymodHost(2)
+
+  def tearDown(self):
+    sys.path.remove(self.directory)
+    shutil.rmtree(self.directory)
+
+  def _Call(self, host, args):
+    return host.Call(os.path.join(self.directory, 'subdir'),
+                     'pymod_test_module', args)
+
+  def test_Call(self):
+    for i in xrange(2):
+      self.assertEqual('subdir a b', self._Call(self.host, ['a', 'b']))
+    self.assertEqual({'pymod_test_module': 2},
+                     dict((module, stats[0])
+                          for module, stats in self.host.stats.iteritems()))
+
+  def test_Errors(self):
+    self.assertRaises(gyp.common.GypError, self._Call, self.host, ['fail'])
+    self.assertRaises(gyp.common.GypError, self.host.Call, self.directory,
+                      'no_such_pymod_test_module', [])
+    self.assertEqual('subdir', self._Call(self.host, []))
+
+  def test_Close(self):
+    self.assertEqual('subdir', self._Call(self.host, []))
+    self.host.Close()
+    self.assertEqual(0, self.host.host_count)
+    self.assertEqual('subdir', self._Call(self.host, []))
+
+  def test_Client(self):
+    client = gyp.pymod_host.PymodClient(self.host.Serve())
+    self.assertEqual('subdir c', self._Call(client, ['c']))
+    self.assertRaises(gyp.common.GypError, self._Call, client, ['fail'])
+
+
+if __name__ == '__main__':
+  unittest.main()
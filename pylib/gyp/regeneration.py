@@ -0,0 +1,123 @@
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Lets gyp skip runs that would generate the same output again.
+
+Build wrappers often run gyp before every build.  After a full run with
+--cache-dir, gyp_main stores a manifest of the run, keyed by the command line,
+the working directory, the environment, and the build files and forced
+includes the run resolved.  The manifest lists what the run depended on: the
+build files it read, the declared inputs of the commands it ran, gyp's own
+sources and the files the generators wrote.  When the same command line is
+run again, gyp_main checks the manifest before loading anything, and stops
+right away if nothing in it changed.
+
+Runs that expand a command without declared inputs (see the
+command_cache_inputs variable) or write a <|() file list are never recorded,
+since there is no telling whether their results would change.
+"""
+
+import __builtin__
+import os
+import sys
+
+import gyp.common
+import gyp.input
+
+
+# Environment variables that shells set differently from one invocation to the
+# next, and that don't affect gyp.
+VOLATILE_ENVIRONMENT = frozenset(['_', 'OLDPWD', 'PWD', 'SHLVL'])
+
+
+def RunKey(args, build_files, includes):
+  """Returns the key of the manifest of a gyp run with arguments |args|.
+
+  |build_files| and |includes| are the build files and forced includes the run
+  resolved them to.
+  """
+  environment = sorted(item for item in os.environ.iteritems()
+                       if item[0] not in VOLATILE_ENVIRONMENT)
+  return repr((os.getcwd(), sys.executable, sys.argv[0], list(args),
+               environment, sorted(build_files), list(includes)))
+
+
+def InputFiles(data):
+  """Returns the build files and included files of the |data| Load returned.
+  """
+  input_files = set()
+  for build_file in data['target_build_files']:
+    build_file_dir = os.path.dirname(build_file)
+    for included_file in data[build_file]['included_files']:
+      input_files.add(os.path.normpath(os.path.join(build_file_dir,
+                                                    included_file)))
+  return input_files
+
+
+class OutputRecorder(object):
+  """Collects the paths of the files generators write while it's started.
+
+  Generators write most files with open(), and the rest through
+  gyp.common.WriteOnDiff or with gyp.common.RecordWrittenFile, so the
+  recorder wraps the built-in open() and sets gyp.common.written_files.
+
+  Attributes:
+    paths: the set of absolute paths written so far.
+  """
+
+  def __init__(self):
+    self.paths = set()
+    self.original_open = None
+
+  def Start(self):
+    self.original_open = __builtin__.open
+    __builtin__.open = self._Open
+    gyp.common.written_files = self.paths
+
+  def Stop(self):
+    __builtin__.open = self.original_open
+    gyp.common.written_files = None
+
+  def _Open(self, name, mode='r', *args):
+    if mode[:1] in ('w', 'a') or '+' in mode:
+      self.paths.add(os.path.abspath(name))
+    return self.original_open(name, mode, *args)
+
+
+def BuildManifest(input_files, expansions, output_files):
+  """Returns the manifest of a run, or None if the run can't be revalidated.
+
+  |input_files| are the build files the run read, |expansions| the entries
+  gyp.input.expansion_log collected, and |output_files| the files written.
+  """
+  if None in expansions:
+    return None
+  commands = dict((repr(command), command) for command in expansions)
+  file_states = [gyp.common.FileState(path)
+                 for path in sorted(input_files) + gyp.common.GypSources()]
+  output_states = []
+  for path in sorted(output_files):
+    # Temporary files that were removed again aren't outputs.
+    if os.path.isfile(path):
+      st = os.stat(path)
+      output_states.append((path, st.st_size, st.st_mtime))
+  return (file_states, commands.values(), output_states)
+
+
+def ManifestIsCurrent(manifest):
+  """Returns whether nothing that a run's |manifest| lists changed since."""
+  (file_states, commands, output_states) = manifest
+  for file_state in file_states:
+    if not gyp.common.FileStateIsCurrent(file_state):
+      return False
+  if not gyp.input.CommandInputsAreCurrent(commands):
+    return False
+  for (path, size, mtime) in output_states:
+    try:
+      st = os.stat(path)
+    except OSError:
+      return False
+    if st.st_size != size or st.st_mtime != mtime:
+      return False
+  return True
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for the regeneration.py file."""
+
+import gyp
+import gyp.common
+import gyp.input
+import gyp.regeneration
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+class TestManifest(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.build_file = os.path.join(self.tempdir, 'foo.gyp')
+    self.output = os.path.join(self.tempdir, 'Makefile')
+    self.input = os.path.join(self.tempdir, 'input.txt')
+    for path in (self.build_file, self.output, self.input):
+      open(path, 'w').write('x')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Manifest(self):
+    command = (['input.txt'], self.tempdir,
+               gyp.input.FingerprintCommandInputs(['input.txt'], self.tempdir))
+    return gyp.regeneration.BuildManifest([self.build_file], [command],
+                                          [self.output])
+
+  def test_Unchanged(self):
+    manifest = self._Manifest()
+    self.assertTrue(gyp.regeneration.ManifestIsCurrent(manifest))
+    # Only the contents of inputs matter.
+    os.utime(self.build_file, (0, 0))
+    self.assertTrue(gyp.regeneration.ManifestIsCurrent(manifest))
+
+  def test_Changes(self):
+    for path in (self.build_file, self.input):
+      manifest = self._Manifest()
+      open(path, 'w').write('yy')
+      self.assertFalse(gyp.regeneration.ManifestIsCurrent(manifest))
+    manifest = self._Manifest()
+    os.remove(self.output)
+    self.assertFalse(gyp.regeneration.ManifestIsCurrent(manifest))
+
+  def test_UndeclaredCommand(self):
+    self.assertEqual(None, gyp.regeneration.BuildManifest([self.build_file],
+                                                          [None], []))
+
+
+class TestOutputRecorder(unittest.TestCase):
+  def test_Record(self):
+    tempdir = tempfile.mkdtemp()
+    try:
+      recorder = gyp.regeneration.OutputRecorder()
+      recorder.Start()
+      try:
+        open(os.path.join(tempdir, 'a.mk'), 'w').close()
+        open(os.path.join(tempdir, 'a.mk')).close()
+        f = gyp.common.WriteOnDiff(os.path.join(tempdir, 'b.ninja'))
+        f.write('b')
+        f.close()
+      finally:
+        recorder.Stop()
+      open(os.path.join(tempdir, 'c.mk'), 'w').close()
+      self.assertEqual(set([os.path.join(tempdir, 'a.mk'),
+                            os.path.join(tempdir, 'b.ninja')]),
+                       recorder.paths)
+    finally:
+      shutil.rmtree(tempdir)
+
+
+class TestRegeneration(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    build_file = open(os.path.join(self.tempdir, 'test.gyp'), 'w')
+    build_file.write("{'targets': [{'target_name': 'test', 'type': 'none', "
+                     "'sources': ['a.cc']}]}")
+    build_file.close()
+    self.vcproj = os.path.join(self.tempdir, 'test.vcproj')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def _Run(self, args=('-f', 'msvs', '-G', 'msvs_version=2008', 'test.gyp')):
+    gyp_main = os.path.join(os.path.dirname(os.path.abspath(gyp.__file__)),
+                            os.path.pardir, os.path.pardir, 'gyp_main.py')
+    subprocess.check_call(
+        [sys.executable, gyp_main, '--depth=.', '--cache-dir=cache'] +
+        list(args), cwd=self.tempdir, stdout=open(os.devnull, 'w'))
+
+  def test_UnchangedOutputRemoved(self):
+    self._Run()
+    # The next run leaves the project file as it was.
+    open(os.path.join(self.tempdir, 'test.gyp'), 'a').write('\n# x\n')
+    self._Run()
+    os.remove(self.vcproj)
+    self._Run()
+    self.assertTrue(os.path.exists(self.vcproj))
+
+  def test_BuildFileAdded(self):
+    # Without build files on the command line, gyp loads the ones in the
+    # current directory.
+    args = ['-f', 'make']
+    self._Run(args)
+    open(os.path.join(self.tempdir, 'b.gyp'), 'w').write(
+        "{'targets': [{'target_name': 'b', 'type': 'none'}]}")
+    self._Run(args)
+    self.assertTrue(os.path.exists(os.path.join(self.tempdir, 'b.target.mk')))
+
+  def test_DefaultIncludeAdded(self):
+    args = ['-f', 'make', '--config-dir=config', 'test.gyp']
+    os.mkdir(os.path.join(self.tempdir, 'config'))
+    self._Run(args)
+    open(os.path.join(self.tempdir, 'config', 'include.gypi'), 'w').write(
+        "{'target_defaults': {'defines': ['FROM_INCLUDE']}}")
+    self._Run(args)
+    makefile = open(os.path.join(self.tempdir, 'test.target.mk')).read()
+    self.assertTrue('FROM_INCLUDE' in makefile)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,237 @@
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A resident gyp process that serves gyp runs over a Unix domain socket.
+
+gyp --server=SOCKET keeps the caches gyp_main would otherwise keep in
+--cache-dir in memory: parsed build files, target build files after the early
+phase and the output of commands with declared inputs, along with the
+manifests of previous runs.  gyp --use-server=SOCKET (or GYP_SERVER) sends
+its arguments, working directory and environment to the server, which runs
+gyp_main with them and sends back the exit status and the output.  The
+generators write their files just as they would in the client.
+
+Cached entries are checked against the files they were computed from before
+each use, as with --cache-dir, so a warm run only parses and expands the
+build files that changed.  When gyp's own sources change, the server exits
+and its clients go back to running gyp themselves.
+"""
+
+import marshal
+import os
+import socket
+import StringIO
+import struct
+import sys
+import traceback
+
+import gyp
+import gyp.common
+import gyp.disk_cache
+import gyp.input
+import gyp.regeneration
+from gyp.common import GypError
+
+
+# True while this process runs gyp_main for a client, so that gyp_main
+# doesn't hand the run to a server again.
+serving = False
+
+
+def _Send(connection, value):
+  contents = marshal.dumps(value)
+  connection.sendall(struct.pack('!I', len(contents)) + contents)
+
+
+def _ReceiveBytes(connection, size):
+  chunks = []
+  while size:
+    chunk = connection.recv(size)
+    if not chunk:
+      raise EOFError('connection closed')
+    chunks.append(chunk)
+    size -= len(chunk)
+  return ''.join(chunks)
+
+
+def _Receive(connection):
+  size, = struct.unpack('!I', _ReceiveBytes(connection, 4))
+  return marshal.loads(_ReceiveBytes(connection, size))
+
+
+def Listen(address):
+  """Returns a socket listening on the Unix domain socket path |address|.
+
+  Replaces the socket file of a server that went away, but raises GypError if
+  a server is still listening on it.
+  """
+  if not hasattr(socket, 'AF_UNIX'):
+    raise GypError('gyp --server needs Unix domain sockets')
+  if os.path.exists(address):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      probe.connect(address)
+    except socket.error:
+      os.unlink(address)
+    else:
+      raise GypError('a gyp server is already listening on %s' % address)
+    finally:
+      probe.close()
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  # Clients get to run commands as this user, so keep other users out.  The
+  # socket file is created with these permissions, rather than changed to them
+  # after the fact, so that nobody can connect in between.
+  old_umask = os.umask(0077)
+  try:
+    listener.bind(address)
+  finally:
+    os.umask(old_umask)
+  listener.listen(5)
+  return listener
+
+
+def MakeImportPathsAbsolute():
+  """Makes sys.path and the paths of the modules imported so far absolute.
+
+  gyp_main.py adds pylib to sys.path relative to the working directory, which
+  the runs a server serves change.
+  """
+  sys.path[:] = [os.path.abspath(path) for path in sys.path]
+  for module in sys.modules.values():
+    if getattr(module, '__file__', None):
+      module.__file__ = os.path.abspath(module.__file__)
+    if getattr(module, '__path__', None):
+      module.__path__[:] = [os.path.abspath(path) for path in module.__path__]
+
+
+def ResetRunState():
+  """Drops the state of the previous run that may not hold for the next one.
+
+  The results of commands without declared inputs and the modules the
+  pymod_do_main hosts imported may be out of date, and so may resolved paths.
+  """
+  gyp.debug.clear()
+  for cache in gyp.resident_caches.itervalues():
+    cache.hits = cache.misses = 0
+  gyp.common.InvalidatePathCaches()
+  for key in gyp.common.realpath_cache_stats:
+    gyp.common.realpath_cache_stats[key] = 0
+  gyp.input.cached_command_results.clear()
+  gyp.input.prefetch_cache_misses.clear()
+  gyp.input.StopCommandPrefetcher()
+  if gyp.input.pymod_host:
+    gyp.input.pymod_host.Close()
+    gyp.input.pymod_host = None
+
+
+def RunRequest(cwd, argv, environment, args):
+  """Runs gyp_main with |args| as if it had been started in |cwd| with
+  |argv| and |environment|.
+
+  Returns the (exit status, stdout output, stderr output) of the run.
+  """
+  saved_cwd = os.getcwd()
+  saved_argv = sys.argv
+  saved_environment = dict(os.environ)
+  saved_stdout, saved_stderr = sys.stdout, sys.stderr
+  output = StringIO.StringIO()
+  errors = StringIO.StringIO()
+  global serving
+  try:
+    os.chdir(cwd)
+    sys.argv = argv
+    os.environ.clear()
+    os.environ.update(environment)
+    sys.stdout, sys.stderr = output, errors
+    serving = True
+    ResetRunState()
+    try:
+      status = gyp.main(args)
+    except SystemExit, e:
+      # optparse exits on bad arguments and --help.
+      status = e.code
+      if status is None:
+        status = 0
+      elif not isinstance(status, int):
+        errors.write('%s\n' % status)
+        status = 1
+    except Exception:
+      traceback.print_exc()
+      status = 1
+  finally:
+    serving = False
+    sys.stdout, sys.stderr = saved_stdout, saved_stderr
+    os.environ.clear()
+    os.environ.update(saved_environment)
+    sys.argv = saved_argv
+    os.chdir(saved_cwd)
+  return (status, output.getvalue(), errors.getvalue())
+
+
+def Serve(address, max_size=gyp.disk_cache.DEFAULT_MAX_SIZE):
+  """Serves gyp runs on the Unix domain socket |address|, one at a time.
+
+  Each of the caches kept between runs holds up to |max_size| bytes.
+  Returns gyp_main's exit status once interrupted, or once gyp's sources
+  changed.
+  """
+  # Runs change the working directory.
+  address = os.path.abspath(address)
+  MakeImportPathsAbsolute()
+  listener = Listen(address)
+  gyp_sources = [gyp.common.FileState(path)
+                 for path in gyp.common.GypSources()]
+  gyp.resident_caches = dict((name, gyp.disk_cache.MemoryCache(max_size))
+                             for name in gyp.CACHE_NAMES)
+  print 'gyp: serving on %s' % address
+  sys.stdout.flush()
+  try:
+    while True:
+      connection, client_address = listener.accept()
+      try:
+        request = _Receive(connection)
+        for file_state in gyp_sources:
+          if not gyp.common.FileStateIsCurrent(file_state):
+            # Have the client run its own, up to date, gyp.
+            _Send(connection, None)
+            print 'gyp: %s changed, exiting' % file_state[0]
+            return 0
+        _Send(connection, RunRequest(*request))
+      except (EOFError, socket.error):
+        # The client went away.
+        pass
+      finally:
+        connection.close()
+  except KeyboardInterrupt:
+    return 0
+  finally:
+    gyp.resident_caches = None
+    listener.close()
+    os.unlink(address)
+
+
+def RunOnServer(address, args):
+  """Runs gyp with |args| on the gyp --server listening on |address|.
+
+  Returns the exit status of the run, or None if there is no server to run
+  on, in which case the caller should run gyp itself.
+  """
+  if not hasattr(socket, 'AF_UNIX'):
+    return None
+  connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    try:
+      connection.connect(address)
+      _Send(connection, (os.getcwd(), sys.argv, dict(os.environ), list(args)))
+      reply = _Receive(connection)
+    except (EOFError, socket.error):
+      return None
+  finally:
+    connection.close()
+  if reply is None:
+    return None
+  status, output, errors = reply
+  sys.stdout.write(output)
+  sys.stderr.write(errors)
+  return status
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for the server.py file."""
+
+import gyp.server
+import os
+import shutil
+import signal
+import socket
+import stat
+import StringIO
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+GYP_MAIN = os.path.join(os.path.dirname(os.path.abspath(gyp.__file__)),
+                        os.path.pardir, os.path.pardir, 'gyp_main.py')
+
+
+class TestServer(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.address = os.path.join(self.directory, 'gyp.sock')
+    self.old_cwd = os.getcwd()
+    os.chdir(self.directory)
+    self._WriteBuildFile('a.cc')
+
+  def tearDown(self):
+    os.chdir(self.old_cwd)
+    shutil.rmtree(self.directory)
+
+  def _WriteBuildFile(self, source):
+    build_file = open('test.gyp', 'w')
+    build_file.write("{'targets': [{'target_name': 'test', 'type': 'none', "
+                     "'sources': ['%s']}]}" % source)
+    build_file.close()
+
+  def _Run(self):
+    """Returns the exit status and the output of a gyp run on the server."""
+    output = StringIO.StringIO()
+    old_stdout = sys.stdout
+    sys.stdout = output
+    try:
+      status = gyp.server.RunOnServer(
+          self.address, ['-f', 'gypd', '--depth=.', 'test.gyp',
+                         '--force-regenerate', '-d', 'general'])
+    finally:
+      sys.stdout = old_stdout
+    return status, output.getvalue()
+
+  def _Generated(self):
+    return open('test.gypd').read()
+
+  def test_NoServer(self):
+    self.assertEqual(None, self._Run()[0])
+
+  if hasattr(socket, 'AF_UNIX'):
+    def test_ListenPermissions(self):
+      # The socket file has to be private from the start, not just after a
+      # chmod.
+      old_umask = os.umask(0)
+      old_chmod = os.chmod
+      os.chmod = lambda path, mode: None
+      try:
+        listener = gyp.server.Listen(self.address)
+        listener.close()
+        self.assertEqual(0, os.umask(old_umask))
+      finally:
+        os.chmod = old_chmod
+        os.umask(old_umask)
+      self.assertEqual(0, stat.S_IMODE(os.stat(self.address).st_mode) & 0077)
+
+    def test_Serve(self):
+      server = subprocess.Popen(
+          [sys.executable, GYP_MAIN, '--server=' + self.address],
+          stdout=subprocess.PIPE)
+      try:
+        self.assertEqual('gyp: serving on %s\n' % self.address,
+                         server.stdout.readline())
+        status, output = self._Run()
+        self.assertEqual(0, status)
+        self.assertTrue('early phase cache: 0 hits, 1 misses' in output)
+        self.assertTrue("'a.cc'" in self._Generated())
+        # The warm run reuses the build file as it was after the early phase.
+        status, output = self._Run()
+        self.assertEqual(0, status)
+        self.assertTrue('early phase cache: 1 hits, 0 misses' in output)
+        self._WriteBuildFile('bb.cc')
+        self.assertEqual(0, self._Run()[0])
+        self.assertTrue("'bb.cc'" in self._Generated())
+      finally:
+        server.send_signal(signal.SIGINT)
+        server.wait()
+      self.assertFalse(os.path.exists(self.address))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,209 @@
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Collects the phase timings and counters that gyp --stats=FILE reports.
+
+gyp_main, gyp.input and the generator processes mark the phases of a run
+with Phase(), or with Enter() and Leave().  Phases nest, and each one is
+charged only for the time spent outside of the phases nested in it, so the
+phase times of a serial run add up to nearly all of its time.  Phases that run
+in --parallel worker processes are charged there and sent back to the main
+process with their results, so their times add up the work of all the
+workers, while the main process charges its wait for them to the phase that
+started the workers.
+
+Counters are kept whether or not phases are timed, since incrementing one
+costs about as much as checking whether to.
+
+The report is a JSON object:
+
+  {"wall_seconds": ..., "cpu_seconds": ..., "child_cpu_seconds": ...,
+   "peak_rss_kb": ..., "child_peak_rss_kb": ...,
+   "phases": [{"name": ..., "calls": ..., "wall_seconds": ...,
+               "cpu_seconds": ..., "peak_rss_kb": ...}, ...],
+   "counters": {name: count, ...}}
+
+Phases are listed in the order they were first entered.  Peak resident set
+sizes are high-water marks, in KB, and are null where the platform doesn't
+report them.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+  import resource
+except ImportError:
+  # Windows.  Peak memory use isn't reported there.
+  resource = None
+
+
+# Whether phases are being timed.
+enabled = False
+
+# Maps the name of each phase to its [calls, wall seconds, CPU seconds, peak
+# RSS in KB], in the order the phases were first entered.
+phases = collections.OrderedDict()
+
+# Maps the name of each counter, such as the calls of a hot function, to its
+# count.
+counts = collections.defaultdict(int)
+
+# The names of the phases entered but not yet left, innermost last.
+stack = []
+
+# The (wall, CPU) times at which the run started, and at which the innermost
+# phase was last charged.
+start_times = None
+last_times = None
+
+# The CPU time of the child processes waited for before the run started.
+start_child_cpu = None
+
+
+def _Times():
+  times = os.times()
+  return (time.time(), times[0] + times[1])
+
+
+def _ChildCpu():
+  times = os.times()
+  return times[2] + times[3]
+
+
+def _PeakRss(who):
+  """Returns the peak resident set size of |who| in KB, or None."""
+  if not resource:
+    return None
+  peak = resource.getrusage(who).ru_maxrss
+  if sys.platform == 'darwin':
+    # Darwin reports bytes.
+    peak /= 1024
+  return peak
+
+
+def Reset():
+  """Forgets the phases and counters recorded so far."""
+  global last_times
+  phases.clear()
+  counts.clear()
+  del stack[:]
+  last_times = _Times()
+
+
+def Start(enable):
+  """Starts the statistics of a run, timing its phases if |enable|."""
+  global enabled, start_times, start_child_cpu
+  enabled = enable
+  Reset()
+  start_times = last_times
+  start_child_cpu = _ChildCpu()
+
+
+def _Charge():
+  """Charges the time since it was last charged to the innermost phase."""
+  global last_times
+  now = _Times()
+  if stack:
+    phase = phases[stack[-1]]
+    phase[1] += now[0] - last_times[0]
+    phase[2] += now[1] - last_times[1]
+  last_times = now
+
+
+def Enter(name):
+  """Starts timing the phase |name|, pausing the phase it's nested in."""
+  if not enabled:
+    return
+  _Charge()
+  phase = phases.get(name)
+  if phase is None:
+    phase = phases[name] = [0, 0.0, 0.0, None]
+  phase[0] += 1
+  stack.append(name)
+
+
+def Leave():
+  """Stops timing the phase entered last, resuming the one it's nested in."""
+  if not enabled:
+    return
+  _Charge()
+  phase = phases[stack.pop()]
+  phase[3] = max(phase[3], _PeakRss(resource and resource.RUSAGE_SELF))
+
+
+@contextlib.contextmanager
+def Phase(name):
+  """Times the phase |name| for the duration of a with statement.
+
+  The phase is left even if the statement raises, so that the phases entered
+  later, say in the next run of gyp --server, are charged correctly.
+  """
+  Enter(name)
+  try:
+    yield
+  finally:
+    Leave()
+
+
+def Take():
+  """Returns the phases and counters recorded so far, and forgets them.
+
+  Worker processes send the result to the main process, which adds it to
+  its own with Merge.
+  """
+  taken = (phases.items(), dict(counts))
+  Reset()
+  return taken
+
+
+def Merge(taken):
+  """Adds the phases and counters another process Took to this process's."""
+  worker_phases, worker_counts = taken
+  for name, (calls, wall, cpu, peak_rss) in worker_phases:
+    phase = phases.get(name)
+    if phase is None:
+      phase = phases[name] = [0, 0.0, 0.0, None]
+    phase[0] += calls
+    phase[1] += wall
+    phase[2] += cpu
+    phase[3] = max(phase[3], peak_rss)
+  for name, count in worker_counts.iteritems():
+    counts[name] += count
+
+
+def Report():
+  """Returns the report of the run, as a JSON-serializable dict."""
+  now = _Times()
+  report = collections.OrderedDict()
+  report['wall_seconds'] = now[0] - start_times[0]
+  report['cpu_seconds'] = now[1] - start_times[1]
+  report['child_cpu_seconds'] = _ChildCpu() - start_child_cpu
+  report['peak_rss_kb'] = _PeakRss(resource and resource.RUSAGE_SELF)
+  report['child_peak_rss_kb'] = _PeakRss(resource and resource.RUSAGE_CHILDREN)
+  report['phases'] = []
+  for name, (calls, wall, cpu, peak_rss) in phases.iteritems():
+    phase = collections.OrderedDict()
+    phase['name'] = name
+    phase['calls'] = calls
+    phase['wall_seconds'] = wall
+    phase['cpu_seconds'] = cpu
+    phase['peak_rss_kb'] = peak_rss
+    report['phases'].append(phase)
+  report['counters'] = collections.OrderedDict(sorted(counts.iteritems()))
+  return report
+
+
+def WriteReport(path):
+  """Writes the JSON report of the run to |path|."""
+  report_file = open(path, 'w')
+  try:
+    json.dump(Report(), report_file, indent=2)
+    report_file.write('\n')
+  finally:
+    report_file.close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for the stats.py file."""
+
+from __future__ import with_statement
+
+import gyp.stats
+import json
+import marshal
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestStats(unittest.TestCase):
+  def setUp(self):
+    self.now = [0.0, 0.0]
+    self.old_times = gyp.stats._Times
+    gyp.stats._Times = lambda: tuple(self.now)
+    gyp.stats.Start(True)
+
+  def tearDown(self):
+    gyp.stats._Times = self.old_times
+    gyp.stats.Start(False)
+
+  def _Pass(self, wall, cpu):
+    self.now[0] += wall
+    self.now[1] += cpu
+
+  def _Phase(self, name):
+    calls, wall, cpu, peak_rss = gyp.stats.phases[name]
+    return (calls, wall, cpu)
+
+  def test_Nesting(self):
+    gyp.stats.Enter('load')
+    self._Pass(1, 1)
+    gyp.stats.Enter('parse')
+    self._Pass(2, 1)
+    gyp.stats.Leave()
+    gyp.stats.Enter('parse')
+    self._Pass(4, 4)
+    gyp.stats.Leave()
+    self._Pass(8, 8)
+    gyp.stats.Leave()
+    # Time outside of any phase isn't charged.
+    self._Pass(16, 16)
+    self.assertEqual(['load', 'parse'], gyp.stats.phases.keys())
+    self.assertEqual((1, 9, 9), self._Phase('load'))
+    self.assertEqual((2, 6, 5), self._Phase('parse'))
+
+  def test_PhaseRaises(self):
+    def Fail():
+      with gyp.stats.Phase('load'):
+        self._Pass(1, 1)
+        raise ValueError()
+    self.assertRaises(ValueError, Fail)
+    self.assertEqual([], gyp.stats.stack)
+    # Time after the error isn't charged to the phase it left.
+    self._Pass(2, 2)
+    with gyp.stats.Phase('generate'):
+      self._Pass(4, 4)
+    self.assertEqual((1, 1, 1), self._Phase('load'))
+    self.assertEqual((1, 4, 4), self._Phase('generate'))
+
+  def test_Disabled(self):
+    gyp.stats.Start(False)
+    gyp.stats.Enter('load')
+    gyp.stats.Leave()
+    gyp.stats.counts['calls'] += 1
+    self.assertEqual({}, dict(gyp.stats.phases))
+    self.assertEqual({'calls': 1}, dict(gyp.stats.counts))
+
+  def test_Merge(self):
+    gyp.stats.Enter('late phase')
+    self._Pass(1, 1)
+    gyp.stats.Leave()
+    gyp.stats.counts['calls'] += 2
+    # What a worker sends back survives marshal.
+    taken = marshal.loads(marshal.dumps(gyp.stats.Take()))
+    self.assertEqual({}, dict(gyp.stats.counts))
+    gyp.stats.Enter('late phase')
+    self._Pass(2, 2)
+    gyp.stats.Leave()
+    gyp.stats.counts['calls'] += 1
+    gyp.stats.Merge(taken)
+    self.assertEqual((2, 3, 3), self._Phase('late phase'))
+    self.assertEqual({'calls': 3}, dict(gyp.stats.counts))
+
+  def test_WriteReport(self):
+    gyp.stats.Enter('generate make')
+    self._Pass(3, 2)
+    gyp.stats.Leave()
+    gyp.stats.counts['ExpandVariables calls'] += 5
+    directory = tempfile.mkdtemp()
+    try:
+      path = os.path.join(directory, 'stats.json')
+      gyp.stats.WriteReport(path)
+      report = json.load(open(path))
+    finally:
+      shutil.rmtree(directory)
+    self.assertEqual(3, report['wall_seconds'])
+    self.assertEqual(2, report['cpu_seconds'])
+    self.assertEqual(['generate make'],
+                     [phase['name'] for phase in report['phases']])
+    self.assertEqual(1, report['phases'][0]['calls'])
+    self.assertEqual(3, report['phases'][0]['wall_seconds'])
+    self.assertEqual({'ExpandVariables calls': 5}, report['counters'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -25,12 +25,18 @@ sys.path.append(os.path.join(test._cwd, 'pylib'))
 # Add new test suites here.
 files_to_test = [
     'pylib/gyp/MSVSSettings_test.py',
+    'pylib/gyp/disk_cache_test.py',
     'pylib/gyp/easy_xml_test.py',
     'pylib/gyp/generator/msvs_test.py',
     'pylib/gyp/generator/ninja_test.py',
     'pylib/gyp/generator/xcode_test.py',
     'pylib/gyp/common_test.py',
     'pylib/gyp/input_test.py',
+    'pylib/gyp/literal_parser_test.py',
+    'pylib/gyp/pymod_host_test.py',
+    'pylib/gyp/regeneration_test.py',
+    'pylib/gyp/server_test.py',
+    'pylib/gyp/stats_test.py',
 ]
 
 # Collect all the suites from the above files.
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013 Google Inc. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Micro-benchmarks for the hot spots of gyp's input processing.
+
+Usage: benchmark_input.py [benchmark ...]
+
+Runs every benchmark when none are named.  Inputs are synthetic, but sized
+after a large Chromium checkout.
+"""
+
+import copy
+import cPickle
+import marshal
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.path.pardir, 'pylib'))
+
+import gyp.input
+import gyp.literal_parser
+
+
+def Time(label, function, repeat=3):
+  """Runs |function| |repeat| times and prints the best wall time."""
+  best = None
+  for i in xrange(repeat):
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  print '  %-40s %8.1f ms' % (label, best * 1000)
+  return best
+
+
+def SyntheticBuildFile(targets):
+  """Returns the text of a .gyp file with |targets| typical targets."""
+  lines = ["# A synthetic build file.", "{", "  'variables': {"]
+  for index in xrange(200):
+    lines.append("    'variable_%d%%': 'value_%d',  # A comment." % (index, index))
+  lines += ["  },", "  'targets': ["]
+  for target in xrange(targets):
+    lines += [
+        "    {",
+        "      'target_name': 'target_%d'," % target,
+        "      'type': 'static_library',",
+        "      'dependencies': [",
+        "        '../base/base.gyp:base',",
+        "        'other.gyp:other_%d'," % target,
+        "      ],",
+        "      'include_dirs': ['<(DEPTH)', '<(SHARED_INTERMEDIATE_DIR)'],",
+        "      'defines': ['TARGET_%d=1', \"QUOTED=\\\"x\\\"\"]," % target,
+        "      'sources': [",
+    ]
+    for source in xrange(40):
+      lines.append("        'src/dir_%d/file_%d.cc'," % (target, source))
+    lines += [
+        "      ],",
+        "      'conditions': [",
+        "        ['OS==\"win\"', {",
+        "          'sources!': ['src/dir_%d/file_0.cc']," % target,
+        "          'msvs_settings': {'VCCLCompilerTool': {'WarningLevel': 4}},",
+        "        }, {",
+        "          'cflags': ['-Wall', '-Wextra', '-O2'],",
+        "        }],",
+        "      ],",
+        "    },",
+    ]
+  lines += ["  ],", "}"]
+  return '\n'.join(lines) + '\n'
+
+
+def LegacyCheckedEval(file_contents):
+  """The compiler.parse based CheckedEval that gyp used to ship."""
+  import compiler
+  from compiler.ast import Const, Dict, Discard, List, Module, Stmt
+
+  def CheckNode(node, keypath):
+    if isinstance(node, Dict):
+      c = node.getChildren()
+      result = {}
+      for n in range(0, len(c), 2):
+        key = c[n].getChildren()[0]
+        if key in result:
+          raise Exception('Key repeated')
+        result[key] = CheckNode(c[n + 1], keypath + [key])
+      return result
+    elif isinstance(node, List):
+      return [CheckNode(child, keypath + [repr(index)])
+              for index, child in enumerate(node.getChildren())]
+    elif isinstance(node, Const):
+      return node.getChildren()[0]
+    raise TypeError('Unknown AST node ' + repr(node))
+
+  ast = compiler.parse(file_contents)
+  assert isinstance(ast, Module)
+  statement = ast.getChildren()[1].getChildren()[0]
+  assert isinstance(statement, Discard)
+  return CheckNode(statement.getChildren()[0], [])
+
+
+def BenchmarkParse():
+  print 'Parsing a build file:'
+  for targets in (100, 1000):
+    text = SyntheticBuildFile(targets)
+    print ' %d targets, %d KB' % (targets, len(text) / 1024)
+    expected = eval(text, {'__builtins__': None}, None)
+    assert gyp.literal_parser.ParseLiteral(text) == expected
+    Time('eval', lambda: eval(text, {'__builtins__': None}, None))
+    Time('gyp.literal_parser.ParseLiteral',
+         lambda: gyp.literal_parser.ParseLiteral(text))
+    try:
+      import compiler
+    except ImportError:
+      print '  (compiler module unavailable, skipping the legacy parser)'
+    else:
+      Time('legacy compiler.parse CheckedEval',
+           lambda: LegacyCheckedEval(text), repeat=1)
+
+
+def BenchmarkInclude():
+  print 'Merging a common include into many build files:'
+  include = gyp.literal_parser.ParseLiteral(SyntheticBuildFile(20))
+  del include['targets']
+  include['target_defaults'] = copy.deepcopy(include)
+  includers = ['dir%d/foo.gyp' % index for index in xrange(500)]
+
+  def Merge(merge_function):
+    gyp.input.include_snapshots.clear()
+    for includer in includers:
+      merge_function({'variables': {'variable_1%': 'x'}}, include, includer,
+                     'build/common.gypi')
+  Time('MergeDicts', lambda: Merge(gyp.input.MergeDicts))
+  Time('MergeIncludedDict', lambda: Merge(gyp.input.MergeIncludedDict))
+
+
+def BenchmarkTransport():
+  print 'Sending a loaded build file from a parallel loader worker:'
+  data = gyp.literal_parser.ParseLiteral(SyntheticBuildFile(200))
+  pickled = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+  marshalled = marshal.dumps(gyp.input.InternStrings(data), 2)
+  print '  pickle: %d KB, interned marshal: %d KB' % (len(pickled) / 1024,
+                                                      len(marshalled) / 1024)
+  Time('pickle encoding (worker)',
+       lambda: cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL))
+  Time('interned marshal encoding (worker)',
+       lambda: marshal.dumps(gyp.input.InternStrings(data), 2))
+  Time('pickle decoding (main process)', lambda: cPickle.loads(pickled))
+  Time('marshal decoding (main process)', lambda: marshal.loads(marshalled))
+
+
+def ChromiumSizedVariables():
+  """Returns a variables dict and strings to expand, sized like Chromium's."""
+  variables = {'DEPTH': '../..', 'OS': 'linux', 'target_arch': 'x64'}
+  for index in xrange(1500):
+    variables['flag_%d' % index] = index % 2
+    variables['dir_%d' % index] = 'third_party/lib_%d' % index
+    variables['name_%d' % index] = 'lib_%d' % index
+  for index in xrange(100):
+    variables['list_%d' % index] = ['-DLIST_%d_%d' % (index, item)
+                                    for item in xrange(10)]
+  strings = []
+  for index in xrange(1500):
+    strings += [
+      '<(DEPTH)/<(dir_%d)/src/file_%d.cc' % (index, index),
+      '<(DEPTH)/<(dir_%d)/include' % index,
+      '<(name_%d)' % index,
+      'ENABLE_FEATURE_%d=<(flag_%d)' % (index, index),
+      '<(SHARED_INTERMEDIATE_DIR)/<(name_%d)/gen.h' % index,
+      '<(PRODUCT_DIR)/<(<(name_%d)_suffix)' % index,
+    ]
+    variables['lib_%d_suffix' % index] = '.so'
+  for index in xrange(100):
+    strings.append('<@(list_%d)' % index)
+  variables['SHARED_INTERMEDIATE_DIR'] = '$(obj)/gen'
+  variables['PRODUCT_DIR'] = '$(builddir)'
+  return variables, strings
+
+
+def BenchmarkExpand():
+  print 'Expanding variable references:'
+  variables, strings = ChromiumSizedVariables()
+  print '  %d variables, %d distinct strings, each expanded 20 times' % (
+      len(variables), len(strings))
+
+  def Expand():
+    for i in xrange(20):
+      for string in strings:
+        gyp.input.ExpandVariables(string, gyp.input.PHASE_EARLY, variables,
+                                  'foo/foo.gyp')
+
+  cache_size = gyp.input.expansion_template_cache_size
+  try:
+    gyp.input.expansion_template_cache_size = 0
+    Time('without expansion templates', Expand)
+  finally:
+    gyp.input.expansion_template_cache_size = cache_size
+  Time('with expansion templates', Expand)
+
+
+def BenchmarkConditions():
+  print 'Evaluating conditions:'
+  variables, strings = ChromiumSizedVariables()
+  conditions = ['OS=="linux"', 'OS=="win" and target_arch=="ia32"',
+                'OS!="mac" and OS!="ios"', 'OS in ("linux", "android")',
+                'flag_1==1 or (flag_2==0 and not flag_3)']
+  conditions += ['flag_%d==1' % index for index in xrange(100)]
+  repeat = 200
+  print '  %d distinct conditions, each evaluated %d times' % (
+      len(conditions), repeat)
+
+  def CompileAndEval():
+    for i in xrange(repeat):
+      for condition in conditions:
+        eval(compile(condition, '<string>', 'eval'), {'__builtins__': None},
+             variables)
+
+  def EvalCondition():
+    gyp.input.cached_conditions_asts.clear()
+    gyp.input.cached_condition_results.clear()
+    for i in xrange(repeat):
+      for condition in conditions:
+        gyp.input.EvalCondition(condition, variables)
+  Time('compile and eval', CompileAndEval)
+  Time('gyp.input.EvalCondition', EvalCondition)
+
+
+def BenchmarkScopes():
+  print 'Processing variables and conditions in a build file:'
+  variables, strings = ChromiumSizedVariables()
+  text = SyntheticBuildFile(200)
+  print '  %d variables in scope, %d KB build file' % (len(variables),
+                                                      len(text) / 1024)
+
+  def Process():
+    build_file_data = gyp.literal_parser.ParseLiteral(text)
+    gyp.input.ProcessVariablesAndConditionsInDict(
+        build_file_data, gyp.input.PHASE_EARLY, variables, 'foo/foo.gyp')
+
+  variable_scope = gyp.input.VariableScope
+  try:
+    # This is how variables were copied before VariableScope.
+    gyp.input.VariableScope = lambda parent: parent.copy()
+    Time('copying variable dicts', Process)
+  finally:
+    gyp.input.VariableScope = variable_scope
+  Time('with VariableScope', Process)
+
+
+def BenchmarkMerge():
+  print 'Merging large lists:'
+  size = 10000
+  sources = ['src/file_%d.cc' % index for index in xrange(size)]
+  defines = ['DEFINE_%d=1' % index for index in xrange(size)]
+  # Half of the merged items are already in the target lists.
+  more_sources = sources[size / 2:] + ['gen/file_%d.cc' % index
+                                       for index in xrange(size / 2)]
+  more_defines = defines[size / 2:] + ['-DFLAG_%d' % index
+                                       for index in xrange(size / 2)]
+  print '  %d item lists, half of the merged items already present' % size
+
+  def Merge(suffix):
+    to = {'sources': sources[:], 'defines': defines[:]}
+    fro = {'sources' + suffix: more_sources, 'defines' + suffix: more_defines}
+    gyp.input.MergeDicts(to, fro, 'foo/foo.gyp', 'foo/foo.gyp')
+
+  def PrependOneAtATime():
+    for to, fro in ((sources[:], more_sources), (defines[:], more_defines)):
+      gyp.input.PrependToList(
+          to, [(item, not item.startswith('-')) for item in fro])
+  Time('append', lambda: Merge(''))
+  Time('prepend (+)', lambda: Merge('+'))
+  Time('prepend, one item at a time', PrependOneAtATime, repeat=1)
+  Time('replace (=)', lambda: Merge('='))
+
+
+BENCHMARKS = {
+  'conditions': BenchmarkConditions,
+  'expand': BenchmarkExpand,
+  'include': BenchmarkInclude,
+  'merge': BenchmarkMerge,
+  'parse': BenchmarkParse,
+  'scopes': BenchmarkScopes,
+  'transport': BenchmarkTransport,
+}
+
+
+def main(args):
+  names = args or sorted(BENCHMARKS)
+  for name in names:
+    if name not in BENCHMARKS:
+      print >>sys.stderr, 'Unknown benchmark %s; choose from %s' % (
+          name, ', '.join(sorted(BENCHMARKS)))
+      return 1
+  for name in names:
+    BENCHMARKS[name]()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))